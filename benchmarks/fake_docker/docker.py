@@ -0,0 +1,26 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Stand-in for docker-py used by the benchmarks
+
+Put this directory and the repository root at the front of PYTHONPATH and
+`import docker` finds this module instead. The client is the one the tests
+use, from blockade.tests.fake_docker.
+"""
+
+from blockade.tests.fake_docker import APIError, Client
+
+__all__ = ['APIError', 'Client']
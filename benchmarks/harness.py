@@ -0,0 +1,131 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Shared setup for the benchmarks
+
+Benchmarks run blockade against a fake docker module and stub versions of
+the network tools, so they need neither Docker nor root.
+"""
+
+import os
+import stat
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_DOCKER_DIR = os.path.join(REPO_ROOT, "benchmarks", "fake_docker")
+
+timer = getattr(time, "perf_counter", time.time)
+
+# each stub tool prints what the real tool would for an empty firewall
+# and no qdiscs, and reads the script when one is given on stdin
+_STUB_TOOLS = {
+    "iptables": """
+while [ $# -gt 0 ]; do
+    if [ "$1" = "-L" ]; then
+        echo "Chain $2 (policy ACCEPT)"
+        echo "target     prot opt source               destination"
+    fi
+    shift
+done
+""",
+    "iptables-save": """
+echo "*filter"
+echo ":INPUT ACCEPT [0:0]"
+echo ":FORWARD ACCEPT [0:0]"
+echo ":OUTPUT ACCEPT [0:0]"
+echo "COMMIT"
+""",
+    "iptables-restore": "cat > /dev/null\n",
+    "ipset": """
+case " $* " in *" restore "*) cat > /dev/null ;; esac
+""",
+    "nft": """
+case " $* " in *" -f "*) cat > /dev/null ;; esac
+""",
+    "tc": """
+case " $* " in *" -batch "*) cat > /dev/null ;; esac
+""",
+}
+
+
+# with BLOCKADE_BENCH_CALLS set, each stub tool appends its name to that file
+_LOG_CALL = ('[ -n "$BLOCKADE_BENCH_CALLS" ] && '
+             'echo %s >> "$BLOCKADE_BENCH_CALLS"\n')
+
+
+def write_stub_tools(bin_dir):
+    """Write stand-ins for iptables, tc and friends into bin_dir
+    """
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    for tool, script in _STUB_TOOLS.items():
+        path = os.path.join(bin_dir, tool)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n")
+            f.write(_LOG_CALL % (tool,))
+            f.write(script.lstrip("\n") + "exit 0\n")
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+                 stat.S_IXOTH)
+
+
+def benchmark_env(workdir, bin_dir):
+    """Environment for running blockade against the fakes
+    """
+    env = dict(os.environ)
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    pythonpath = [FAKE_DOCKER_DIR, REPO_ROOT]
+    if env.get('PYTHONPATH'):
+        pythonpath.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(pythonpath)
+    env['FAKE_DOCKER_STATE'] = os.path.join(workdir, ".fake-docker.json")
+    return env
+
+
+def write_config(path, count):
+    """Write a blockade.yaml with count containers, each linked to the
+    one before it
+    """
+    with open(path, "w") as f:
+        f.write("containers:\n")
+        for i in range(1, count + 1):
+            f.write("  c%d:\n" % (i,))
+            f.write("    image: ubuntu\n")
+            f.write("    command: /bin/sleep 300000\n")
+            if i > 1:
+                f.write("    links: ['c%d']\n" % (i - 1,))
+
+
+def read_calls(path):
+    """Count the stub tool runs logged to path, by tool, and clear the log
+    """
+    counts = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                tool = line.strip()
+                counts[tool] = counts.get(tool, 0) + 1
+    except IOError:
+        pass
+    open(path, "w").close()
+    return counts
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
@@ -0,0 +1,161 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Measure how long each blockade operation takes as the blockade grows
+
+Operations run in this interpreter against the fake docker module, holding
+its containers in memory, with stub iptables, tc, ipset and nft on PATH:
+
+    python benchmarks/operations.py [--containers 3,30,300,3000] [--runs N]
+                                    [--firewall iptables] [--json]
+
+For each operation and blockade size, reports the time taken, how many
+network tool processes it started and how many Docker API calls it made.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from harness import FAKE_DOCKER_DIR, REPO_ROOT, median, read_calls, timer, \
+    write_stub_tools
+
+os.environ["FAKE_DOCKER_STATE"] = ":memory:"
+sys.path[:0] = [FAKE_DOCKER_DIR, REPO_ROOT]
+
+import docker
+
+from blockade.config import BlockadeConfig
+from blockade.core import Blockade
+from blockade.net import BlockadeNetwork
+from blockade.state import BlockadeStateFactory
+
+
+def _operations(b, names):
+    half = len(names) // 2 or 1
+    return (
+        ("up", b.create),
+        ("status", b.status),
+        ("partition", lambda: b.partition([names[:half]])),
+        # moves one container to the other side
+        ("repartition", lambda: b.partition([names[:half + 1]])),
+        ("join", b.join),
+        ("flaky", lambda: b.flaky(include_all=True)),
+        ("slow", lambda: b.slow(include_all=True)),
+        ("fast", lambda: b.fast(include_all=True)),
+        ("destroy", b.destroy),
+    )
+
+
+def run_once(count, firewall, workdir, calls_path):
+    """Run every operation once against a new blockade of count containers
+
+    Returns (operation, seconds, tool runs, docker calls) in order.
+    """
+    config = BlockadeConfig.from_dict({
+        "containers": {"c": {"image": "ubuntu", "count": count}},
+        "network": {"firewall": firewall}})
+    client = docker.Client()
+    b = Blockade(config, BlockadeStateFactory(), BlockadeNetwork(config),
+                 client)
+    names = [c.name for c in config.sorted_containers]
+
+    results = []
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for label, operation in _operations(b, names):
+            read_calls(calls_path)
+            client.take_calls()
+            start = timer()
+            operation()
+            elapsed = timer() - start
+            results.append((label, elapsed, read_calls(calls_path),
+                            client.take_calls()))
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def run(runs, counts, firewall="iptables"):
+    tempdir = tempfile.mkdtemp(prefix="blockade-bench-")
+    try:
+        bin_dir = os.path.join(tempdir, "bin")
+        write_stub_tools(bin_dir)
+        calls_path = os.path.join(tempdir, "calls")
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+        os.environ["BLOCKADE_BENCH_CALLS"] = calls_path
+
+        results = []
+        for count in counts:
+            times = {}
+            for index in range(runs):
+                workdir = os.path.join(tempdir, "work-%d-%d" % (count, index))
+                os.makedirs(workdir)
+                for label, elapsed, tools, docker_calls in run_once(
+                        count, firewall, workdir, calls_path):
+                    times.setdefault(label, []).append(elapsed)
+                    # counts are the same on every run
+                    if index == 0:
+                        results.append(dict(
+                            operation=label, containers=count,
+                            processes=sum(tools.values()),
+                            process_counts=tools,
+                            docker_calls=sum(docker_calls.values()),
+                            docker_call_counts=docker_calls))
+            for r in results:
+                if r['containers'] == count:
+                    r['min_ms'] = round(min(times[r['operation']]) * 1000, 1)
+                    r['median_ms'] = round(
+                        median(times[r['operation']]) * 1000, 1)
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Times to run each operation")
+    parser.add_argument("--containers", default="3,30,300,3000",
+                        help="Comma-separated blockade sizes")
+    parser.add_argument("--firewall", default="iptables",
+                        choices=("iptables", "ipset", "nftables"),
+                        help="Firewall backend to partition with")
+    parser.add_argument("--json", action="store_true",
+                        help="Output in JSON format")
+    opts = parser.parse_args()
+
+    counts = [int(c) for c in opts.containers.split(",")]
+    results = run(opts.runs, counts, opts.firewall)
+    if opts.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("%-12s %10s %10s %10s %10s %12s" % (
+            "OPERATION", "CONTAINERS", "MIN MS", "MEDIAN MS", "PROCESSES",
+            "DOCKER CALLS"))
+        for r in results:
+            print("%-12s %10d %10.1f %10.1f %10d %12d" % (
+                r['operation'], r['containers'], r['min_ms'],
+                r['median_ms'], r['processes'], r['docker_calls']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Measure cold-start time of each blockade subcommand
+
+Every command runs in a fresh interpreter, against the fake docker module
+and stub network tools, so the time is what a script pays per call:
+
+    python benchmarks/startup.py [--runs N] [--json] [--max-ms MS]
+
+Alongside the time, each command reports which of the slow-to-import
+modules it loaded. With --max-ms, exits non-zero if any command's median
+time is over the limit.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from harness import benchmark_env, median, timer, write_config, \
+    write_stub_tools
+
+# modules which are slow to import and should only be loaded by the
+# commands which need them
+HEAVY_MODULES = ("docker", "yaml", "clint", "multiprocessing.pool",
+                 "socketserver")
+
+# (label, arguments, needs a blockade.yaml) in the order they run
+COMMANDS = (
+    ("help", ["--help"], False),
+    ("bad-config", ["status"], False),
+    ("up", ["up"], True),
+    ("status", ["status"], True),
+    ("flaky", ["flaky", "--all"], True),
+    ("slow", ["slow", "--all"], True),
+    ("fast", ["fast", "--all"], True),
+    ("partition", ["partition", "c1"], True),
+    ("join", ["join"], True),
+    ("logs", ["logs", "c1"], True),
+    ("destroy", ["destroy"], True),
+)
+
+_CHILD = """
+import atexit, json, os, sys
+
+def report():
+    with open(os.environ['BLOCKADE_BENCH_MODULES'], 'w') as f:
+        json.dump([m for m in %r if m in sys.modules], f)
+atexit.register(report)
+
+sys.argv[0] = 'blockade'
+import blockade.cli
+blockade.cli.main(sys.argv[1:])
+""" % (HEAVY_MODULES,)
+
+
+def run_command(args, cwd, env):
+    """Run blockade in a new interpreter
+
+    Returns (seconds, exit code, modules loaded).
+    """
+    modules_path = os.path.join(cwd, ".bench-modules.json")
+    env = dict(env, BLOCKADE_BENCH_MODULES=modules_path)
+    with open(os.devnull, "w") as devnull:
+        start = timer()
+        cmd = [sys.executable, "-c", _CHILD, "--no-daemon"] + args
+        rc = subprocess.call(cmd, cwd=cwd, env=env, stdin=devnull,
+                             stdout=devnull, stderr=devnull)
+        elapsed = timer() - start
+    with open(modules_path) as f:
+        modules = json.load(f)
+    os.unlink(modules_path)
+    return elapsed, rc, modules
+
+
+def run(runs, containers):
+    tempdir = tempfile.mkdtemp(prefix="blockade-bench-")
+    try:
+        bin_dir = os.path.join(tempdir, "bin")
+        workdir = os.path.join(tempdir, "work")
+        emptydir = os.path.join(tempdir, "empty")
+        os.makedirs(workdir)
+        os.makedirs(emptydir)
+        write_stub_tools(bin_dir)
+        write_config(os.path.join(workdir, "blockade.yaml"), containers)
+        env = benchmark_env(workdir, bin_dir)
+
+        times = dict((label, []) for label, _, _ in COMMANDS)
+        modules = {}
+        rcs = {}
+        for _ in range(runs):
+            for label, args, needs_config in COMMANDS:
+                cwd = workdir if needs_config else emptydir
+                elapsed, rc, loaded = run_command(args, cwd, env)
+                times[label].append(elapsed)
+                modules[label] = loaded
+                rcs[label] = rc
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    results = []
+    for label, _, _ in COMMANDS:
+        results.append(dict(command=label,
+                            min_ms=round(min(times[label]) * 1000, 1),
+                            median_ms=round(median(times[label]) * 1000, 1),
+                            modules=modules[label], rc=rcs[label]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Times to run each command")
+    parser.add_argument("--containers", type=int, default=3,
+                        help="Containers in the benchmark blockade")
+    parser.add_argument("--json", action="store_true",
+                        help="Output in JSON format")
+    parser.add_argument("--max-ms", type=float,
+                        help="Fail if any median time is over this")
+    opts = parser.parse_args()
+
+    results = run(opts.runs, opts.containers)
+    if opts.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("%-12s %10s %10s %4s  %s" % ("COMMAND", "MIN MS", "MEDIAN MS",
+                                           "RC", "HEAVY MODULES"))
+        for r in results:
+            print("%-12s %10.1f %10.1f %4d  %s" % (
+                r['command'], r['min_ms'], r['median_ms'], r['rc'],
+                ", ".join(r['modules'])))
+
+    if opts.max_ms:
+        slow = [r['command'] for r in results if r['median_ms'] > opts.max_ms]
+        if slow:
+            sys.stderr.write("Over %sms: %s\n" % (opts.max_ms,
+                                                  ", ".join(slow)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Measure config parsing, dependency sorting and selection for large blockades
+
+Builds a config of replicated containers (a few db nodes, and cache and app
+groups linking to them), and a chain of containers each linking to the
+last, and times each step in this interpreter:
+
+    python benchmarks/topology.py [--containers 1000,5000] [--runs N] [--json]
+"""
+
+import argparse
+import json
+import sys
+
+from harness import REPO_ROOT, median, timer
+
+sys.path.insert(0, REPO_ROOT)
+
+from blockade.config import BlockadeConfig, BlockadeContainerConfig, \
+    dependency_levels
+
+
+def topology(count):
+    """A config dict for count containers in three replicated groups
+    """
+    caches = max(1, count // 4)
+    return {"containers": {
+        "db": {"image": "db", "count": 5,
+               "environment": {"NODE_ID": "{index}", "PEERS": "{count}"}},
+        "cache": {"image": "cache", "count": caches, "links": ["db"]},
+        "app": {"image": "app", "count": max(1, count - caches - 5),
+                "links": {"db": "database"},
+                "environment": {"NAME": "{name}"}},
+    }}
+
+
+def chain(count):
+    """count containers each linking to the one before, the deepest graph
+    """
+    containers = [BlockadeContainerConfig("c0", "image")]
+    for index in range(1, count):
+        containers.append(BlockadeContainerConfig(
+            "c%d" % index, "image", links=["c%d" % (index - 1)]))
+    return containers
+
+
+def _steps(count):
+    d = topology(count)
+    config = BlockadeConfig.from_dict(d)
+    linked = chain(count)
+    return (
+        ("parse", lambda: BlockadeConfig.from_dict(d)),
+        ("dependency-levels", lambda: dependency_levels(config.containers)),
+        ("dependency-chain", lambda: dependency_levels(linked)),
+        ("select-glob", lambda: config.select(["app-1*"])),
+        ("select-group", lambda: config.select(["group:cache"])),
+        ("select-partitions", lambda: config.select_many(
+            [["group:db"], ["app-*"], ["cache-1", "cache-2"]])),
+    )
+
+
+def run(runs, counts):
+    results = []
+    for count in counts:
+        for label, step in _steps(count):
+            times = []
+            for _ in range(runs):
+                start = timer()
+                step()
+                times.append(timer() - start)
+            results.append(dict(step=label, containers=count,
+                                min_ms=round(min(times) * 1000, 2),
+                                median_ms=round(median(times) * 1000, 2)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Times to run each step")
+    parser.add_argument("--containers", default="1000,5000",
+                        help="Comma-separated blockade sizes")
+    parser.add_argument("--json", action="store_true",
+                        help="Output in JSON format")
+    opts = parser.parse_args()
+
+    counts = [int(c) for c in opts.containers.split(",")]
+    results = run(opts.runs, counts)
+    if opts.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print("%-18s %10s %10s %10s" % ("STEP", "CONTAINERS", "MIN MS",
+                                        "MEDIAN MS"))
+        for r in results:
+            print("%-18s %10d %10.2f %10.2f" % (
+                r['step'], r['containers'], r['min_ms'], r['median_ms']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
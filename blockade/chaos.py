@@ -0,0 +1,170 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import random
+import time
+
+from .errors import BlockadeError
+from .scenario import monotonic, _sleep_until
+
+CHAOS_FAULTS = ("partition", "flaky", "slow", "heal")
+DEFAULT_CHAOS_WEIGHTS = {"partition": 2, "flaky": 1, "slow": 1, "heal": 2}
+
+# faults per second
+DEFAULT_CHAOS_RATE = 1.0
+
+# seconds between asking Docker which containers are running
+DEFAULT_CHAOS_REFRESH = 60.0
+
+
+class ChaosEvent(object):
+    """A fault applied by a chaos run, at seconds from its start
+    """
+    def __init__(self, at, fault, containers=None, partitions=None,
+                 error=None):
+        self.at = at
+        self.fault = fault
+        self.containers = containers
+        self.partitions = partitions
+        self.error = error
+
+    def to_dict(self):
+        return dict(at=self.at, fault=self.fault, containers=self.containers,
+                    partitions=self.partitions, error=self.error)
+
+
+class Chaos(object):
+    """Keep applying random network faults to a blockade
+
+    At rate faults per second, a fault is drawn from the weighted menu: a
+    random minority of the running containers partitioned from the rest,
+    random containers made flaky or slow, or the network healed. Every
+    random choice comes from seed, so a run with the same seed and
+    containers applies the same faults in the same order.
+
+    The running containers are looked up once and kept, and only looked
+    up again every refresh seconds or after a fault fails.
+    """
+    def __init__(self, blockade, seed=None, rate=DEFAULT_CHAOS_RATE,
+                 weights=None, refresh=DEFAULT_CHAOS_REFRESH,
+                 clock=monotonic, sleep=time.sleep):
+        if not rate > 0:
+            raise BlockadeError("Chaos rate must be above zero")
+        weights = DEFAULT_CHAOS_WEIGHTS if weights is None else weights
+        unknown = set(weights) - set(CHAOS_FAULTS)
+        if unknown:
+            raise BlockadeError("Unknown chaos faults: %s" %
+                                ", ".join(sorted(unknown)))
+        if any(w < 0 for w in weights.values()) or \
+                not sum(weights.values()) > 0:
+            raise BlockadeError("Chaos weights must not be negative, and "
+                                "at least one must be above zero")
+
+        if seed is None:
+            seed = random.SystemRandom().randint(0, 2 ** 31 - 1)
+        self.blockade = blockade
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.rate = float(rate)
+        self.refresh = refresh
+        self.clock = clock
+        self.sleep = sleep
+        # in a fixed order, so the same draw picks the same fault
+        self.menu = [(f, weights[f]) for f in CHAOS_FAULTS if weights.get(f)]
+
+        self.containers = []
+        self.partitioned = False
+        self.netem = set()
+
+    def choose_fault(self):
+        x = self.random.random() * sum(w for _, w in self.menu)
+        for fault, weight in self.menu:
+            x -= weight
+            if x < 0:
+                return fault
+        return self.menu[-1][0]
+
+    def run(self, duration=None):
+        """Yield a ChaosEvent for each fault, for duration seconds or
+        until closed, then heal the network
+        """
+        state = self.blockade.state_factory.load()
+        self.refresh_containers(state)
+        start = self.clock()
+        next_refresh = self.refresh
+        try:
+            count = 0
+            while True:
+                at = count / self.rate
+                if duration is not None and at >= duration:
+                    break
+                _sleep_until(start + at, self.clock, self.sleep)
+                if self.refresh and at >= next_refresh:
+                    self.refresh_containers(state)
+                    next_refresh = at + self.refresh
+
+                fault = self.choose_fault()
+                started = self.clock() - start
+                try:
+                    event = self.apply(state, fault, started)
+                except BlockadeError as e:
+                    # most likely a container stopped under us
+                    self.refresh_containers(state)
+                    event = ChaosEvent(started, fault, error=str(e))
+                yield event
+                count += 1
+        finally:
+            self.heal(state)
+
+    def refresh_containers(self, state):
+        containers = self.blockade._get_running_containers(state=state)
+        self.containers = sorted(containers, key=lambda c: c.name)
+
+    def apply(self, state, fault, at):
+        names = [c.name for c in self.containers]
+
+        if fault == "partition" and len(names) > 1:
+            size = self.random.randint(1, max(1, (len(names) - 1) // 2))
+            minority = sorted(self.random.sample(names, size))
+            chosen = set(minority)
+            majority = [n for n in names if n not in chosen]
+            self.blockade._apply_partition(state, self.containers,
+                                           [minority, majority])
+            self.partitioned = True
+            return ChaosEvent(at, fault, partitions=[minority, majority])
+
+        if fault in ("flaky", "slow") and names:
+            size = self.random.randint(1, len(names))
+            chosen = set(self.random.sample(names, size))
+            containers = [c for c in self.containers if c.name in chosen]
+            apply_netem = getattr(self.blockade, "_apply_" + fault)
+            apply_netem(state, containers)
+            self.netem.update(chosen)
+            return ChaosEvent(at, fault, containers=sorted(chosen))
+
+        self.heal(state)
+        return ChaosEvent(at, "heal")
+
+    def heal(self, state):
+        """Undo every fault this run applied
+        """
+        if self.partitioned:
+            self.blockade._apply_join(state)
+            self.partitioned = False
+        if self.netem:
+            containers = [c for c in self.containers if c.name in self.netem]
+            self.blockade._apply_fast(state, containers)
+            self.netem = set()
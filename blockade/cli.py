@@ -14,28 +14,67 @@
 # limitations under the License.
 #
 
+import os
 import sys
 import argparse
 import traceback
 import errno
 import json
-
-import yaml
-from clint.textui import puts, puts_err, colored, columns
+import time
 
 from .errors import BlockadeError
-from .core import Blockade
+from .core import Blockade, DEFAULT_STOP_TIMEOUT
 from .state import BlockadeStateFactory
 from .config import BlockadeConfig
 from .net import BlockadeNetwork
+from .logs import COMPRESSIONS
+from .scenario import Scenario
+from .chaos import Chaos, DEFAULT_CHAOS_RATE
+from .trace import TRACE_FORMATS, phase, start_tracing, stop_tracing
+from .watch import BlockadeWatcher, ContainerChange
+from .daemon import BlockadeDaemon, BlockadeClient, CachingBlockade, \
+    CachedStateFactory, daemon_running, BLOCKADE_DAEMON_SOCKET
+
+
+def puts(s):
+    from clint.textui import puts as clint_puts
+    clint_puts(s)
+
+
+def puts_err(s):
+    from clint.textui import puts_err as clint_puts_err
+    clint_puts_err(s)
+
+
+def _red(s):
+    from clint.textui import colored
+    return colored.red(s)
 
 
 def load_config(opts):
+    with phase("load config"):
+        return _load_config(opts)
+
+
+def _config_paths(opts):
+    return (opts.config,) if opts.config else ("blockade.yaml",
+                                               "blockade.yml")
+
+
+def find_config(opts):
+    """Get the absolute path of the config file to load, or None
+    """
+    for path in _config_paths(opts):
+        if os.path.exists(path):
+            return os.path.abspath(path)
+    return None
+
+
+def _load_config(opts):
+    import yaml
     error = None
-    paths = (opts.config,) if opts.config else ("blockade.yaml",
-                                                "blockade.yml")
     try:
-        for path in paths:
+        for path in _config_paths(opts):
             try:
                 with open(path) as f:
                     d = yaml.safe_load(f)
@@ -50,11 +89,37 @@ def load_config(opts):
                         (str(error) if error else ""))
 
 
-def get_blockade(config):
-    return Blockade(config, BlockadeStateFactory, BlockadeNetwork(config))
+def load_scenario(path):
+    import yaml
+    try:
+        with open(path) as f:
+            d = yaml.safe_load(f)
+    except (IOError, yaml.YAMLError) as e:
+        raise BlockadeError("Failed to load scenario %s: %s" % (path, e))
+    return Scenario.from_dict(d)
+
+
+def get_blockade(opts, parallelism=None):
+    """Get a Blockade, or a client of the Blockade daemon if it is running
+
+    The daemon refuses commands meant for a config other than its own.
+    """
+    if not opts.no_daemon and daemon_running():
+        return BlockadeClient(parallelism=parallelism,
+                              config_path=find_config(opts))
+    return get_local_blockade(opts, parallelism)
+
+
+def get_local_blockade(opts, parallelism=None):
+    """Get a Blockade in this process, even if the daemon is running
+    """
+    config = load_config(opts)
+    return Blockade(config, BlockadeStateFactory, BlockadeNetwork(config),
+                    parallelism=parallelism)
 
 
 def print_containers(containers, to_json=False):
+    from clint.textui import colored, columns
     containers = sorted(containers, key=lambda c: c.name)
 
     if to_json:
@@ -86,11 +151,67 @@ def _add_output_options(parser):
 
 def _add_container_selection_options(parser):
     parser.add_argument('containers', metavar='CONTAINER', nargs='*',
-                        help='Container to select')
+                        help='Container to select: a name, a glob such as '
+                        "'db-*', or group:NAME")
     parser.add_argument('--all', action='store_true',
                         help='Select all containers')
 
 
+def _positive_int(value):
+    try:
+        value = int(value)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return value
+
+
+def _positive_float(value):
+    try:
+        value = float(value)
+    except ValueError:
+        value = 0
+    if not value > 0:
+        raise argparse.ArgumentTypeError("must be a positive number")
+    return value
+
+
+def _chaos_weights(value):
+    """Weights like partition=2,heal=1; faults left out are never chosen
+    """
+    weights = {}
+    try:
+        for item in value.split(","):
+            fault, weight = item.split("=")
+            weights[fault.strip()] = float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "must be like partition=2,flaky=1,slow=1,heal=2")
+    return weights
+
+
+_TIME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def _since(value):
+    """A Unix time, or a duration like 90s, 10m, 2h or 1d before now
+    """
+    try:
+        unit = _TIME_UNITS.get(value[-1:])
+        if unit:
+            return int(time.time() - float(value[:-1]) * unit)
+        return int(float(value))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "must be a Unix time or a duration such as 10m")
+
+
+def _add_parallelism_option(parser):
+    parser.add_argument('--parallelism', metavar='N', type=_positive_int,
+                        help='Number of containers to work on at once')
+
+
 def _check_container_selections(opts):
     if opts.containers and opts.all:
         raise BlockadeError("Either specify individual containers "
@@ -104,8 +225,7 @@ def _check_container_selections(opts):
 def cmd_up(opts):
     """Start the containers and link them together
     """
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts, parallelism=opts.parallelism)
     containers = b.create()
     print_containers(containers, opts.json)
 
@@ -113,16 +233,14 @@ def cmd_up(opts):
 def cmd_destroy(opts):
     """Destroy all containers and restore networks
     """
-    config = load_config(opts)
-    b = get_blockade(config)
-    b.destroy()
+    b = get_blockade(opts, parallelism=opts.parallelism)
+    b.destroy(stop_timeout=opts.stop_timeout, kill=opts.kill)
 
 
 def cmd_status(opts):
     """Print status of containers and networks
     """
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts)
     containers = b.status()
     print_containers(containers, opts.json)
 
@@ -131,8 +249,7 @@ def cmd_flaky(opts):
     """Make the network flaky for some or all containers
     """
     containers, select_all = _check_container_selections(opts)
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts)
     b.flaky(containers, select_all)
 
 
@@ -140,8 +257,7 @@ def cmd_slow(opts):
     """Make the network slow for some or all containers
     """
     containers, select_all = _check_container_selections(opts)
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts)
     b.slow(containers, select_all)
 
 
@@ -149,8 +265,7 @@ def cmd_fast(opts):
     """Restore network speed and reliability for some or all containers
     """
     containers, select_all = _check_container_selections(opts)
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts)
     b.fast(containers, select_all)
 
 
@@ -174,36 +289,215 @@ def cmd_partition(opts):
             if name:
                 names.append(name)
         partitions.append(names)
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts)
     b.partition(partitions)
 
 
 def cmd_join(opts):
     """Restore full networking between containers
     """
-    config = load_config(opts)
-    b = get_blockade(config)
+    b = get_blockade(opts)
     b.join()
 
 
 def cmd_logs(opts):
-    """Fetch the logs of a container
+    """Fetch the logs of some or all containers
+
+    Logs are printed as they are read. With more than one container, the
+    lines are interleaved as they arrive, each prefixed with the container
+    name and the time it was logged.
+    """
+    containers, _ = _check_container_selections(opts)
+    # logs are streamed straight from Docker, not through the daemon
+    b = get_local_blockade(opts)
+
+    # a single glob or group can select several containers
+    if containers is None:
+        prefixed = len(b.config.containers) > 1
+    else:
+        containers = b.config.select(containers)
+        prefixed = len(containers) > 1
+    lines = b.stream_logs(containers, follow=opts.follow, since=opts.since,
+                          timestamps=prefixed)
+    for line in lines:
+        if prefixed:
+            puts("%-15s %s | %s" % (line.name, line.timestamp, line.text))
+        else:
+            puts(line.text)
+        if opts.follow:
+            sys.stdout.flush()
+
+
+def cmd_collect_logs(opts):
+    """Write the logs of all containers to compressed files in DIR
+
+    Logs are streamed from Docker straight to one file per container, for
+    several containers at once. Prints the size of each log and how long
+    it took.
+    """
+    b = get_local_blockade(opts, parallelism=opts.parallelism)
+    archives = b.collect_logs(opts.directory, opts.containers or None,
+                              compression=opts.compression)
+    if opts.json:
+        d = [a.to_dict() for a in archives]
+        puts(json.dumps(d, indent=2, sort_keys=True, separators=(',', ': ')))
+        return
+
+    from clint.textui import colored, columns
+    puts(colored.blue(columns(["NODE",          15],
+                              ["BYTES",         12],
+                              ["COMPRESSED",    12],
+                              ["SECONDS",        8],
+                              ["FILE",          30])))
+    for archive in archives:
+        puts(columns([archive.name,                    15],
+                     [str(archive.size),               12],
+                     [str(archive.compressed_size),    12],
+                     ["%.2f" % (archive.seconds,),      8],
+                     [archive.path,                    30]))
+
+
+def print_change(change, to_json=False):
+    if to_json:
+        puts(json.dumps(change.to_dict(), sort_keys=True))
+    else:
+        from clint.textui import columns
+        when = change.time or time.time()
+        puts(columns([time.strftime("%H:%M:%S", time.localtime(when)), 10],
+                     [change.name,                                    15],
+                     [change.event,                                    8],
+                     [change.container.state,                          8],
+                     [change.container.ip_address or "",              15]))
+    sys.stdout.flush()
+
+
+def cmd_watch(opts):
+    """Print container status changes as Docker reports them
+
+    Prints the status of every container, then a line for each container
+    that starts, dies, runs out of memory or is removed, until
+    interrupted.
+    """
+    # events come straight from Docker, not through the daemon
+    watcher = BlockadeWatcher(get_local_blockade(opts))
+    since = int(time.time())
+    containers = watcher.refresh()
+    if opts.json:
+        for container in sorted(containers, key=lambda c: c.name):
+            print_change(ContainerChange(container.name, "status", since,
+                                         container), True)
+    else:
+        print_containers(containers)
+    for change in watcher.follow(since):
+        print_change(change, opts.json)
+
+
+def cmd_run(opts):
+    """Apply a timeline of network faults from a scenario file
+
+    Each step of the scenario (partition, join, slow, flaky or fast) starts
+    at its offset in seconds from the start of the run. Prints when each
+    step was scheduled, when its fault was in place and how long it took.
+    """
+    scenario = load_scenario(opts.scenario)
+    config = load_config(opts)
+    scenario.validate(config)
+    # containers are looked up once, before the first step
+    b = CachingBlockade(config, CachedStateFactory(BlockadeStateFactory),
+                        BlockadeNetwork(config))
+    results = scenario.run(b)
+
+    if opts.json:
+        d = [r.to_dict() for r in results]
+        puts(json.dumps(d, indent=2, sort_keys=True, separators=(',', ': ')))
+        return
+
+    from clint.textui import colored, columns
+    puts(colored.blue(columns(["ACTION",       10],
+                              ["SCHEDULED",    10],
+                              ["APPLIED",      10],
+                              ["LAG MS",        8],
+                              ["SECONDS",       8])))
+    for result in results:
+        d = result.to_dict()
+        puts(columns([d['action'],                       10],
+                     ["%.3f" % (d['scheduled'],),        10],
+                     ["%.3f" % (d['applied'],),          10],
+                     ["%.1f" % (d['lag'] * 1000,),        8],
+                     ["%.3f" % (d['seconds'],),           8]))
+
+
+def print_chaos_event(event, to_json=False):
+    if to_json:
+        puts(json.dumps(event.to_dict(), sort_keys=True))
+    else:
+        if event.error:
+            detail = _red("failed: " + event.error)
+        elif event.partitions:
+            detail = " | ".join(",".join(p) for p in event.partitions)
+        else:
+            detail = ",".join(event.containers or ())
+        puts("%10.3f  %-10s %s" % (event.at, event.fault, detail))
+    sys.stdout.flush()
+
+
+def cmd_chaos(opts):
+    """Keep applying random network faults until interrupted
+
+    Faults are drawn from a weighted menu at --rate per second: a random
+    minority of containers partitioned from the rest, random containers
+    made flaky or slow, or the network healed. Give the seed of an earlier
+    run to --seed to repeat it. The network is healed when chaos stops.
     """
     config = load_config(opts)
-    b = get_blockade(config)
-    puts(b.logs(opts.container))
+    # containers are looked up once and kept, not inspected for each fault
+    b = CachingBlockade(config, CachedStateFactory(BlockadeStateFactory),
+                        BlockadeNetwork(config))
+    chaos = Chaos(b, seed=opts.seed, rate=opts.rate, weights=opts.weights)
+    puts_err("Chaos seed: %d" % (chaos.seed,))
+    events = chaos.run(opts.duration)
+    try:
+        for event in events:
+            print_chaos_event(event, opts.json)
+    finally:
+        events.close()
+
+
+def cmd_daemon(opts):
+    """Serve commands from a long-running process
+
+    Holds the config, state, Docker connection and container details in
+    memory. While it runs, other blockade commands in this directory are
+    sent to it instead of doing all of that work themselves.
+    """
+    config = load_config(opts)
+    b = CachingBlockade(config, CachedStateFactory(BlockadeStateFactory),
+                        BlockadeNetwork(config))
+    puts("Blockade daemon listening on %s" % (BLOCKADE_DAEMON_SOCKET,))
+    BlockadeDaemon(b, config_path=find_config(opts)).serve_forever()
 
 
 _CMDS = (("up", cmd_up), ("destroy", cmd_destroy), ("status", cmd_status),
          ("logs", cmd_logs), ("flaky", cmd_flaky), ("slow", cmd_slow),
-         ("fast", cmd_fast), ("partition", cmd_partition), ("join", cmd_join))
+         ("fast", cmd_fast), ("partition", cmd_partition), ("join", cmd_join),
+         ("collect-logs", cmd_collect_logs), ("watch", cmd_watch),
+         ("run", cmd_run), ("chaos", cmd_chaos), ("daemon", cmd_daemon))
 
 
 def setup_parser():
     parser = argparse.ArgumentParser(description='Blockade')
     parser.add_argument("--config", "-c", metavar="blockade.yaml",
                         help="Config YAML. Looks in CWD if not specified.")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="Don't use the Blockade daemon even if it is "
+                        "running")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Write the time taken by every command, Docker "
+                        "call and phase to FILE")
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS,
+                        default="jsonl",
+                        help="JSON lines (the default) or Chrome trace "
+                        "format, for chrome://tracing")
 
     subparsers = parser.add_subparsers(title="commands")
 
@@ -218,16 +512,64 @@ def setup_parser():
 
     # add additional parameters to some commands
     _add_output_options(command_parsers["up"])
+    _add_parallelism_option(command_parsers["up"])
+    _add_parallelism_option(command_parsers["destroy"])
     _add_output_options(command_parsers["status"])
+    _add_output_options(command_parsers["watch"])
     _add_container_selection_options(command_parsers["flaky"])
     _add_container_selection_options(command_parsers["slow"])
     _add_container_selection_options(command_parsers["fast"])
 
-    command_parsers["logs"].add_argument("container", metavar='CONTAINER',
-                                         help="Container to fetch logs for")
+    command_parsers["destroy"].add_argument(
+        '--stop-timeout', metavar='SECONDS', type=int,
+        default=DEFAULT_STOP_TIMEOUT,
+        help='Seconds to wait for containers to stop before killing them')
+    command_parsers["destroy"].add_argument(
+        '--kill', action='store_true',
+        help='Kill containers immediately instead of stopping them')
+
+    _add_container_selection_options(command_parsers["logs"])
+    command_parsers["logs"].add_argument(
+        '--follow', '-f', action='store_true',
+        help='Keep printing new log lines until the containers stop')
+    command_parsers["logs"].add_argument(
+        '--since', metavar='TIME', type=_since,
+        help='Only print lines logged since TIME, a Unix time or a '
+        'duration such as 10m')
+    command_parsers["collect-logs"].add_argument(
+        'directory', metavar='DIR',
+        help='Directory to write the logs to')
+    command_parsers["collect-logs"].add_argument(
+        'containers', metavar='CONTAINER', nargs='*',
+        help='Container to collect logs from (default all)')
+    command_parsers["collect-logs"].add_argument(
+        '--compression', choices=sorted(COMPRESSIONS), default="gzip",
+        help='How to compress the logs (zstd needs the zstandard package)')
+    _add_output_options(command_parsers["collect-logs"])
+    _add_parallelism_option(command_parsers["collect-logs"])
+    command_parsers["run"].add_argument(
+        'scenario', metavar='SCENARIO',
+        help='Scenario YAML file')
+    _add_output_options(command_parsers["run"])
+    command_parsers["chaos"].add_argument(
+        '--rate', metavar='FAULTS', type=_positive_float,
+        default=DEFAULT_CHAOS_RATE,
+        help='Faults per second (default %s)' % (DEFAULT_CHAOS_RATE,))
+    command_parsers["chaos"].add_argument(
+        '--seed', type=int,
+        help='Seed for the random choices, to repeat an earlier run')
+    command_parsers["chaos"].add_argument(
+        '--weights', type=_chaos_weights,
+        help='Relative chance of each fault, as partition=2,flaky=1,'
+        'slow=1,heal=2 (the default)')
+    command_parsers["chaos"].add_argument(
+        '--duration', metavar='SECONDS', type=_positive_float,
+        help='Stop after this long instead of running until interrupted')
+    _add_output_options(command_parsers["chaos"])
     command_parsers["partition"].add_argument(
         'partitions', nargs='+', metavar='PARTITION',
-        help='Comma-separated partition')
+        help='Comma-separated partition of container names, globs or '
+        'group:NAME')
 
     return parser
 
@@ -237,22 +579,29 @@ def main(args=None):
     opts = parser.parse_args(args=args)
 
     rc = 0
+    tracer = start_tracing() if opts.trace else None
 
     try:
-        opts.func(opts)
+        with phase("blockade " + opts.func.__name__[len("cmd_"):]):
+            opts.func(opts)
     except BlockadeError as e:
-        puts_err(colored.red("\nError:\n") + str(e) + "\n")
+        puts_err(_red("\nError:\n") + str(e) + "\n")
         rc = 1
 
     except KeyboardInterrupt:
-        puts_err(colored.red("Caught Ctrl-C. exiting!"))
+        puts_err(_red("Caught Ctrl-C. exiting!"))
 
     except:
         puts_err(
-            colored.red("\nUnexpected error! This may be a Blockade bug.\n"))
+            _red("\nUnexpected error! This may be a Blockade bug.\n"))
         traceback.print_exc()
         rc = 2
 
+    finally:
+        if tracer:
+            stop_tracing()
+            tracer.dump(opts.trace, opts.trace_format)
+
     sys.exit(rc)
 
 
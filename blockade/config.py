@@ -15,8 +15,18 @@
 #
 
 import collections
+import fnmatch
+import re
 
-from .errors import BlockadeConfigError
+from .errors import BlockadeError, BlockadeConfigError
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+# selects every container in a group, as in "group:db"
+GROUP_SELECTOR_PREFIX = "group:"
 
 
 class BlockadeContainerConfig(object):
@@ -26,10 +36,41 @@ class BlockadeContainerConfig(object):
             name, d['image'],
             command=d.get('command'), links=d.get('links'),
             lxc_conf=d.get('lxc_conf'), volumes=d.get('volumes'),
-            ports=d.get('ports'), environment=d.get('environment'))
+            ports=d.get('ports'), environment=d.get('environment'),
+            group=d.get('group'))
+
+    @staticmethod
+    def replicas_from_dict(name, d):
+        """Get the containers a config entry describes
+
+        An entry with a count of N describes N containers, NAME-1 to NAME-N,
+        in the group NAME unless it names another. In their environment,
+        {name}, {index}, {count} and {group} are replaced by each replica's
+        own values.
+        """
+        count = d.get('count')
+        if count is None:
+            return [BlockadeContainerConfig.from_dict(name, d)]
+        if isinstance(count, bool) or not isinstance(count, int) \
+                or count < 1:
+            raise BlockadeConfigError("count must be a positive integer")
+
+        group = d.get('group') or name
+        replicas = []
+        for index in range(1, count + 1):
+            container = BlockadeContainerConfig.from_dict(
+                "%s-%d" % (name, index), d)
+            container.group = group
+            fields = {"{name}": container.name, "{index}": str(index),
+                      "{count}": str(count), "{group}": group}
+            container.environment = dict(
+                (k, _template(v, fields))
+                for k, v in container.environment.items())
+            replicas.append(container)
+        return replicas
 
     def __init__(self, name, image, command=None, links=None, lxc_conf=None,
-                 volumes=None, ports=None, environment=None):
+                 volumes=None, ports=None, environment=None, group=None):
         self.name = name
         self.image = image
         self.command = command
@@ -38,13 +79,19 @@ class BlockadeContainerConfig(object):
         self.volumes = _dictify(volumes, "volumes")
         self.ports = _dictify(ports, "ports")
         self.environment = dict(environment or {})
+        self.group = group
 
 
 _DEFAULT_NETWORK_CONFIG = {
     "flaky": "30%",
     "slow": "75ms 100ms distribution normal",
+    "traffic_control": "tc",
+    "firewall": "iptables",
 }
 
+_TRAFFIC_CONTROL_BACKENDS = ("tc", "netlink")
+_FIREWALL_BACKENDS = ("iptables", "ipset", "nftables")
+
 
 class BlockadeConfig(object):
     @staticmethod
@@ -52,16 +99,30 @@ class BlockadeConfig(object):
         try:
             containers = d['containers']
             parsed_containers = {}
+            replicated = {}
             for name, container_dict in containers.items():
                 try:
-                    container = BlockadeContainerConfig.from_dict(
+                    replicas = BlockadeContainerConfig.replicas_from_dict(
                         name, container_dict)
-                    parsed_containers[name] = container
-
                 except Exception as e:
                     raise BlockadeConfigError(
                         "Container '%s' config problem: %s" % (name, e))
 
+                if container_dict.get('count') is not None:
+                    replicated[name] = [c.name for c in replicas]
+                for container in replicas:
+                    if container.name in parsed_containers:
+                        raise BlockadeConfigError(
+                            "Container '%s' is defined more than once" %
+                            (container.name,))
+                    parsed_containers[container.name] = container
+
+            # a link to a replicated container links to every replica
+            if replicated:
+                for container in parsed_containers.values():
+                    container.links = _expand_links(container.links,
+                                                    replicated)
+
             network = d.get('network')
             if network:
                 defaults = _DEFAULT_NETWORK_CONFIG.copy()
@@ -71,6 +132,16 @@ class BlockadeConfig(object):
             else:
                 network = _DEFAULT_NETWORK_CONFIG.copy()
 
+            if network['traffic_control'] not in _TRAFFIC_CONTROL_BACKENDS:
+                raise BlockadeConfigError(
+                    "invalid traffic_control %s: need one of %s" %
+                    (network['traffic_control'],
+                     ", ".join(_TRAFFIC_CONTROL_BACKENDS)))
+            if network['firewall'] not in _FIREWALL_BACKENDS:
+                raise BlockadeConfigError(
+                    "invalid firewall %s: need one of %s" %
+                    (network['firewall'], ", ".join(_FIREWALL_BACKENDS)))
+
             return BlockadeConfig(parsed_containers, network=network)
 
         except KeyError as e:
@@ -82,9 +153,80 @@ class BlockadeConfig(object):
 
     def __init__(self, containers, network=None):
         self.containers = containers
-        self.sorted_containers = dependency_sorted(containers)
+        self.dependency_levels = dependency_levels(containers)
+        self.sorted_containers = [c for level in self.dependency_levels
+                                  for c in level]
         self.network = network or {}
 
+        self.groups = {}
+        for container in self.sorted_containers:
+            if container.group:
+                self.groups.setdefault(container.group, []).append(
+                    container.name)
+
+    def select(self, selectors):
+        """Get the names of the containers matching selectors
+
+        A selector is a container name, a glob such as 'db-*', or
+        group:NAME for the containers in a group.
+        """
+        return self.select_many([selectors])[0]
+
+    def select_many(self, selector_lists):
+        """Get the names of the containers matching each list of selectors
+
+        All the lists are resolved in one pass over the containers, so a
+        partition of many groups costs no more than selecting one. Names
+        come back in dependency order. Raises BlockadeError for a selector
+        which matches nothing.
+        """
+        exact = {}
+        groups = {}
+        globs = []
+        globs_by_list = []
+        for index, selectors in enumerate(selector_lists):
+            patterns = []
+            for selector in selectors:
+                if selector.startswith(GROUP_SELECTOR_PREFIX):
+                    group = selector[len(GROUP_SELECTOR_PREFIX):]
+                    if group not in self.groups:
+                        raise BlockadeError("Unknown container group: %s" %
+                                            (group,))
+                    groups.setdefault(group, set()).add(index)
+                elif _is_glob(selector):
+                    patterns.append(fnmatch.translate(selector))
+                    globs_by_list.append((index, selector))
+                else:
+                    exact.setdefault(selector, set()).add(index)
+            if patterns:
+                globs.append((index, re.compile("|".join(patterns))))
+
+        unknown = set(exact).difference(
+            c.name for c in self.sorted_containers)
+        if unknown:
+            raise BlockadeError("Unknown containers: %s" %
+                                ", ".join(sorted(unknown)))
+
+        results = [[] for _ in selector_lists]
+        for container in self.sorted_containers:
+            name = container.name
+            indexes = set(exact.get(name, ()))
+            indexes.update(groups.get(container.group, ()))
+            for index, pattern in globs:
+                if index not in indexes and pattern.match(name):
+                    indexes.add(index)
+            for index in indexes:
+                results[index].append(name)
+
+        unmatched = sorted(
+            selector for index, selector in globs_by_list
+            if not any(fnmatch.fnmatchcase(name, selector)
+                       for name in results[index]))
+        if unmatched:
+            raise BlockadeError("No containers match %s" %
+                                ", ".join(unmatched))
+        return results
+
 
 def _dictify(data, name="input"):
     if data:
@@ -99,51 +241,110 @@ def _dictify(data, name="input"):
         return {}
 
 
+def _template(value, fields):
+    if not isinstance(value, _string_types):
+        return value
+    for field, replacement in fields.items():
+        value = value.replace(field, replacement)
+    return value
+
+
+def _expand_links(links, replicated):
+    expanded = {}
+    for link, alias in links.items():
+        replicas = replicated.get(link)
+        if replicas is None:
+            expanded[link] = alias
+            continue
+        # each replica gets its own alias: db-1, db-2 or master-1, master-2
+        for replica in replicas:
+            expanded[replica] = alias + replica[len(link):]
+    return expanded
+
+
+def _is_glob(selector):
+    return any(c in selector for c in "*?[")
+
+
 def dependency_sorted(containers):
     """Sort a dictionary or list of containers into dependency order
 
     Returns a sequence
     """
+    return [c for level in dependency_levels(containers) for c in level]
+
+
+def dependency_levels(containers):
+    """Group a dictionary or list of containers by dependency depth
+
+    Returns a list of levels, each a list of containers. Containers only
+    link to containers in earlier levels, so all containers in a level
+    can be started at the same time.
+    """
     if not isinstance(containers, collections.Mapping):
         containers = dict((c.name, c) for c in containers)
 
     container_links = dict((name, set(c.links.keys()))
                            for name, c in containers.items())
-    sorted_names = _resolve(container_links)
-    return [containers[name] for name in sorted_names]
+    return [[containers[name] for name in level]
+            for level in _resolve(container_links)]
 
 
 def _resolve(d):
+    """Group a map of name -> linked names into dependency levels
+
+    A topological sort in O(V+E) (Kahn's algorithm), taken a level at a
+    time: each level holds the names whose links are all in earlier ones.
+    """
     all_keys = frozenset(d.keys())
-    result = []
-    resolved_keys = set()
-
-    while d:
-        resolved_this_round = set()
-        for name, links in list(d.items()):
-            # containers with no links can be started in any order.
-            # containers whose parent containers have already been resolved
-            # can be added now too.
-            if not links or links <= resolved_keys:
-                result.append(name)
-                resolved_this_round.add(name)
-                del d[name]
-
-            # guard against containers which link to unknown containers
-            unknown = links - all_keys
-            if len(unknown) == 1:
-                raise BlockadeConfigError(
-                    "container %s links to unknown container %s" %
-                    (name, list(unknown)[0]))
-            elif len(unknown) > 1:
-                raise BlockadeConfigError(
-                    "container %s links to unknown containers %s" %
-                    (name, unknown))
+    for name, links in d.items():
+        # guard against containers which link to unknown containers
+        unknown = links - all_keys
+        if len(unknown) == 1:
+            raise BlockadeConfigError(
+                "container %s links to unknown container %s" %
+                (name, list(unknown)[0]))
+        elif len(unknown) > 1:
+            raise BlockadeConfigError(
+                "container %s links to unknown containers %s" %
+                (name, unknown))
+
+    waiting_on = dict((name, len(links)) for name, links in d.items())
+    dependents = dict((name, []) for name in d)
+    for name, links in d.items():
+        for link in links:
+            dependents[link].append(name)
 
-        # if we made no progress this round, we have a circular dep
-        if not resolved_this_round:
-            raise BlockadeConfigError("containers have circular links!")
+    result = []
+    resolved = 0
+    level = [name for name in d if not waiting_on[name]]
+    while level:
+        result.append(level)
+        resolved += len(level)
+        next_level = []
+        for name in level:
+            for dependent in dependents[name]:
+                waiting_on[dependent] -= 1
+                if not waiting_on[dependent]:
+                    next_level.append(dependent)
+        level = next_level
 
-        resolved_keys.update(resolved_this_round)
+    if resolved < len(d):
+        cycle = _find_cycle(d, set(n for n, w in waiting_on.items() if w))
+        raise BlockadeConfigError("containers have circular links: %s" %
+                                  " -> ".join(cycle))
 
     return result
+
+
+def _find_cycle(d, unresolved):
+    # every unresolved container links to another unresolved one, so
+    # following those links from anywhere must come back around
+    path = []
+    seen = {}
+    name = min(unresolved)
+    while name not in seen:
+        seen[name] = len(path)
+        path.append(name)
+        name = min(unresolved.intersection(d[name]))
+    return path[seen[name]:] + [name]
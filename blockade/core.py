@@ -14,22 +14,44 @@
 # limitations under the License.
 #
 
+import os
 from copy import deepcopy
 
-import docker
-
 from .errors import BlockadeError
 from .net import NetworkState, BlockadeNetwork
 from .state import BlockadeStateFactory
+from .trace import phase, traced
+from .logs import docker_log_stream, split_lines, parse_log_line, \
+    multiplex, archive_log, COMPRESSIONS
+
+
+DEFAULT_PARALLELISM = 8
+DEFAULT_STOP_TIMEOUT = 3
+DEFAULT_LOOKUP_TIMEOUT = 30
+
+# labels on every blockade container, naming its blockade and itself
+BLOCKADE_ID_LABEL = "blockade.id"
+BLOCKADE_NAME_LABEL = "blockade.name"
+
+# state factory methods traced as phases, when tracing
+_STATE_PHASES = {"load": "load state", "initialize": "initialize state",
+                 "destroy": "destroy state"}
 
 
 class Blockade(object):
     def __init__(self, config, state_factory=None, network=None,
-                 docker_client=None):
+                 docker_client=None, parallelism=None, lookup_timeout=None):
         self.config = config
-        self.state_factory = state_factory or BlockadeStateFactory()
+        self.state_factory = traced(state_factory or BlockadeStateFactory(),
+                                    "phase", _STATE_PHASES)
         self.network = network or BlockadeNetwork(config)
-        self.docker_client = docker_client or docker.Client()
+        if docker_client is None:
+            # docker-py is slow to import, so only pay for it when needed
+            import docker
+            docker_client = docker.Client()
+        self.docker_client = traced(docker_client, "docker")
+        self.parallelism = parallelism or DEFAULT_PARALLELISM
+        self.lookup_timeout = lookup_timeout or DEFAULT_LOOKUP_TIMEOUT
 
     def create(self):
         container_state = {}
@@ -40,24 +62,51 @@ class Blockade(object):
         # generate blockade ID and persist
         state = self.state_factory.initialize(container_state)
 
-        container_descriptions = []
-        for container in self.config.sorted_containers:
+        def start(container):
             veth_device = container_state[container.name]['veth_device']
-            container_id = self._start_container(state.blockade_id, container,
-                                                 veth_device)
-            description = self._get_container_description(
-                state, container.name, container_id)
-            container_descriptions.append(description)
+            return container.name, self._start_container(
+                state.blockade_id, container, veth_device)
+
+        # containers in a level only link to containers in earlier levels,
+        # so each level can be started all at once
+        container_descriptions = []
+        for level in self.config.dependency_levels:
+            with phase("start containers"):
+                started = parallel_map(start, level, self.parallelism)
+
+                # one tc call for the whole level, not one per container
+                device_states = self.network.network_states()
+
+                def describe(item):
+                    name, container_id = item
+                    return self._get_container_description(
+                        state, name, container_id,
+                        device_states=device_states)
+
+                started = parallel_map(describe, started, self.parallelism)
+            state.update_containers(dict(
+                (c.name, {"container_id": c.container_id,
+                          "ip_address": c.ip_address}) for c in started))
+            container_descriptions.extend(started)
 
         return container_descriptions
 
     def _start_container(self, blockade_id, container, veth_device):
         container_name = docker_container_name(blockade_id, container.name)
         volumes = list(container.volumes.values()) or None
-        response = self.docker_client.create_container(
-            container.image, command=container.command, name=container_name,
-            ports=container.ports, volumes=volumes, hostname=container.name,
-            environment=container.environment)
+        kwargs = dict(command=container.command, name=container_name,
+                      ports=container.ports, volumes=volumes,
+                      hostname=container.name,
+                      environment=container.environment)
+        labels = {BLOCKADE_ID_LABEL: blockade_id,
+                  BLOCKADE_NAME_LABEL: container.name}
+        try:
+            response = self.docker_client.create_container(
+                container.image, labels=labels, **kwargs)
+        except TypeError:
+            # docker-py too old to know about labels
+            response = self.docker_client.create_container(
+                container.image, **kwargs)
         container_id = response['Id']
 
         links = dict((docker_container_name(blockade_id, link), alias)
@@ -70,10 +119,11 @@ class Blockade(object):
         return container_id
 
     def _get_container_description(self, state, name, container_id,
-                                   network_state=True, ip_partitions=None):
+                                   network_state=True, ip_partitions=None,
+                                   device_states=None):
         try:
-            container = self.docker_client.inspect_container(container_id)
-        except docker.APIError as e:
+            container = self._inspect_container(container_id)
+        except _docker_api_error() as e:
             if e.response.status_code == 404:
                 return Container(name, container_id, ContainerState.MISSING)
             else:
@@ -93,11 +143,15 @@ class Blockade(object):
             if ip:
                 extras['ip_address'] = ip
 
-        if (network_state and name in state.containers
-                and container_state == ContainerState.UP):
-            device = state.containers[name]['veth_device']
+        container_info = state.container(name) if network_state else None
+        if container_info and container_state == ContainerState.UP:
+            device = container_info['veth_device']
             extras['veth_device'] = device
-            extras['network_state'] = self.network.network_state(device)
+            if device_states is None:
+                extras['network_state'] = self.network.network_state(device)
+            else:
+                extras['network_state'] = device_states.get(
+                    device, NetworkState.UNKNOWN)
 
             # include partition ID if we were provided a map of them
             if ip_partitions and ip:
@@ -108,44 +162,77 @@ class Blockade(object):
 
         return Container(name, container_id, container_state, **extras)
 
-    def destroy(self, force=False):
+    def _inspect_container(self, container_id):
+        return self.docker_client.inspect_container(container_id)
+
+    def destroy(self, force=False, stop_timeout=DEFAULT_STOP_TIMEOUT,
+                kill=False):
+        """Stop and remove all containers and restore the network
+
+        Containers are torn down concurrently. Docker gives each container
+        stop_timeout seconds to exit before killing it. If kill is True,
+        running containers are killed outright instead.
+        """
         state = self.state_factory.load()
 
-        containers = self._get_docker_containers(state.blockade_id)
-        for container in list(containers.values()):
+        def remove(container):
             container_id = container['Id']
-            self.docker_client.stop(container_id, timeout=3)
+            if not kill:
+                self.docker_client.stop(container_id, timeout=stop_timeout)
+            elif container.get('Status', 'Up').startswith('Up'):
+                self.docker_client.kill(container_id)
             self.docker_client.remove_container(container_id)
 
+        containers = self._get_docker_containers(state.blockade_id)
+        with phase("remove containers"):
+            parallel_map(remove, list(containers.values()), self.parallelism)
+
         self.network.restore(state.blockade_id)
         self.state_factory.destroy()
 
     def _get_docker_containers(self, blockade_id):
-        # look for containers prefixed with our blockade ID
-        prefix = "/" + blockade_id + "-"
-        d = {}
-        for container in self.docker_client.containers(all=True):
-            for name in container['Names']:
-                if name.startswith(prefix):
-                    name = name[len(prefix):]
-                    d[name] = container
-                    break
+        """Get a map of name -> Docker container dict for the blockade
+
+        Asks Docker for just the containers labelled with our blockade ID.
+        Docker clients or daemons which can't filter on labels, and
+        blockades created before containers were labelled, fall back to
+        listing every container and matching on name.
+        """
+        label_filter = "%s=%s" % (BLOCKADE_ID_LABEL, blockade_id)
+        try:
+            containers = self.docker_client.containers(
+                all=True, filters={"label": [label_filter]})
+        except (TypeError, _docker_api_error()):
+            containers = None
+        d = _blockade_containers(blockade_id, containers or ())
+        if not d:
+            d = _blockade_containers(blockade_id,
+                                     self.docker_client.containers(all=True))
         return d
 
     def _get_all_containers(self, state):
-        containers = []
-        ip_partitions = self.network.get_ip_partitions(state.blockade_id)
-        docker_containers = self._get_docker_containers(state.blockade_id)
-        for name, container in docker_containers.items():
-            containers.append(self._get_container_description(state, name,
-                              container['Id'], ip_partitions=ip_partitions))
-        return containers
+        with phase("inspect"):
+            ip_partitions = self.network.get_ip_partitions(state.blockade_id)
+            device_states = self.network.network_states()
+            docker_containers = self._get_docker_containers(
+                state.blockade_id)
+
+            def describe(item):
+                name, container = item
+                return self._get_container_description(
+                    state, name, container['Id'],
+                    ip_partitions=ip_partitions, device_states=device_states)
+
+            return parallel_map(describe, list(docker_containers.items()),
+                                self.parallelism, timeout=self.lookup_timeout)
 
     def status(self):
         state = self.state_factory.load()
         return self._get_all_containers(state)
 
     def _get_running_containers(self, container_names=None, state=None):
+        if container_names is not None:
+            container_names = self.config.select(container_names)
         state = state or self.state_factory.load()
         containers = self._get_all_containers(state)
 
@@ -169,45 +256,146 @@ class Blockade(object):
     def flaky(self, container_names=None, include_all=False):
         if include_all:
             container_names = None
-        containers = self._get_running_containers(container_names)
-        for container in containers:
-            self.network.flaky(container.veth_device)
+        state = self.state_factory.load()
+        containers = self._get_running_containers(container_names, state)
+        self._apply_flaky(state, containers)
 
     def slow(self, container_names=None, include_all=False):
         if include_all:
             container_names = None
-        containers = self._get_running_containers(container_names)
-        for container in containers:
-            self.network.slow(container.veth_device)
+        state = self.state_factory.load()
+        containers = self._get_running_containers(container_names, state)
+        self._apply_slow(state, containers)
 
     def fast(self, container_names=None, include_all=False):
         if include_all:
             container_names = None
-        containers = self._get_running_containers(container_names)
-        for container in containers:
-            self.network.fast(container.veth_device)
+        state = self.state_factory.load()
+        containers = self._get_running_containers(container_names, state)
+        self._apply_fast(state, containers)
 
     def partition(self, partitions):
         state = self.state_factory.load()
         containers = self._get_running_containers(state=state)
-        container_dict = dict((c.name, c) for c in containers)
-        partitions = expand_partitions(list(container_dict.keys()), partitions)
-
-        container_partitions = []
-        for partition in partitions:
-            container_partitions.append([container_dict[c] for c in partition])
-
-        self.network.partition_containers(state.blockade_id,
-                                          container_partitions)
+        self._apply_partition(state, containers,
+                              self.config.select_many(partitions))
 
     def join(self):
         state = self.state_factory.load()
-        self.network.restore(state.blockade_id)
+        self._apply_join(state)
+
+    # The _apply_* methods change the network of containers which were
+    # already looked up, so a caller holding on to running containers
+    # (like a chaos run) doesn't pay for asking Docker about them again.
+
+    def _apply_flaky(self, state, containers):
+        with phase("apply flaky"):
+            self.network.flaky_devices([c.veth_device for c in containers])
+            state.set_netem([c.name for c in containers],
+                            self.network.flaky_params())
+
+    def _apply_slow(self, state, containers):
+        with phase("apply slow"):
+            self.network.slow_devices([c.veth_device for c in containers])
+            state.set_netem([c.name for c in containers],
+                            self.network.slow_params())
+
+    def _apply_fast(self, state, containers):
+        with phase("apply fast"):
+            self.network.fast_devices([c.veth_device for c in containers])
+            state.set_netem([c.name for c in containers], None)
+
+    def _apply_partition(self, state, containers, partitions):
+        """Partition running containers by lists of their names
+        """
+        with phase("apply partition"):
+            container_dict = dict((c.name, c) for c in containers)
+            partitions = expand_partitions(list(container_dict.keys()),
+                                           partitions)
+
+            container_partitions = []
+            for partition in partitions:
+                container_partitions.append(
+                    [container_dict[c] for c in partition])
+
+            self.network.partition_containers(state.blockade_id,
+                                              container_partitions)
+            state.set_partitions(dict((name, index)
+                                      for index, partition in
+                                      enumerate(partitions, 1)
+                                      for name in partition))
+
+    def _apply_join(self, state):
+        with phase("apply join"):
+            self.network.restore(state.blockade_id)
+            state.set_partitions({})
 
     def logs(self, container_name):
         container = self._get_running_container(container_name)
         return self.docker_client.logs(container.container_id)
 
+    def _get_existing_containers(self, container_names=None):
+        """Get (name, container ID) pairs for containers, running or not
+        """
+        state = self.state_factory.load()
+        docker_containers = self._get_docker_containers(state.blockade_id)
+        if container_names is None:
+            container_names = sorted(docker_containers)
+        else:
+            container_names = self.config.select(container_names)
+        found = []
+        for name in container_names:
+            container = docker_containers.get(name)
+            if not container:
+                raise BlockadeError("Container %s is not found" % (name,))
+            found.append((name, container['Id']))
+        return found
+
+    def stream_logs(self, container_names=None, follow=False, since=None,
+                    timestamps=False):
+        """Yield LogLines from the logs of some or all containers
+
+        Lines are read as Docker sends them, one thread per container, and
+        yielded in the order they arrive, so memory use doesn't grow with
+        the size of the logs. Stopped containers' logs can be read too.
+        With follow, new lines are yielded until every container stops.
+        since is a Unix time; timestamps asks Docker for the time each line
+        was logged.
+        """
+        containers = self._get_existing_containers(container_names)
+
+        def lines(item):
+            name, container_id = item
+            chunks = docker_log_stream(self.docker_client, container_id,
+                                       follow=follow, since=since,
+                                       timestamps=timestamps)
+            for line in split_lines(chunks):
+                yield parse_log_line(name, line, timestamps)
+
+        return multiplex([lines(item) for item in containers])
+
+    def collect_logs(self, directory, container_names=None,
+                     compression="gzip"):
+        """Write the logs of some or all containers to compressed files
+
+        Each container's log is streamed from Docker into NAME.log.gz (or
+        NAME.log.zst for zstd) in directory, up to parallelism containers
+        at a time. Returns a LogArchive for each container.
+        """
+        if compression not in COMPRESSIONS:
+            raise BlockadeError("Unknown compression: %s" % (compression,))
+        containers = self._get_existing_containers(container_names)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        def collect(item):
+            name, container_id = item
+            chunks = docker_log_stream(self.docker_client, container_id)
+            path = os.path.join(directory, name + COMPRESSIONS[compression])
+            return archive_log(name, chunks, path, compression)
+
+        return parallel_map(collect, containers, self.parallelism)
+
 
 class Container(object):
     ip_address = None
@@ -236,6 +424,62 @@ class ContainerState(object):
     MISSING = "MISSING"
 
 
+def parallel_map(func, items, parallelism=DEFAULT_PARALLELISM, timeout=None):
+    """Call func on each item using a bounded pool of threads
+
+    Returns the results in the same order as items. If any call raises,
+    the first exception is raised here. If timeout is given, a call which
+    takes longer than timeout seconds raises a BlockadeError.
+    """
+    items = list(items)
+    if timeout is None and (len(items) < 2 or parallelism < 2):
+        return [func(item) for item in items]
+
+    from multiprocessing import TimeoutError
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(max(1, min(parallelism, len(items))))
+    try:
+        results = [pool.apply_async(func, (item,)) for item in items]
+        try:
+            return [result.get(timeout) for result in results]
+        except TimeoutError:
+            raise BlockadeError("Timed out after %s seconds" % (timeout,))
+    finally:
+        pool.terminate()
+
+
+def _docker_api_error():
+    # except clauses only evaluate this once something was raised, so
+    # commands which succeed never have to import docker-py for it
+    import docker
+    try:
+        return docker.APIError
+    except AttributeError:
+        # later docker-py only has it in docker.errors
+        from docker.errors import APIError
+        return APIError
+
+
+def _blockade_containers(blockade_id, containers):
+    # a daemon which ignores the filter gives us every container, so check
+    # each one belongs to the blockade, by label or else by name prefix
+    prefix = "/" + blockade_id + "-"
+    d = {}
+    for container in containers:
+        labels = container.get('Labels') or {}
+        if labels.get(BLOCKADE_ID_LABEL) == blockade_id:
+            name = labels.get(BLOCKADE_NAME_LABEL)
+            if name:
+                d[name] = container
+                continue
+        for name in container.get('Names') or ():
+            if name.startswith(prefix):
+                d[name[len(prefix):]] = container
+                break
+    return d
+
+
 def docker_container_name(blockade_id, name):
     return '-'.join((blockade_id, name))
 
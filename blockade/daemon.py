@@ -0,0 +1,320 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import errno
+import json
+import os
+import socket
+import traceback
+
+from .errors import BlockadeError, DaemonNotRunningError
+from .core import Blockade, Container, DEFAULT_STOP_TIMEOUT
+from .state import BLOCKADE_STATE_FILE, BLOCKADE_LEGACY_STATE_FILE
+
+BLOCKADE_DAEMON_SOCKET = ".blockade/daemon.sock"
+
+# Blockade methods which may be called through the daemon
+_COMMANDS = ("create", "destroy", "status", "flaky", "slow", "fast",
+             "partition", "join", "logs")
+
+
+class CachingBlockade(Blockade):
+    """Blockade which remembers what it learns from inspecting containers
+
+    A running container keeps its IP address and veth device, so its
+    inspection is reused until Docker lists it as stopped or gone.
+    """
+    def __init__(self, *args, **kwargs):
+        Blockade.__init__(self, *args, **kwargs)
+        self._inspect_cache = {}
+
+    def _inspect_container(self, container_id):
+        try:
+            return self._inspect_cache[container_id]
+        except KeyError:
+            pass
+        container = Blockade._inspect_container(self, container_id)
+        state = container.get('State')
+        if state and state.get('Running'):
+            self._inspect_cache[container_id] = container
+        return container
+
+    def _get_docker_containers(self, blockade_id):
+        containers = Blockade._get_docker_containers(self, blockade_id)
+        running = set(c['Id'] for c in containers.values()
+                      if c.get('Status', '').startswith('Up'))
+        for container_id in list(self._inspect_cache):
+            if container_id not in running:
+                self._inspect_cache.pop(container_id, None)
+        return containers
+
+
+class CachedStateFactory(object):
+    """State factory which loads the state once and keeps it
+
+    The state is loaded again whenever one of the state files in paths
+    is created, replaced or removed behind our back, as when a blockade
+    is destroyed and brought up again with --no-daemon. That drops the
+    old state's database connections along with its blockade ID.
+    """
+    def __init__(self, state_factory,
+                 paths=(BLOCKADE_STATE_FILE, BLOCKADE_LEGACY_STATE_FILE)):
+        self.state_factory = state_factory
+        self.paths = paths
+        self._state = None
+        self._files = None
+
+    def _stat_files(self):
+        files = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                files.append(None)
+            else:
+                # a new file can reuse a deleted file's inode, but not
+                # its change time
+                files.append((st.st_dev, st.st_ino, st.st_ctime))
+        return files
+
+    def initialize(self, containers, blockade_id=None):
+        self._state = self.state_factory.initialize(containers, blockade_id)
+        self._files = self._stat_files()
+        return self._state
+
+    def load(self):
+        files = self._stat_files()
+        if self._state is None or files != self._files:
+            self._state = None
+            self._state = self.state_factory.load()
+            self._files = files
+        return self._state
+
+    def destroy(self):
+        self._state = None
+        self.state_factory.destroy()
+
+
+class BlockadeDaemon(object):
+    """Serve Blockade commands over a Unix socket
+
+    Each request is a line of JSON naming a Blockade method and its
+    arguments. The response is a line of JSON holding either the result
+    or an error message. Requests are handled one at a time. A request
+    naming a config file other than config_path, the one the daemon
+    loaded, is refused.
+    """
+    def __init__(self, blockade, path=BLOCKADE_DAEMON_SOCKET,
+                 config_path=None):
+        self.blockade = blockade
+        self.path = path
+        self.config_path = config_path
+        self.server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            if daemon_running(self.path):
+                raise BlockadeError("A Blockade daemon is already listening "
+                                    "on %s" % (self.path,))
+            os.unlink(self.path)
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.server = _create_server(self.path, self)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        """Stop serve_forever() from another thread
+        """
+        if self.server:
+            self.server.shutdown()
+
+    def handle_request(self, request):
+        try:
+            command = request['command']
+            args = dict(request.get('args') or {})
+        except (KeyError, TypeError, AttributeError):
+            return dict(error="Invalid request: %r" % (request,))
+        if command not in _COMMANDS:
+            return dict(error="Unknown command: %s" % (command,))
+
+        config_path = request.get('config_path')
+        if (config_path and self.config_path and
+                os.path.realpath(config_path) !=
+                os.path.realpath(self.config_path)):
+            return dict(error="The Blockade daemon is using the config in "
+                        "%s, not %s. Restart the daemon to use that config, "
+                        "or pass --no-daemon" % (self.config_path,
+                                                 config_path))
+
+        parallelism = args.pop('parallelism', None)
+        default_parallelism = self.blockade.parallelism
+        if parallelism:
+            self.blockade.parallelism = parallelism
+        try:
+            result = getattr(self.blockade, command)(**args)
+            return dict(result=_encode_result(result))
+        except BlockadeError as e:
+            return dict(error=str(e))
+        except Exception:
+            return dict(error="Unexpected error in Blockade daemon:\n" +
+                        traceback.format_exc())
+        finally:
+            self.blockade.parallelism = default_parallelism
+
+
+def _create_server(path, daemon):
+    # socketserver is only needed by the daemon itself, not its clients
+    try:
+        import socketserver
+    except ImportError:
+        import SocketServer as socketserver
+
+    class DaemonRequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            if not line.strip():
+                return
+            try:
+                request = json.loads(line.decode())
+            except ValueError:
+                response = dict(error="Invalid request: not JSON")
+            else:
+                response = daemon.handle_request(request)
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+    return socketserver.UnixStreamServer(path, DaemonRequestHandler)
+
+
+def _encode_result(result):
+    if isinstance(result, list):
+        return [_encode_result(r) for r in result]
+    if isinstance(result, Container):
+        return result.to_dict()
+    if isinstance(result, bytes):
+        return result.decode("utf-8", "replace")
+    return result
+
+
+def _decode_containers(result):
+    return [Container(**d) for d in result]
+
+
+def call_daemon(command, path=BLOCKADE_DAEMON_SOCKET, config_path=None,
+                **args):
+    """Run a Blockade method in the daemon and return its result
+
+    config_path is the config file the caller means to use, so the daemon
+    can refuse the call if it is using a different one.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error as e:
+            if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                raise DaemonNotRunningError("No Blockade daemon is "
+                                            "listening on %s" % (path,))
+            raise
+        request = dict(command=command, args=args)
+        if config_path:
+            request['config_path'] = config_path
+        sock.sendall((json.dumps(request) + "\n").encode())
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+    try:
+        response = json.loads(b"".join(chunks).decode())
+    except ValueError:
+        raise BlockadeError("Blockade daemon sent an invalid response")
+    if 'error' in response:
+        raise BlockadeError(response['error'])
+    return response.get('result')
+
+
+def daemon_running(path=BLOCKADE_DAEMON_SOCKET):
+    if not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class BlockadeClient(object):
+    """Stands in for Blockade, running every call in the daemon
+    """
+    def __init__(self, path=BLOCKADE_DAEMON_SOCKET, parallelism=None,
+                 config_path=None):
+        self.path = path
+        self.parallelism = parallelism
+        self.config_path = config_path
+
+    def _call(self, command, **args):
+        if self.parallelism:
+            args['parallelism'] = self.parallelism
+        return call_daemon(command, self.path, self.config_path, **args)
+
+    def create(self):
+        return _decode_containers(self._call("create"))
+
+    def destroy(self, force=False, stop_timeout=DEFAULT_STOP_TIMEOUT,
+                kill=False):
+        self._call("destroy", force=force, stop_timeout=stop_timeout,
+                   kill=kill)
+
+    def status(self):
+        return _decode_containers(self._call("status"))
+
+    def flaky(self, container_names=None, include_all=False):
+        self._call("flaky", container_names=container_names,
+                   include_all=include_all)
+
+    def slow(self, container_names=None, include_all=False):
+        self._call("slow", container_names=container_names,
+                   include_all=include_all)
+
+    def fast(self, container_names=None, include_all=False):
+        self._call("fast", container_names=container_names,
+                   include_all=include_all)
+
+    def partition(self, partitions):
+        self._call("partition", partitions=partitions)
+
+    def join(self):
+        self._call("join")
+
+    def logs(self, container_name):
+        return self._call("logs", container_name=container_name)
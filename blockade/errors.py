@@ -38,3 +38,31 @@ class NotInitializedError(BlockadeError):
 class InconsistentStateError(BlockadeError):
     """Blockade state is inconsistent (partially created or destroyed)
     """
+
+
+class DaemonNotRunningError(BlockadeError):
+    """No Blockade daemon is listening in this context
+    """
+
+
+class IptablesLockError(BlockadeError):
+    """Another program held the xtables lock
+    """
+
+
+class NetlinkError(BlockadeError):
+    """Error reported by the kernel over a netlink socket
+    """
+    def __init__(self, errno, message):
+        BlockadeError.__init__(self, message)
+        self.errno = errno
+
+
+class UnsupportedNetemError(BlockadeError):
+    """netem parameters which can't be sent over netlink
+    """
+
+
+class ScenarioError(BlockadeError):
+    """Error in a fault scenario
+    """
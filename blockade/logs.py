@@ -0,0 +1,236 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import contextlib
+import datetime
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .errors import BlockadeError
+
+# longer lines are split, so a log without newlines can't use up memory
+MAX_LINE = 65536
+
+# lines read ahead of the consumer, across all containers
+QUEUE_SIZE = 1024
+
+# compressing lines one by one is slow, so they are written in blocks
+WRITE_SIZE = 65536
+
+# file extension for each compression collect-logs can write
+COMPRESSIONS = {"gzip": ".log.gz", "zstd": ".log.zst"}
+
+
+class LogLine(object):
+    """One line of a container's log
+
+    timestamp is when Docker logged it, if Docker said, or else when we
+    read it, as an RFC 3339 string in UTC.
+    """
+    def __init__(self, name, timestamp, text):
+        self.name = name
+        self.timestamp = timestamp
+        self.text = text
+
+
+def docker_log_stream(docker_client, container_id, follow=False, since=None,
+                      timestamps=False):
+    """Yield chunks of a container's log as Docker sends them
+    """
+    try:
+        stream = docker_client.logs(container_id, stream=True, follow=follow,
+                                    since=since, timestamps=timestamps)
+    except TypeError:
+        # docker-py from before logs could be streamed
+        if since is not None:
+            raise BlockadeError("This version of docker-py can't fetch logs "
+                                "since a time")
+        if follow:
+            stream = docker_client.attach(container_id, stream=True,
+                                          logs=True)
+        else:
+            stream = [docker_client.logs(container_id)]
+    for chunk in stream:
+        yield chunk
+
+
+def split_lines(chunks, max_line=MAX_LINE):
+    """Yield the lines (as bytes, without newlines) in a stream of chunks
+    """
+    pending = b""
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode("utf-8")
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+        while len(pending) >= max_line:
+            yield pending[:max_line]
+            pending = pending[max_line:]
+    if pending:
+        yield pending
+
+
+def _utcnow():
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+
+def parse_log_line(name, line, timestamps=False):
+    """Make a LogLine, taking the timestamp Docker put in front if asked
+    """
+    text = line.decode("utf-8", "replace").rstrip("\r")
+    if timestamps:
+        stamp, sep, rest = text.partition(" ")
+        if sep and stamp[:4].isdigit() and stamp.endswith("Z"):
+            return LogLine(name, stamp, rest)
+    return LogLine(name, _utcnow(), text)
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def multiplex(sources, queue_size=QUEUE_SIZE):
+    """Yield the items of several iterables as they arrive
+
+    Each source is read by its own thread. At most queue_size items wait
+    to be consumed, so a slow consumer holds the readers back rather than
+    piling up items. If a source raises, the error is raised here. When
+    the generator is closed, the readers stop at their next item.
+    """
+    items = queue.Queue(queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(source):
+        try:
+            for item in source:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_Failure(e))
+        finally:
+            put(done)
+
+    remaining = 0
+    for source in sources:
+        thread = threading.Thread(target=read, args=(source,))
+        thread.daemon = True
+        thread.start()
+        remaining += 1
+
+    try:
+        while remaining:
+            try:
+                # a timeout, so Ctrl-C still gets through on Python 2
+                item = items.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+class LogArchive(object):
+    """A container's log written to a compressed file
+
+    size is the length of the log itself, compressed_size that of the file.
+    """
+    def __init__(self, name, path, size, compressed_size, seconds):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.compressed_size = compressed_size
+        self.seconds = seconds
+
+    def to_dict(self):
+        return dict(name=self.name, path=self.path, size=self.size,
+                    compressed_size=self.compressed_size,
+                    seconds=self.seconds)
+
+
+@contextlib.contextmanager
+def _compressed_file(path, compression):
+    if compression == "gzip":
+        import gzip
+        f = gzip.open(path, "wb")
+        try:
+            yield f
+        finally:
+            f.close()
+        return
+
+    try:
+        import zstandard
+    except ImportError:
+        raise BlockadeError("zstd compression needs the zstandard package")
+    f = open(path, "wb")
+    try:
+        with zstandard.ZstdCompressor().stream_writer(f) as writer:
+            yield writer
+    finally:
+        f.close()
+
+
+def archive_log(name, chunks, path, compression="gzip"):
+    """Write a stream of log chunks to a compressed file
+
+    Chunks are compressed as they arrive, a block of up to WRITE_SIZE bytes
+    at a time, so the log is never held in memory.
+    """
+    if compression not in COMPRESSIONS:
+        raise BlockadeError("Unknown compression: %s" % (compression,))
+    start = time.time()
+    size = 0
+    with _compressed_file(path, compression) as f:
+        block = []
+        block_size = 0
+        for chunk in chunks:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            block.append(chunk)
+            block_size += len(chunk)
+            if block_size >= WRITE_SIZE:
+                f.write(b"".join(block))
+                size += block_size
+                block = []
+                block_size = 0
+        f.write(b"".join(block))
+        size += block_size
+    return LogArchive(name, path, size, os.path.getsize(path),
+                      time.time() - start)
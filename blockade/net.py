@@ -15,11 +15,20 @@
 #
 
 import random
+import re
 import string
 import subprocess
+import time
 
-from .errors import BlockadeError
-import collections
+from .errors import BlockadeError, IptablesLockError
+
+# times to try an iptables-restore while something else holds the
+# xtables lock, and seconds to wait before trying again
+_IPTABLES_ATTEMPTS = 3
+_IPTABLES_RETRY_WAIT = 0.1
+
+# iptables exits with this status when it can't take the xtables lock
+_XTABLES_RESOURCE_PROBLEM = 4
 
 
 class NetworkState(object):
@@ -32,36 +41,137 @@ class NetworkState(object):
 class BlockadeNetwork(object):
     def __init__(self, config):
         self.config = config
+        self.traffic_control = get_traffic_control(
+            config.network.get('traffic_control'))
+        self.firewall = get_firewall(config.network.get('firewall'))
 
     def new_veth_device_name(self):
         chars = string.ascii_letters + string.digits
         return "veth" + "".join(random.choice(chars) for _ in range(8))
 
     def network_state(self, device):
-        return network_state(device)
+        return self.traffic_control.network_state(device)
+
+    def network_states(self):
+        return self.traffic_control.network_states()
+
+    def flaky_params(self):
+        return ["loss"] + self.config.network['flaky'].split()
+
+    def slow_params(self):
+        return ["delay"] + self.config.network['slow'].split()
 
     def flaky(self, device):
-        flaky_config = self.config.network['flaky'].split()
-        traffic_control_netem(device, ["loss"] + flaky_config)
+        self.traffic_control.netem(device, self.flaky_params())
 
     def slow(self, device):
-        slow_config = self.config.network['slow'].split()
-        traffic_control_netem(device, ["delay"] + slow_config)
+        self.traffic_control.netem(device, self.slow_params())
 
     def fast(self, device):
-        traffic_control_restore(device)
+        self.traffic_control.restore(device)
+
+    def flaky_devices(self, devices):
+        self.traffic_control.netem_devices(devices, self.flaky_params())
+
+    def slow_devices(self, devices):
+        self.traffic_control.netem_devices(devices, self.slow_params())
+
+    def fast_devices(self, devices):
+        self.traffic_control.restore_devices(devices)
 
     def restore(self, blockade_id):
-        clear_iptables(blockade_id)
+        self.firewall.clear(blockade_id)
 
     def partition_containers(self, blockade_id, partitions):
-        clear_iptables(blockade_id)
+        self.firewall.partition(blockade_id, partitions)
+
+    def get_ip_partitions(self, blockade_id):
+        return self.firewall.get_ip_partitions(blockade_id)
+
+
+class TrafficControl(object):
+    """Traffic control by way of the tc binary
+    """
+    def netem(self, device, params):
+        traffic_control_netem(device, params)
+
+    def restore(self, device):
+        traffic_control_restore(device)
+
+    def netem_devices(self, devices, params):
+        traffic_control_netem_devices(devices, params)
+
+    def restore_devices(self, devices):
+        traffic_control_restore_devices(devices)
+
+    def network_state(self, device):
+        return network_state(device)
+
+    def network_states(self):
+        return network_states()
+
+
+def get_traffic_control(name=None):
+    """Get the traffic control backend configured by name
+
+    "netlink" talks to the kernel directly, falling back to the tc binary
+    for anything it can't express. Anything else uses the tc binary.
+    """
+    if name == "netlink":
+        from .netlink import NetlinkTrafficControl
+        return NetlinkTrafficControl(fallback=TrafficControl())
+    return TrafficControl()
+
+
+class IptablesFirewall(object):
+    """Partitions by way of iptables chains
+    """
+    def partition(self, blockade_id, partitions):
         partition_containers(blockade_id, partitions)
 
+    def clear(self, blockade_id):
+        clear_iptables(blockade_id)
+
     def get_ip_partitions(self, blockade_id):
         return iptables_get_source_chains(blockade_id)
 
 
+class IpsetFirewall(IptablesFirewall):
+    """Partitions by way of iptables chains matching on ipsets
+
+    Each partition has an ipset of its members and a chain holding a
+    single rule, so the per-packet cost is a couple of hash lookups.
+    Moving containers between the same number of partitions only changes
+    set membership and leaves the chains alone.
+    """
+    def partition(self, blockade_id, partitions):
+        partition_containers_ipset(blockade_id, partitions)
+
+    def clear(self, blockade_id):
+        clear_iptables(blockade_id)
+
+        # sets can only be destroyed once no rule refers to them
+        ipset_destroy_blockade_sets(blockade_id)
+
+    def get_ip_partitions(self, blockade_id):
+        return ipset_get_ip_partitions(blockade_id)
+
+
+def get_firewall(name=None):
+    """Get the partitioning backend configured by name
+
+    "nftables" uses nft sets and an atomic nft -f transaction. "ipset"
+    uses iptables chains matching on ipsets. Anything else uses plain
+    iptables rules.
+    """
+    if name == "nftables":
+        from .nftables import NftablesFirewall
+        return NftablesFirewall()
+    if name == "ipset":
+        return IpsetFirewall()
+    return IptablesFirewall()
+
+
 def parse_partition_index(blockade_id, chain):
     prefix = "%s-p" % (blockade_id,)
     if chain and chain.startswith(prefix):
@@ -85,14 +195,36 @@ def iptables_call_output(*args):
         raise BlockadeError("Problem calling '%s'" % " ".join(cmd))
 
 
-def iptables_call(*args):
-    cmd = ["iptables"] + list(args)
+def iptables_save():
+    """Dump the filter table in iptables-save format
+    """
+    cmd = ["iptables-save", "-t", "filter"]
     try:
-        subprocess.check_call(cmd)
+        output = subprocess.check_output(cmd)
+        return output.decode().split("\n")
     except subprocess.CalledProcessError:
         raise BlockadeError("Problem calling '%s'" % " ".join(cmd))
 
 
+def iptables_restore(lines):
+    """Apply iptables-save formatted lines in a single transaction
+
+    Runs with --noflush so rules we don't mention are left alone. If any
+    line fails, none of them are applied.
+    """
+    cmd = ["iptables-restore", "--noflush"]
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    _, stderr = p.communicate(("\n".join(lines) + "\n").encode())
+    if p.returncode != 0:
+        stderr = stderr.decode().strip()
+        message = "Problem calling '%s': %s" % (" ".join(cmd), stderr)
+        if (p.returncode == _XTABLES_RESOURCE_PROBLEM or
+                "xtables lock" in stderr):
+            raise IptablesLockError(message)
+        raise BlockadeError(message)
+
+
 def iptables_get_chain_rules(chain):
     if not chain:
         raise ValueError("invalid chain")
@@ -134,108 +266,358 @@ def iptables_get_source_chains(blockade_id):
     return result
 
 
-def iptables_delete_rules(chain, predicate):
-    if not chain:
-        raise ValueError("invalid chain")
-    if not isinstance(predicate, collections.Callable):
-        raise ValueError("invalid predicate")
+def iptables_transaction(build):
+    """Apply iptables-restore input built from the current rules
 
-    lines = iptables_get_chain_rules(chain)
+    build is called with iptables-save output and returns the lines to
+    restore, or an empty list if there is nothing to do. Rules are deleted
+    by their exact spec rather than their position, and iptables-restore
+    applies all of the lines under the xtables lock, so rules which Docker
+    or other blockades add or remove meanwhile are left alone. If another
+    program holds the lock, the restore is tried again a little later
+    against fresh rules. Any other failure is raised straight away.
+    """
+    for attempt in range(1, _IPTABLES_ATTEMPTS + 1):
+        lines = build(iptables_save())
+        if not lines:
+            return
+        try:
+            iptables_restore(lines)
+            return
+        except IptablesLockError:
+            if attempt == _IPTABLES_ATTEMPTS:
+                raise
+            time.sleep(_IPTABLES_RETRY_WAIT * attempt)
 
-    # TODO this is susceptible to check-then-act races.
-    # better to ultimately switch to python-iptables if it becomes less buggy
-    for index, line in reversed(list(enumerate(lines, 1))):
-        line = line.strip()
-        if line and predicate(line):
-            iptables_call("-D", chain, str(index))
+
+def clear_iptables(blockade_id):
+    """Remove all iptables rules and chains related to this blockade
+    """
+    # references to our chains and then the chains themselves, all in one
+    # transaction
+    def build(lines):
+        chain_rules, jumps = iptables_get_partition_layout(blockade_id, lines)
+        return iptables_partition_delta(blockade_id, [], chain_rules, jumps)
+    iptables_transaction(build)
 
 
-def iptables_delete_blockade_rules(blockade_id):
-    def predicate(rule):
-        target = rule.split()[0]
+def _iptables_replace_chains(chains, old_chains, old_rules):
+    """Start iptables-restore input which swaps old chains for new ones
+
+    The new chains are left empty and the old FORWARD jumps are removed.
+    """
+    # declaring a user chain creates it, or flushes it if it already exists
+    lines = ["*filter"]
+    lines.extend(":%s - [0:0]" % (chain,) for chain in chains)
+
+    # unhook the old partitions before removing any chains they jump to
+    lines.extend("-D FORWARD " + rule for rule in old_rules)
+    for chain in old_chains:
+        if chain not in chains:
+            lines.extend(["-F " + chain, "-X " + chain])
+    return lines
+
+
+def _rule_option(parts, option):
+    """Get the value of an option like -s or -j from a split rule spec
+    """
+    try:
+        value = parts[parts.index(option) + 1]
+    except (ValueError, IndexError):
+        return None
+    # iptables-save spells a single address as a /32 network
+    return value[:-3] if value.endswith("/32") else value
+
+
+def iptables_get_partition_layout(blockade_id, lines=None):
+    """Read the partitions a blockade currently has applied
+
+    Works from iptables-save output. Returns a pair:
+
+    - a dict of partition chain -> list of (rule spec, dropped IP) for
+      the rules in the chain. The IP is None for a rule which isn't a
+      plain DROP of one destination.
+    - a list of (rule spec, source IP, chain) for the FORWARD rules
+      jumping to a partition chain. The IP is None for a rule which
+      doesn't match one source.
+
+    Rule specs are as iptables-save prints them, without "-A <chain>", so
+    they can be handed back to "-D <chain>".
+    """
+    if not blockade_id:
+        raise ValueError("invalid blockade_id")
+    if lines is None:
+        lines = iptables_save()
+
+    def is_blockade_chain(chain):
         try:
-            parse_partition_index(blockade_id, target)
+            parse_partition_index(blockade_id, chain)
         except ValueError:
             return False
         return True
-    iptables_delete_rules("FORWARD", predicate)
+
+    chain_rules = {}
+    jumps = []
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0].startswith(":"):
+            if is_blockade_chain(parts[0][1:]):
+                chain_rules.setdefault(parts[0][1:], [])
+        elif parts[0] == "-A" and len(parts) > 2:
+            chain, spec, target = (parts[1], " ".join(parts[2:]),
+                                   _rule_option(parts, "-j"))
+            if chain == "FORWARD" and is_blockade_chain(target):
+                jumps.append((spec, _rule_option(parts, "-s"), target))
+            elif is_blockade_chain(chain):
+                dropped = None
+                if target == "DROP" and len(parts) == 6:
+                    dropped = _rule_option(parts, "-d")
+                chain_rules.setdefault(chain, []).append((spec, dropped))
+    return chain_rules, jumps
+
+
+def iptables_partition_delta(blockade_id, partitions, chain_rules=None,
+                             jumps=()):
+    """Build iptables-restore input moving a blockade to new partitions
+
+    chain_rules and jumps describe what is currently applied, as returned
+    by iptables_get_partition_layout(). Partition N keeps using chain
+    "<blockade_id>-pN", and only the rules which differ between the
+    current and wanted partitions are added or deleted, so moving one
+    container touches a handful of rules however big the blockade is.
+    Returns an empty list if nothing needs to change.
+
+    Everything goes through a single iptables-restore transaction, so the
+    old and new partitions swap atomically.
+    """
+    chain_rules = chain_rules or {}
+    if not partitions or len(partitions) == 1:
+        partitions = []
+    chains = [partition_chain_name(blockade_id, index)
+              for index in range(1, len(partitions) + 1)]
+    partition_ips = [[c.ip_address for c in partition if c.ip_address]
+                     for partition in partitions]
+    all_ips = set(ip for ips in partition_ips for ip in ips)
+    wanted_jumps = dict((ip, chain) for chain, ips in zip(chains,
+                                                          partition_ips)
+                        for ip in ips)
+
+    # keep one current FORWARD jump per container that already goes to
+    # the right chain, and delete the rest
+    kept_jumps = set()
+    delete_lines = []
+    for spec, source, chain in jumps:
+        if (source is not None and wanted_jumps.get(source) == chain and
+                source not in kept_jumps):
+            kept_jumps.add(source)
+        else:
+            delete_lines.append("-D FORWARD " + spec)
+
+    # declaring a user chain creates it, or flushes it if it already
+    # exists, so only chains which are missing are declared
+    lines = ["*filter"]
+    lines.extend(":%s - [0:0]" % (chain,) for chain in chains
+                 if chain not in chain_rules)
+
+    for chain, ips in zip(chains, partition_ips):
+        # block traffic TO any other partition
+        dropped = all_ips.difference(ips)
+        kept = set()
+        for spec, ip in chain_rules.get(chain, ()):
+            if ip in dropped and ip not in kept:
+                kept.add(ip)
+            else:
+                delete_lines.append("-D %s %s" % (chain, spec))
+        for ip in sorted(dropped - kept):
+            lines.append("-A %s -d %s -j DROP" % (chain, ip))
+
+        # direct traffic FROM any container in the partition to its chain
+        for ip in ips:
+            if ip not in kept_jumps:
+                lines.append("-I FORWARD -s %s -j %s" % (ip, chain))
+
+    # stale chains go last, once nothing jumps to them
+    for chain in sorted(chain_rules):
+        if chain not in chains:
+            delete_lines.extend(["-F " + chain, "-X " + chain])
+
+    if len(lines) == 1 and not delete_lines:
+        return []
+    return lines + delete_lines + ["COMMIT"]
 
 
-def iptables_delete_blockade_chains(blockade_id):
+def partition_containers(blockade_id, partitions):
+    """Move the blockade's containers into new partitions
+
+    The applied partitions are read with a single iptables-save, and only
+    the difference is committed with a single iptables-restore. There is
+    no point at which the old partitions are gone and the new ones not yet
+    in place.
+    """
+    def build(lines):
+        chain_rules, jumps = iptables_get_partition_layout(blockade_id, lines)
+        return iptables_partition_delta(blockade_id, partitions, chain_rules,
+                                        jumps)
+    iptables_transaction(build)
+
+
+def ipset_members_name(blockade_id):
+    return "%s-all" % (blockade_id,)
+
+
+def ipset_save():
+    """Dump all ipsets in ipset save format
+    """
+    cmd = ["ipset", "save"]
+    try:
+        output = subprocess.check_output(cmd)
+        return output.decode().split("\n")
+    except OSError as e:
+        raise _ipset_missing(cmd, e)
+    except subprocess.CalledProcessError:
+        raise BlockadeError("Problem calling '%s'" % " ".join(cmd))
+
+
+def ipset_restore(lines):
+    """Apply ipset save formatted lines with a single ipset process
+    """
+    cmd = ["ipset", "-exist", "restore"]
+    try:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise _ipset_missing(cmd, e)
+    _, stderr = p.communicate(("\n".join(lines) + "\n").encode())
+    if p.returncode != 0:
+        raise BlockadeError("Problem calling '%s': %s" %
+                            (" ".join(cmd), stderr.decode().strip()))
+
+
+def _ipset_missing(cmd, error):
+    return BlockadeError("Problem calling '%s': %s. The ipset firewall "
+                         "needs the ipset tool installed" %
+                         (" ".join(cmd), error))
+
+
+def ipset_get_blockade_sets(blockade_id, lines=None):
+    """Get a map of set name -> set of member IPs for a blockade's ipsets
+    """
     if not blockade_id:
         raise ValueError("invalid blockade_id")
+    if lines is None:
+        lines = ipset_save()
+    members_name = ipset_members_name(blockade_id)
+
+    def is_blockade_set(name):
+        if name == members_name:
+            return True
+        try:
+            parse_partition_index(blockade_id, name)
+        except ValueError:
+            return False
+        return True
 
-    lines = iptables_call_output("-L")
+    sets = {}
     for line in lines:
         parts = line.split()
-        if len(parts) >= 2 and parts[0] == "Chain":
-            chain = parts[1]
-            try:
-                parse_partition_index(blockade_id, chain)
-            except ValueError:
-                continue
-            # if we are a valid blockade chain, flush and delete
-            iptables_call("-F", chain)
-            iptables_call("-X", chain)
-
-
-def iptables_insert_rule(chain, src=None, dest=None, target=None):
-    """Insert a new rule in the chain
-    """
-    if not chain:
-        raise ValueError("Invalid chain")
-    if not target:
-        raise ValueError("Invalid target")
-    if not (src or dest):
-        raise ValueError("Need src, dest, or both")
-
-    args = ["-I", chain]
-    if src:
-        args += ["-s", src]
-    if dest:
-        args += ["-d", dest]
-    args += ["-j", target]
-    iptables_call(*args)
-
-
-def iptables_create_chain(chain):
-    """Create a new chain
+        if len(parts) < 3 or not is_blockade_set(parts[1]):
+            continue
+        if parts[0] == "create":
+            sets.setdefault(parts[1], set())
+        elif parts[0] == "add":
+            sets.setdefault(parts[1], set()).add(parts[2])
+    return sets
+
+
+def ipset_get_ip_partitions(blockade_id):
+    """Get a map of IP -> partition index from a blockade's ipsets
     """
-    if not chain:
-        raise ValueError("Invalid chain")
-    iptables_call("-N", chain)
+    result = {}
+    for name, ips in ipset_get_blockade_sets(blockade_id).items():
+        try:
+            index = parse_partition_index(blockade_id, name)
+        except ValueError:
+            continue
+        for ip in ips:
+            result[ip] = index
+    return result
 
 
-def clear_iptables(blockade_id):
-    """Remove all iptables rules and chains related to this blockade
+def ipset_destroy_blockade_sets(blockade_id):
+    sets = ipset_get_blockade_sets(blockade_id)
+    if sets:
+        ipset_restore(["destroy " + name for name in sorted(sets)])
+
+
+def iptables_ipset_ruleset(blockade_id, count, old_chains=(), old_rules=()):
+    """Build iptables-restore input for count ipset-matched partitions
     """
-    # first remove refererences to our custom chains
-    iptables_delete_blockade_rules(blockade_id)
+    members_name = ipset_members_name(blockade_id)
+    chains = [partition_chain_name(blockade_id, index)
+              for index in range(1, count + 1)]
+    lines = _iptables_replace_chains(chains, old_chains, old_rules)
 
-    # then remove the chains themselves
-    iptables_delete_blockade_chains(blockade_id)
+    # each partition's set shares its chain's name
+    for chain in chains:
+        lines.append("-A %s -m set ! --match-set %s dst "
+                     "-m set --match-set %s dst -j DROP" %
+                     (chain, chain, members_name))
+        lines.append("-I FORWARD -m set --match-set %s src -j %s" %
+                     (chain, chain))
 
+    lines.append("COMMIT")
+    return lines
 
-def partition_containers(blockade_id, partitions):
-    if not partitions or len(partitions) == 1:
-        return
-    for index, partition in enumerate(partitions, 1):
-        chain_name = partition_chain_name(blockade_id, index)
 
-        # create chain for partition and block traffic TO any other partition
-        iptables_create_chain(chain_name)
-        for other in partitions:
-            if partition is other:
-                continue
-            for container in other:
-                if container.ip_address:
-                    iptables_insert_rule(chain_name, dest=container.ip_address,
-                                         target="DROP")
+def partition_containers_ipset(blockade_id, partitions):
+    """Replace any existing partitions of the blockade using ipsets
+
+    If the number of partitions is unchanged, only set membership is
+    updated. Otherwise the partition chains are rebuilt in a single
+    iptables-restore transaction as well.
+    """
+    if not partitions or len(partitions) == 1:
+        partitions = []
 
-        # direct traffic FROM any container in the partition to the new chain
-        for container in partition:
-            iptables_insert_rule("FORWARD", src=container.ip_address,
-                                 target=chain_name)
+    wanted = {}
+    for index, partition in enumerate(partitions, 1):
+        wanted[partition_chain_name(blockade_id, index)] = set(
+            c.ip_address for c in partition if c.ip_address)
+    if wanted:
+        wanted[ipset_members_name(blockade_id)] = set().union(
+            *wanted.values())
+
+    current = ipset_get_blockade_sets(blockade_id)
+
+    # add new members before removing old ones, so a moving container is
+    # never briefly outside of every partition
+    lines = []
+    for name in sorted(wanted):
+        if name not in current:
+            lines.append("create %s hash:ip" % (name,))
+        for ip in sorted(wanted[name] - current.get(name, set())):
+            lines.append("add %s %s" % (name, ip))
+    for name in sorted(wanted):
+        for ip in sorted(current.get(name, set()) - wanted[name]):
+            lines.append("del %s %s" % (name, ip))
+    if lines:
+        ipset_restore(lines)
+
+    if sorted(wanted) != sorted(current):
+        def build(lines):
+            chain_rules, jumps = iptables_get_partition_layout(blockade_id,
+                                                               lines)
+            return iptables_ipset_ruleset(
+                blockade_id, len(partitions), sorted(chain_rules),
+                [spec for spec, _, _ in jumps])
+        iptables_transaction(build)
+
+        # sets can only be destroyed once no rule refers to them
+        stale = sorted(name for name in current if name not in wanted)
+        if stale:
+            ipset_restore(["destroy " + name for name in stale])
 
 
 def traffic_control_restore(device):
@@ -247,9 +629,8 @@ def traffic_control_restore(device):
     stderr = stderr.decode()
 
     if p.returncode != 0:
-        if p.returncode == 2 and stderr:
-            if "No such file or directory" in stderr:
-                return
+        if p.returncode == 2 and _no_root_qdisc(stderr):
+            return
 
         # TODO log error somewhere?
         raise BlockadeError("Problem calling traffic control: " +
@@ -268,17 +649,130 @@ def traffic_control_netem(device, params):
                             " ".join(cmd))
 
 
+# tc -force -batch reports each failed line as "Command failed FILE:LINE"
+_BATCH_FAILURE = re.compile(r"^Command failed .*:(\d+)$")
+
+
+def traffic_control_batch(commands):
+    """Run many tc commands with a single tc process
+
+    commands are lists of tc arguments, without the "tc". With -force, tc
+    carries on past a line which fails, so one bad device doesn't stop
+    the rest changing. Returns a dict of the index of each command which
+    failed -> tc's error message for it.
+    """
+    if not commands:
+        return {}
+    cmd = ["tc", "-force", "-batch", "-"]
+    batch = "".join(" ".join(command) + "\n" for command in commands)
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    _, stderr = p.communicate(batch.encode())
+    stderr = stderr.decode()
+    failures = parse_batch_failures(stderr)
+    if p.returncode != 0 and not failures:
+        raise BlockadeError("Problem calling traffic control: %s: %s" %
+                            (" ".join(cmd), stderr.strip()))
+    return failures
+
+
+def parse_batch_failures(output):
+    """Get a dict of line index -> error message from tc -batch errors
+
+    tc prints a line's errors and then the "Command failed" line naming
+    it, counting lines from 1.
+    """
+    failures = {}
+    messages = []
+    for line in output.split("\n"):
+        line = line.strip()
+        match = _BATCH_FAILURE.match(line)
+        if match:
+            failures[int(match.group(1)) - 1] = " ".join(messages)
+            messages = []
+        elif line:
+            messages.append(line)
+    return failures
+
+
+def traffic_control_netem_devices(devices, params):
+    """Replace the root qdisc of every device with netem in one tc call
+    """
+    commands = [["qdisc", "replace", "dev", device, "root", "netem"] + params
+                for device in devices]
+    _check_batch(commands, traffic_control_batch(commands))
+
+
+def traffic_control_restore_devices(devices):
+    """Delete the root qdisc of every device in one tc call
+
+    Devices which are already back to normal are left alone.
+    """
+    commands = [["qdisc", "del", "dev", device, "root"]
+                for device in devices]
+    failures = traffic_control_batch(commands)
+    _check_batch(commands, dict(
+        (index, message) for index, message in failures.items()
+        if not _no_root_qdisc(message)))
+
+
+def _check_batch(commands, failures):
+    if failures:
+        raise BlockadeError("Problem calling traffic control: " + "; ".join(
+            "tc %s: %s" % (" ".join(commands[index]), failures[index])
+            for index in sorted(failures)))
+
+
+def _no_root_qdisc(message):
+    # older kernels report deleting a missing qdisc as ENOENT, newer ones
+    # refuse to delete the default qdisc
+    return ("No such file or directory" in message or
+            "handle of zero" in message)
+
+
 def network_state(device):
     try:
         output = subprocess.check_output(
             ["tc", "qdisc", "show", "dev", device]).decode()
-        # sloppy but good enough for now
-        if " delay " in output:
-            return NetworkState.SLOW
-        if " loss " in output:
-            return NetworkState.FLAKY
-        return NetworkState.NORMAL
+        return _qdisc_network_state(output)
 
     except subprocess.CalledProcessError:
         # TODO log error somewhere?
         return NetworkState.UNKNOWN
+
+
+def network_states():
+    """Get the state of every device on the host with a single tc call
+
+    Returns a dict of device name -> NetworkState. Devices that tc does
+    not report a root qdisc for are left out, as is every device if tc
+    fails, so their state shows as unknown.
+    """
+    try:
+        output = subprocess.check_output(["tc", "qdisc", "show"]).decode()
+    except subprocess.CalledProcessError:
+        return {}
+    return parse_network_states(output)
+
+
+def parse_network_states(output):
+    states = {}
+    for line in output.split("\n"):
+        parts = line.split()
+        if not (parts and parts[0] == "qdisc" and "root" in parts):
+            continue
+        try:
+            device = parts[parts.index("dev") + 1]
+        except (ValueError, IndexError):
+            continue
+        states[device] = _qdisc_network_state(line)
+    return states
+
+
+def _qdisc_network_state(output):
+    # sloppy but good enough for now
+    if " delay " in output:
+        return NetworkState.SLOW
+    if " loss " in output:
+        return NetworkState.FLAKY
+    return NetworkState.NORMAL
@@ -0,0 +1,415 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import errno
+import os
+import socket
+import struct
+
+from .errors import BlockadeError, NetlinkError, UnsupportedNetemError
+from .net import NetworkState
+
+NETLINK_ROUTE = 0
+
+RTM_NEWQDISC = 36
+RTM_DELQDISC = 37
+RTM_GETQDISC = 38
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_REPLACE = 0x100
+NLM_F_CREATE = 0x400
+NLM_F_DUMP = 0x300
+
+TCA_KIND = 1
+TCA_OPTIONS = 2
+
+TCA_NETEM_CORR = 1
+TCA_NETEM_DELAY_DIST = 2
+
+TC_H_ROOT = 0xFFFFFFFF
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_TCMSG = struct.Struct("=BxxxiIII")
+_RTATTR = struct.Struct("=HH")
+_NETEM_QOPT = struct.Struct("=IIIIII")
+_NETEM_CORR = struct.Struct("=III")
+
+_UINT32_MAX = 0xFFFFFFFF
+_DEFAULT_LIMIT = 1000
+
+_TIME_UNITS = (
+    (("s", "sec", "secs"), 1000000.0),
+    (("ms", "msec", "msecs"), 1000.0),
+    (("us", "usec", "usecs"), 1.0),
+    (("ns", "nsec", "nsecs"), 0.001),
+)
+
+_TC_LIB_DIRS = ("/usr/lib/tc", "/usr/lib64/tc", "/usr/local/lib/tc")
+
+
+class NetlinkTrafficControl(object):
+    """Traffic control by way of an rtnetlink socket
+
+    Speaks just enough rtnetlink to add, replace, delete and dump netem
+    qdiscs without running the tc binary. netem parameters the encoder
+    doesn't understand are handed to the fallback backend, normally the
+    tc binary.
+    """
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+        self._seq = 0
+
+    def netem(self, device, params):
+        try:
+            attrs = netem_attrs(params)
+        except UnsupportedNetemError:
+            if self.fallback is None:
+                raise
+            return self.fallback.netem(device, params)
+        self._replace_qdisc(device, attrs)
+
+    def restore(self, device):
+        try:
+            self._request(RTM_DELQDISC, 0, device_index(device))
+        except NetlinkError as e:
+            # there was no qdisc of ours to delete
+            if e.errno != errno.ENOENT:
+                raise
+
+    def netem_devices(self, devices, params):
+        # encoded once for every device
+        try:
+            attrs = netem_attrs(params)
+        except UnsupportedNetemError:
+            if self.fallback is None:
+                raise
+            return self.fallback.netem_devices(devices, params)
+        for device in devices:
+            self._replace_qdisc(device, attrs)
+
+    def restore_devices(self, devices):
+        for device in devices:
+            self.restore(device)
+
+    def network_state(self, device):
+        return self.network_states().get(device, NetworkState.UNKNOWN)
+
+    def network_states(self):
+        names = device_names()
+        states = {}
+        for message in self._dump(RTM_GETQDISC):
+            ifindex, parent, kind, options = parse_qdisc_message(message)
+            if parent == TC_H_ROOT and ifindex in names:
+                states[names[ifindex]] = qdisc_network_state(kind, options)
+        return states
+
+    def _replace_qdisc(self, device, attrs):
+        self._request(RTM_NEWQDISC, NLM_F_CREATE | NLM_F_REPLACE,
+                      device_index(device), attrs)
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _request(self, msg_type, flags, ifindex, attrs=b""):
+        seq = self._next_seq()
+        payload = _TCMSG.pack(socket.AF_UNSPEC, ifindex, 0, TC_H_ROOT, 0)
+        message = nlmsg(msg_type, NLM_F_REQUEST | NLM_F_ACK | flags, seq,
+                        payload + attrs)
+        sock = _open_socket()
+        try:
+            sock.send(message)
+            for msg_type, body in _receive(sock, seq):
+                if msg_type == NLMSG_ERROR:
+                    check_ack(body)
+                    return
+        finally:
+            sock.close()
+
+    def _dump(self, msg_type):
+        seq = self._next_seq()
+        payload = _TCMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        message = nlmsg(msg_type, NLM_F_REQUEST | NLM_F_DUMP, seq, payload)
+        sock = _open_socket()
+        try:
+            sock.send(message)
+            messages = []
+            for msg_type, body in _receive(sock, seq):
+                if msg_type == NLMSG_DONE:
+                    return messages
+                if msg_type == NLMSG_ERROR:
+                    check_ack(body)
+                else:
+                    messages.append(body)
+        finally:
+            sock.close()
+
+
+def _open_socket():
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def _receive(sock, seq):
+    """Yield (type, body) of each message answering request seq
+    """
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            raise BlockadeError("netlink socket closed unexpectedly")
+        for msg_type, msg_seq, body in parse_nlmsgs(data):
+            if msg_seq == seq:
+                yield msg_type, body
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def nlmsg(msg_type, flags, seq, payload):
+    length = _NLMSGHDR.size + len(payload)
+    return _NLMSGHDR.pack(length, msg_type, flags, seq, 0) + payload
+
+
+def parse_nlmsgs(data):
+    """Split a netlink datagram into (type, seq, body) tuples
+    """
+    messages = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, _, seq, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        body = data[offset + _NLMSGHDR.size:offset + length]
+        messages.append((msg_type, seq, body))
+        offset += _align(length)
+    return messages
+
+
+def rtattr(attr_type, payload):
+    length = _RTATTR.size + len(payload)
+    padding = b"\0" * (_align(length) - length)
+    return _RTATTR.pack(length, attr_type) + payload + padding
+
+
+def parse_rtattrs(data):
+    """Parse a run of rtattrs into a dict of type -> payload
+    """
+    attrs = {}
+    offset = 0
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def check_ack(body):
+    err, = struct.unpack_from("=i", body)
+    if err:
+        raise NetlinkError(-err, "Problem calling traffic control: %s" %
+                           os.strerror(-err))
+
+
+def parse_qdisc_message(body):
+    """Parse an RTM_NEWQDISC body into (ifindex, parent, kind, options)
+    """
+    _, ifindex, _, parent, _ = _TCMSG.unpack_from(body)
+    attrs = parse_rtattrs(body[_TCMSG.size:])
+    kind = attrs.get(TCA_KIND, b"").rstrip(b"\0").decode()
+    return ifindex, parent, kind, attrs.get(TCA_OPTIONS, b"")
+
+
+def qdisc_network_state(kind, options):
+    if kind != "netem" or len(options) < _NETEM_QOPT.size:
+        return NetworkState.NORMAL
+    latency, _, loss, _, _, _ = _NETEM_QOPT.unpack_from(options)
+    if latency:
+        return NetworkState.SLOW
+    if loss:
+        return NetworkState.FLAKY
+    return NetworkState.NORMAL
+
+
+def device_index(device):
+    try:
+        with open("/sys/class/net/%s/ifindex" % (device,)) as f:
+            return int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        raise BlockadeError("Network device %s not found" % (device,))
+
+
+def device_names():
+    """Get a map of ifindex -> name for every network device
+    """
+    names = {}
+    for device in os.listdir("/sys/class/net"):
+        try:
+            names[device_index(device)] = device
+        except BlockadeError:
+            continue
+    return names
+
+
+def parse_time(value):
+    """Parse a tc time like "75ms" into microseconds
+    """
+    number = value.rstrip("abcdefghijklmnopqrstuvwxyz")
+    unit = value[len(number):]
+    try:
+        number = float(number)
+    except ValueError:
+        raise UnsupportedNetemError("invalid time %s" % (value,))
+    if not unit:
+        return number
+    for names, scale in _TIME_UNITS:
+        if unit in names:
+            return number * scale
+    raise UnsupportedNetemError("invalid time %s" % (value,))
+
+
+def parse_percent(value):
+    """Parse a tc percentage like "30%" into a fraction of the u32 range
+    """
+    try:
+        percent = float(value[:-1] if value.endswith("%") else value)
+    except ValueError:
+        raise UnsupportedNetemError("invalid percentage %s" % (value,))
+    return int(round(percent / 100.0 * _UINT32_MAX))
+
+
+def _is_time(value):
+    try:
+        parse_time(value)
+    except UnsupportedNetemError:
+        return False
+    return True
+
+
+def _is_percent(value):
+    try:
+        parse_percent(value)
+    except UnsupportedNetemError:
+        return False
+    return True
+
+
+_TICKS_PER_USEC = None
+
+
+def ticks_per_usec():
+    """How many packet scheduler ticks make up a microsecond
+
+    Same calculation as tc's tc_core_init(), from /proc/net/psched.
+    """
+    global _TICKS_PER_USEC
+    if _TICKS_PER_USEC is None:
+        try:
+            with open("/proc/net/psched") as f:
+                t2us, us2t, clock_res = [int(v, 16)
+                                         for v in f.read().split()[:3]]
+        except (IOError, OSError, ValueError):
+            t2us, us2t, clock_res = 1000, 64, 1000000
+        if clock_res == 1000000000:
+            t2us = us2t
+        _TICKS_PER_USEC = float(t2us) / us2t * clock_res / 1000000
+    return _TICKS_PER_USEC
+
+
+def load_distribution(name):
+    """Load a netem delay distribution table shipped with tc
+    """
+    for directory in (os.environ.get("TC_LIB_DIR"),) + _TC_LIB_DIRS:
+        if not directory:
+            continue
+        path = os.path.join(directory, name + ".dist")
+        try:
+            with open(path) as f:
+                values = []
+                for line in f:
+                    line = line.split("#", 1)[0]
+                    values.extend(int(v) for v in line.split())
+                return struct.pack("=%dh" % len(values), *values)
+        except (IOError, OSError):
+            continue
+    raise UnsupportedNetemError("distribution %s not found" % (name,))
+
+
+def netem_attrs(params):
+    """Encode the attributes of a netem qdisc with these parameters
+    """
+    return (rtattr(TCA_KIND, b"netem\0") +
+            rtattr(TCA_OPTIONS, encode_netem_options(params)))
+
+
+def encode_netem_options(params):
+    """Encode netem parameters as the TCA_OPTIONS payload
+
+    Understands the "delay TIME [JITTER [CORRELATION]] [distribution NAME]"
+    and "loss [random] PERCENT [CORRELATION]" forms that Blockade uses.
+    Raises UnsupportedNetemError for anything else.
+    """
+    params = list(params)
+    latency = jitter = loss = 0
+    delay_corr = loss_corr = 0
+    distribution = None
+
+    while params:
+        param = params.pop(0)
+        if param == "delay" and params:
+            latency = parse_time(params.pop(0))
+            if params and _is_time(params[0]):
+                jitter = parse_time(params.pop(0))
+                if params and _is_percent(params[0]):
+                    delay_corr = parse_percent(params.pop(0))
+        elif param == "distribution" and params:
+            distribution = params.pop(0)
+        elif param == "loss" and params:
+            if params[0] == "random":
+                params.pop(0)
+            if not params:
+                raise UnsupportedNetemError("loss needs a percentage")
+            loss = parse_percent(params.pop(0))
+            if params and _is_percent(params[0]):
+                loss_corr = parse_percent(params.pop(0))
+        else:
+            raise UnsupportedNetemError("unsupported netem parameter %s" %
+                                        (param,))
+
+    if distribution and not (latency and jitter):
+        raise UnsupportedNetemError("distribution needs delay and jitter")
+
+    ticks = ticks_per_usec()
+    options = _NETEM_QOPT.pack(
+        min(int(latency * ticks), _UINT32_MAX), _DEFAULT_LIMIT, loss, 0, 0,
+        min(int(jitter * ticks), _UINT32_MAX))
+    options += rtattr(TCA_NETEM_CORR,
+                      _NETEM_CORR.pack(delay_corr, loss_corr, 0))
+    if distribution:
+        options += rtattr(TCA_NETEM_DELAY_DIST,
+                          load_distribution(distribution))
+    return options
@@ -0,0 +1,153 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+import subprocess
+
+from .errors import BlockadeError
+
+# a partition set's body in `nft list` output, and the elements within it
+_SET_RE = re.compile(r"set p(\d+) \{((?:[^{}]|\{[^{}]*\})*)\}")
+_ELEMENTS_RE = re.compile(r"elements = \{([^}]*)\}")
+
+
+class NftablesFirewall(object):
+    """Partitions by way of an nftables table per blockade
+
+    Each partition is an nft set of container addresses. A verdict map
+    sends forwarded packets from a blockade container to its partition's
+    chain, which drops them if the destination is a blockade container
+    outside the partition. Every lookup is a hash lookup, so the cost per
+    packet doesn't grow with the size of the blockade, and packets from
+    other containers on the host only pay for a single map miss.
+    """
+    def partition(self, blockade_id, partitions):
+        nft_apply(nft_partition_ruleset(blockade_id, partitions))
+
+    def clear(self, blockade_id):
+        nft_apply(nft_partition_ruleset(blockade_id, []))
+
+    def get_ip_partitions(self, blockade_id):
+        output = nft_list_table(blockade_id)
+        if output is None:
+            return {}
+        return parse_ip_partitions(output)
+
+
+def nft_table_name(blockade_id):
+    if not blockade_id:
+        raise ValueError("invalid blockade_id")
+    return blockade_id
+
+
+def nft_apply(lines):
+    """Apply nft commands in a single atomic transaction
+    """
+    cmd = ["nft", "-f", "-"]
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    _, stderr = p.communicate(("\n".join(lines) + "\n").encode())
+    if p.returncode != 0:
+        raise BlockadeError("Problem calling '%s': %s" %
+                            (" ".join(cmd), stderr.decode().strip()))
+
+
+def nft_list_table(blockade_id):
+    """List the blockade's table, or None if it doesn't exist
+    """
+    cmd = ["nft", "list", "table", "ip", nft_table_name(blockade_id)]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        if "No such file or directory" in stderr.decode():
+            return None
+        raise BlockadeError("Problem calling '%s'" % " ".join(cmd))
+    return stdout.decode()
+
+
+def parse_ip_partitions(output):
+    """Get a map of IP -> partition index from `nft list table` output
+    """
+    result = {}
+    for match in _SET_RE.finditer(output):
+        index = int(match.group(1))
+        elements = _ELEMENTS_RE.search(match.group(2))
+        if not elements:
+            continue
+        for ip in elements.group(1).split(","):
+            ip = ip.strip()
+            if ip:
+                result[ip] = index
+    return result
+
+
+def _elements(items):
+    if not items:
+        return []
+    return ["        elements = { %s }" % ", ".join(items)]
+
+
+def nft_partition_ruleset(blockade_id, partitions):
+    """Build an nft script replacing a blockade's partitions
+
+    The table is created (if missing) and deleted before being rebuilt, so
+    the whole replacement is one transaction. With fewer than two
+    partitions the table is just removed.
+    """
+    table = nft_table_name(blockade_id)
+    lines = ["table ip %s" % (table,), "delete table ip %s" % (table,)]
+    if not partitions or len(partitions) == 1:
+        return lines
+
+    partition_ips = [[c.ip_address for c in partition if c.ip_address]
+                     for partition in partitions]
+    members = [ip for ips in partition_ips for ip in ips]
+
+    lines.append("table ip %s {" % (table,))
+    for index, ips in enumerate(partition_ips, 1):
+        lines.append("    set p%d {" % (index,))
+        lines.append("        type ipv4_addr")
+        lines.extend(_elements(ips))
+        lines.append("    }")
+
+    lines.append("    set members {")
+    lines.append("        type ipv4_addr")
+    lines.extend(_elements(members))
+    lines.append("    }")
+
+    # traffic within a partition passes, traffic to the rest of the
+    # blockade is dropped
+    for index in range(1, len(partitions) + 1):
+        lines.append("    chain p%d {" % (index,))
+        lines.append("        ip daddr @p%d return" % (index,))
+        lines.append("        ip daddr @members drop")
+        lines.append("    }")
+
+    lines.append("    map partitions {")
+    lines.append("        type ipv4_addr : verdict")
+    lines.extend(_elements(["%s : jump p%d" % (ip, index)
+                            for index, ips in enumerate(partition_ips, 1)
+                            for ip in ips]))
+    lines.append("    }")
+
+    lines.append("    chain forward {")
+    lines.append("        type filter hook forward priority 0; "
+                 "policy accept;")
+    lines.append("        ip saddr vmap @partitions")
+    lines.append("    }")
+    lines.append("}")
+    return lines
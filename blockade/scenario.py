@@ -0,0 +1,216 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+
+from .errors import BlockadeError, ScenarioError
+from .core import expand_partitions
+
+# a clock which system time changes can't move. Python 2 has none, so
+# there a scenario runs on the system clock, and changing the system time
+# during a run moves its remaining steps.
+monotonic = getattr(time, "monotonic", time.time)
+
+# sleeping can overshoot, so the last stretch before a step is spun away
+SPIN_SECONDS = 0.002
+
+SCENARIO_ACTIONS = ("partition", "join", "slow", "flaky", "fast")
+
+
+class ScenarioStep(object):
+    """A fault to apply at an offset, in seconds, from the scenario start
+    """
+    def __init__(self, at, action, containers=None):
+        self.at = at
+        self.action = action
+        self.containers = containers
+
+    @staticmethod
+    def from_dict(d):
+        if not isinstance(d, dict):
+            raise ScenarioError("Step is not a map: %r" % (d,))
+        actions = [a for a in SCENARIO_ACTIONS if a in d]
+        if len(actions) != 1:
+            raise ScenarioError("Step needs exactly one of %s: %r" %
+                                (", ".join(SCENARIO_ACTIONS), d))
+        action = actions[0]
+
+        at = d.get('at', 0)
+        if isinstance(at, bool) or not isinstance(at, (int, float)) \
+                or at < 0:
+            raise ScenarioError("Step 'at' must be a number of seconds: %r"
+                                % (d,))
+
+        value = d[action]
+        if action == "join":
+            containers = None
+        elif action == "partition":
+            if not isinstance(value, list) or not value:
+                raise ScenarioError("partition needs a list of partitions")
+            containers = [_selectors(p) for p in value]
+        elif value == "all":
+            containers = None
+        else:
+            containers = _selectors(value)
+        return ScenarioStep(float(at), action, containers)
+
+    def to_dict(self):
+        return dict(at=self.at, action=self.action,
+                    containers=self.containers)
+
+
+def _selectors(value):
+    # "c1,c2" or [c1, c2]
+    if isinstance(value, list):
+        names = [str(v) for v in value]
+    else:
+        names = str(value).split(",")
+    names = [n.strip() for n in names if n.strip()]
+    if not names:
+        raise ScenarioError("Step selects no containers")
+    return names
+
+
+class StepResult(object):
+    """When a step was meant to take effect, and when it did
+
+    Times are seconds from the start of the scenario. started is when the
+    step began changing the network, and applied when it was done, so the
+    lag is how late the fault was in place.
+    """
+    def __init__(self, step, started, applied):
+        self.step = step
+        self.started = started
+        self.applied = applied
+
+    @property
+    def lag(self):
+        return self.applied - self.step.at
+
+    def to_dict(self):
+        return dict(action=self.step.action, scheduled=self.step.at,
+                    started=self.started, applied=self.applied,
+                    lag=self.lag, seconds=self.applied - self.started)
+
+
+class Scenario(object):
+    """A timeline of network faults to apply to a blockade
+
+    Steps run one at a time, in order of their offsets, each started at
+    its offset from the scenario start on a monotonic clock.
+    """
+    def __init__(self, steps):
+        # sorted is stable, so steps at the same time keep their order
+        self.steps = sorted(steps, key=lambda s: s.at)
+
+    @staticmethod
+    def from_dict(d):
+        try:
+            steps = d['steps']
+        except (KeyError, TypeError):
+            raise ScenarioError("Scenario needs a list of steps")
+        if not isinstance(steps, list) or not steps:
+            raise ScenarioError("Scenario needs a list of steps")
+        return Scenario([ScenarioStep.from_dict(s) for s in steps])
+
+    def validate(self, config):
+        """Check every step's containers exist before anything runs
+        """
+        for step in self.steps:
+            if step.containers is None:
+                continue
+            if step.action == "partition":
+                config.select_many(step.containers)
+            else:
+                config.select(step.containers)
+
+    def run(self, blockade, clock=monotonic, sleep=time.sleep):
+        """Apply each step to blockade at its time and return StepResults
+
+        The state and the running containers are looked up once, before
+        the clock starts, and every step's containers are resolved
+        against them. Each step then only changes the network.
+        """
+        self.validate(blockade.config)
+        state = blockade.state_factory.load()
+        running = blockade._get_running_containers(state=state)
+        plans = []
+        for step in self.steps:
+            try:
+                plans.append((step, _plan(blockade.config, step, running)))
+            except BlockadeError as e:
+                raise _step_error(step, e)
+
+        results = []
+        start = clock()
+        for step, containers in plans:
+            _sleep_until(start + step.at, clock, sleep)
+            started = clock() - start
+            try:
+                _apply(blockade, state, step, running, containers)
+            except BlockadeError as e:
+                raise _step_error(step, e)
+            results.append(StepResult(step, started, clock() - start))
+        return results
+
+
+def _step_error(step, error):
+    return ScenarioError("%s at %ss failed: %s" %
+                         (step.action, step.at, error))
+
+
+def _sleep_until(deadline, clock, sleep):
+    remaining = deadline - clock()
+    while remaining > SPIN_SECONDS:
+        sleep(remaining - SPIN_SECONDS)
+        remaining = deadline - clock()
+    while clock() < deadline:
+        pass
+
+
+def _plan(config, step, running):
+    """Resolve a step's containers against the running containers
+
+    Returns the partitions of container names for a partition step, the
+    containers to change for slow, flaky and fast, and None for join.
+    """
+    if step.action == "join":
+        return None
+    names = [c.name for c in running]
+    if step.action == "partition":
+        partitions = config.select_many(step.containers)
+        expand_partitions(names, partitions)
+        return partitions
+    if step.containers is None:
+        return list(running)
+
+    by_name = dict((c.name, c) for c in running)
+    selected = []
+    for name in config.select(step.containers):
+        if name not in by_name:
+            raise BlockadeError("Container %s is not found or not running"
+                                % (name,))
+        selected.append(by_name[name])
+    return selected
+
+
+def _apply(blockade, state, step, running, planned):
+    if step.action == "join":
+        blockade._apply_join(state)
+    elif step.action == "partition":
+        blockade._apply_partition(state, running, planned)
+    else:
+        getattr(blockade, "_apply_" + step.action)(state, planned)
@@ -14,20 +14,44 @@
 # limitations under the License.
 #
 
-import uuid
-import os
 import errno
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
 from copy import deepcopy
 
-import yaml
-
 from .errors import AlreadyInitializedError, NotInitializedError, \
     InconsistentStateError
 
 BLOCKADE_STATE_DIR = ".blockade"
-BLOCKADE_STATE_FILE = ".blockade/state.yml"
+BLOCKADE_STATE_FILE = ".blockade/state.db"
+BLOCKADE_LEGACY_STATE_FILE = ".blockade/state.yml"
 BLOCKADE_ID_PREFIX = "blockade-"
-BLOCKADE_STATE_VERSION = 1
+BLOCKADE_STATE_VERSION = 2
+
+# seconds a writer waits for another process to finish writing
+BLOCKADE_STATE_TIMEOUT = 30
+
+_SCHEMA = (
+    "CREATE TABLE blockade (blockade_id TEXT NOT NULL, "
+    "version INTEGER NOT NULL)",
+    "CREATE TABLE containers (name TEXT PRIMARY KEY, container_id TEXT, "
+    "veth_device TEXT UNIQUE, ip_address TEXT, extra TEXT)",
+    "CREATE INDEX containers_container_id ON containers (container_id)",
+    "CREATE INDEX containers_ip_address ON containers (ip_address)",
+    "CREATE TABLE partitions (name TEXT PRIMARY KEY "
+    "REFERENCES containers (name), partition_index INTEGER NOT NULL)",
+    "CREATE INDEX partitions_partition_index ON partitions "
+    "(partition_index)",
+    "CREATE TABLE netem (name TEXT PRIMARY KEY REFERENCES containers (name), "
+    "params TEXT NOT NULL)",
+)
+
+# container details with columns of their own. Anything else is kept as
+# JSON in the extra column.
+_CONTAINER_COLUMNS = ("container_id", "veth_device", "ip_address")
 
 
 def _assure_dir():
@@ -38,13 +62,19 @@ def _assure_dir():
             raise
 
 
-def _state_delete():
+def _remove(path):
     try:
-        os.remove(BLOCKADE_STATE_FILE)
+        os.remove(path)
     except OSError as e:
         if e.errno not in (errno.EPERM, errno.ENOENT):
             raise
 
+
+def _state_delete():
+    for path in (BLOCKADE_STATE_FILE, BLOCKADE_STATE_FILE + "-wal",
+                 BLOCKADE_STATE_FILE + "-shm", BLOCKADE_LEGACY_STATE_FILE):
+        _remove(path)
+
     try:
         os.rmdir(BLOCKADE_STATE_DIR)
     except OSError as e:
@@ -52,15 +82,60 @@ def _state_delete():
             raise
 
 
-def _base_state(blockade_id, containers):
-    return dict(blockade_id=blockade_id, containers=containers,
-                version=BLOCKADE_STATE_VERSION)
+def _connect(path):
+    import sqlite3
+    # transactions are begun explicitly, see _write_transaction()
+    return sqlite3.connect(path, timeout=BLOCKADE_STATE_TIMEOUT,
+                           isolation_level=None)
+
+
+@contextmanager
+def _write_transaction(db):
+    """Run a block of writes as one transaction
+
+    BEGIN IMMEDIATE takes the write lock up front, so writers from other
+    processes queue up behind each other instead of failing halfway.
+    Readers are never blocked in WAL mode.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+        db.execute("COMMIT")
+    except Exception:
+        # a failed COMMIT may have rolled back already
+        if getattr(db, "in_transaction", True):
+            db.execute("ROLLBACK")
+        raise
+
+
+def _split_container(values):
+    columns = [values.get(column) for column in _CONTAINER_COLUMNS]
+    extra = dict((k, v) for k, v in values.items()
+                 if k not in _CONTAINER_COLUMNS)
+    return columns, (json.dumps(extra, sort_keys=True) if extra else None)
+
+
+def _join_container(row):
+    container = json.loads(row[-1]) if row[-1] else {}
+    for column, value in zip(_CONTAINER_COLUMNS, row):
+        if value is not None:
+            container[column] = value
+    return container
 
 
 class BlockadeState(object):
-    def __init__(self, blockade_id, containers):
+    """Blockade state held in memory
+
+    Besides the blockade ID, the state has a dict of details for each
+    container (its veth device, Docker ID and IP address), the partition
+    each container was last put in, and the netem parameters last applied
+    to each container.
+    """
+    def __init__(self, blockade_id, containers, partitions=None, netem=None):
         self._blockade_id = blockade_id
         self._containers = containers
+        self._partitions = dict(partitions or {})
+        self._netem = dict(netem or {})
 
     @property
     def blockade_id(self):
@@ -70,6 +145,151 @@ class BlockadeState(object):
     def containers(self):
         return deepcopy(self._containers)
 
+    def container(self, name):
+        """Get the details of one container, or None
+        """
+        container = self._containers.get(name)
+        return None if container is None else deepcopy(container)
+
+    def update_containers(self, updates):
+        """Merge a dict of name -> details into the containers
+        """
+        for name, values in updates.items():
+            self._containers.setdefault(name, {}).update(values)
+
+    @property
+    def partitions(self):
+        return dict(self._partitions)
+
+    def set_partitions(self, partitions):
+        """Replace the map of container name -> partition index
+        """
+        self._partitions = dict(partitions)
+
+    @property
+    def netem(self):
+        return deepcopy(self._netem)
+
+    def set_netem(self, names, params):
+        """Record netem params for some containers, or None for none
+        """
+        for name in names:
+            if params is None:
+                self._netem.pop(name, None)
+            else:
+                self._netem[name] = list(params)
+
+
+class BlockadeDatabaseState(object):
+    """Blockade state kept in a SQLite database
+
+    Same interface as BlockadeState, but every read and write goes to the
+    database, so any number of blockade processes can share it. The
+    database is in WAL mode: readers see the last committed write and are
+    never blocked, and writers take turns. Each thread gets its own
+    connection.
+    """
+    def __init__(self, blockade_id, path=BLOCKADE_STATE_FILE):
+        self._blockade_id = blockade_id
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = _connect(self.path)
+        return db
+
+    @property
+    def blockade_id(self):
+        return self._blockade_id
+
+    @property
+    def containers(self):
+        rows = self._db().execute(
+            "SELECT name, container_id, veth_device, ip_address, extra "
+            "FROM containers")
+        return dict((row[0], _join_container(row[1:])) for row in rows)
+
+    def container(self, name):
+        row = self._db().execute(
+            "SELECT container_id, veth_device, ip_address, extra "
+            "FROM containers WHERE name = ?", (name,)).fetchone()
+        return None if row is None else _join_container(row)
+
+    def update_containers(self, updates):
+        with _write_transaction(self._db()) as db:
+            for name, values in updates.items():
+                row = db.execute(
+                    "SELECT container_id, veth_device, ip_address, extra "
+                    "FROM containers WHERE name = ?", (name,)).fetchone()
+                container = _join_container(row) if row else {}
+                container.update(values)
+                columns, extra = _split_container(container)
+                if row is None:
+                    db.execute("INSERT INTO containers (name, container_id, "
+                               "veth_device, ip_address, extra) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               [name] + columns + [extra])
+                else:
+                    db.execute("UPDATE containers SET container_id = ?, "
+                               "veth_device = ?, ip_address = ?, extra = ? "
+                               "WHERE name = ?", columns + [extra, name])
+
+    @property
+    def partitions(self):
+        return dict(self._db().execute(
+            "SELECT name, partition_index FROM partitions"))
+
+    def set_partitions(self, partitions):
+        with _write_transaction(self._db()) as db:
+            db.execute("DELETE FROM partitions")
+            db.executemany("INSERT INTO partitions (name, partition_index) "
+                           "VALUES (?, ?)", list(partitions.items()))
+
+    @property
+    def netem(self):
+        return dict((name, json.loads(params)) for name, params in
+                    self._db().execute("SELECT name, params FROM netem"))
+
+    def set_netem(self, names, params):
+        with _write_transaction(self._db()) as db:
+            if params is None:
+                db.executemany("DELETE FROM netem WHERE name = ?",
+                               [(name,) for name in names])
+            else:
+                params = json.dumps(list(params))
+                db.executemany("INSERT OR REPLACE INTO netem (name, params) "
+                               "VALUES (?, ?)",
+                               [(name, params) for name in names])
+
+
+def _create_database(path, blockade_id, containers):
+    db = _connect(path)
+    try:
+        db.execute("PRAGMA journal_mode=WAL")
+        with _write_transaction(db):
+            for statement in _SCHEMA:
+                db.execute(statement)
+            db.execute("INSERT INTO blockade (blockade_id, version) "
+                       "VALUES (?, ?)", (blockade_id, BLOCKADE_STATE_VERSION))
+            for name, values in containers.items():
+                columns, extra = _split_container(values)
+                db.execute("INSERT INTO containers (name, container_id, "
+                           "veth_device, ip_address, extra) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           [name] + columns + [extra])
+    finally:
+        db.close()
+
+
+def _load_legacy_state():
+    # blockades created before the state moved to SQLite
+    import yaml
+    with open(BLOCKADE_LEGACY_STATE_FILE) as f:
+        state = yaml.safe_load(f)
+        return BlockadeState(state['blockade_id'], state['containers'])
+
 
 class BlockadeStateFactory(object):
     # annoyed with how this ended up structured, and that I called it
@@ -79,39 +299,60 @@ class BlockadeStateFactory(object):
     def initialize(containers, blockade_id=None):
         if blockade_id is None:
             blockade_id = BLOCKADE_ID_PREFIX + uuid.uuid4().hex[:10]
-        containers = deepcopy(containers)
 
-        f = None
         path = BLOCKADE_STATE_FILE
         _assure_dir()
+        if os.path.exists(BLOCKADE_LEGACY_STATE_FILE):
+            raise AlreadyInitializedError(
+                "Path %s exists. You may need to destroy a previous "
+                "blockade." % BLOCKADE_LEGACY_STATE_FILE)
+
+        # build the database off to the side and link it into place, so
+        # nobody sees it half made and only one of two racing blockades
+        # can win
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
         try:
-            flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
-            with os.fdopen(os.open(path, flags), "w") as f:
-                yaml.dump(_base_state(blockade_id, containers), f)
-        except OSError as e:
-            if e.errno == errno.EEXIST:
-                raise AlreadyInitializedError(
-                    "Path %s exists. "
-                    "You may need to destroy a previous blockade." % path)
-            raise
-        except Exception:
-            # clean up our created file
-            _state_delete()
-            raise
-        return BlockadeState(blockade_id, containers)
+            _create_database(temp_path, blockade_id, containers)
+            try:
+                os.link(temp_path, path)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    raise AlreadyInitializedError(
+                        "Path %s exists. "
+                        "You may need to destroy a previous blockade." % path)
+                raise
+        finally:
+            _remove(temp_path)
+        return BlockadeDatabaseState(blockade_id, path)
 
     @staticmethod
     def load():
+        path = BLOCKADE_STATE_FILE
         try:
-            with open(BLOCKADE_STATE_FILE) as f:
-                state = yaml.safe_load(f)
-                return BlockadeState(state['blockade_id'], state['containers'])
-
-        except (IOError, OSError) as e:
-            if e.errno == errno.ENOENT:
+            if not os.path.exists(path):
+                if os.path.exists(BLOCKADE_LEGACY_STATE_FILE):
+                    return _load_legacy_state()
                 raise NotInitializedError("No blockade exists in this context")
-            raise InconsistentStateError("Failed to load Blockade state: "
-                                         + str(e))
+
+            db = _connect(path)
+            try:
+                row = db.execute(
+                    "SELECT blockade_id, version FROM blockade").fetchone()
+            finally:
+                db.close()
+            if row is None:
+                raise InconsistentStateError("Failed to load Blockade state: "
+                                             "no blockade ID")
+            blockade_id, version = row
+            if version != BLOCKADE_STATE_VERSION:
+                raise InconsistentStateError(
+                    "Failed to load Blockade state: %s is version %s, but "
+                    "this Blockade reads version %s" %
+                    (path, version, BLOCKADE_STATE_VERSION))
+            return BlockadeDatabaseState(blockade_id, path)
+
+        except (NotInitializedError, InconsistentStateError):
+            raise
 
         except Exception as e:
             raise InconsistentStateError("Failed to load Blockade state: "
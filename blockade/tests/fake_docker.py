@@ -0,0 +1,166 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Stand-in for a docker-py client, for the tests and benchmarks
+
+Nothing talks to a real Docker daemon. Containers are kept in a JSON file,
+so that separate blockade commands see the same containers, or with a
+state of ":memory:" in the client itself. Each client counts the requests
+made to it by method.
+"""
+
+import collections
+import json
+import os
+import threading
+
+# ":memory:" keeps containers in the client only, for in-process use
+FAKE_DOCKER_STATE = os.environ.get("FAKE_DOCKER_STATE", ".fake-docker.json")
+
+# lines of log each container has
+FAKE_DOCKER_LOG_LINES = int(os.environ.get("FAKE_DOCKER_LOG_LINES", "1"))
+
+_lock = threading.Lock()
+
+
+class APIError(Exception):
+    def __init__(self, message, response=None):
+        Exception.__init__(self, message)
+        self.response = response
+
+
+class _Response(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class Client(object):
+    def __init__(self, *args, **kwargs):
+        self.path = kwargs.get("state") or FAKE_DOCKER_STATE
+        self.calls = collections.Counter()
+        self._memory = {}
+
+    def _record(self, method):
+        with _lock:
+            self.calls[method] += 1
+
+    def take_calls(self):
+        """Get the requests made since the last take_calls, by method
+        """
+        with _lock:
+            calls, self.calls = self.calls, collections.Counter()
+        return dict(calls)
+
+    def _load(self):
+        if self.path == ":memory:":
+            return self._memory
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, containers):
+        if self.path == ":memory:":
+            return
+        with open(self.path, "w") as f:
+            json.dump(containers, f)
+
+    def _get(self, containers, container_id):
+        try:
+            return containers[container_id]
+        except KeyError:
+            raise APIError("No such container: %s" % (container_id,),
+                           _Response(404))
+
+    def _set_running(self, container_id, running):
+        with _lock:
+            containers = self._load()
+            self._get(containers, container_id)['running'] = running
+            self._save(containers)
+
+    def create_container(self, image, name=None, labels=None, **kwargs):
+        self._record("create_container")
+        with _lock:
+            containers = self._load()
+            container_id = "%012x" % (len(containers) + 1,) + "0" * 52
+            containers[container_id] = dict(name=name, running=False,
+                                            index=len(containers) + 1,
+                                            labels=labels or {})
+            self._save(containers)
+        return {"Id": container_id}
+
+    def start(self, container_id, **kwargs):
+        self._record("start")
+        self._set_running(container_id, True)
+
+    def stop(self, container_id, timeout=None):
+        self._record("stop")
+        self._set_running(container_id, False)
+
+    def kill(self, container_id):
+        self._record("kill")
+        self._set_running(container_id, False)
+
+    def remove_container(self, container_id):
+        self._record("remove_container")
+        with _lock:
+            containers = self._load()
+            self._get(containers, container_id)
+            del containers[container_id]
+            self._save(containers)
+
+    def containers(self, all=False, filters=None):
+        self._record("containers")
+        wanted = [label.split("=", 1)
+                  for label in (filters or {}).get("label", ())]
+        result = []
+        for container_id, c in list(self._load().items()):
+            labels = c.get('labels') or {}
+            if not (c['running'] or all):
+                continue
+            if any(labels.get(k) != v for k, v in wanted):
+                continue
+            result.append({
+                "Id": container_id,
+                "Names": ["/" + c['name']],
+                "Labels": labels,
+                "Status": "Up 1 second" if c['running'] else "Exited"})
+        return result
+
+    def inspect_container(self, container_id):
+        self._record("inspect_container")
+        c = self._get(self._load(), container_id)
+        index = c['index']
+        return {
+            "Id": container_id,
+            "Name": "/" + c['name'],
+            "State": {"Running": c['running']},
+            "NetworkSettings": {
+                "IPAddress": "10.%d.%d.%d" % (index >> 16 & 255,
+                                              index >> 8 & 255,
+                                              index & 255)}}
+
+    def logs(self, container_id, stream=False, follow=False, since=None,
+             timestamps=False):
+        self._record("logs")
+        c = self._get(self._load(), container_id)
+        prefix = "2014-06-01T12:00:00.000000000Z " if timestamps else ""
+        lines = ("%slog %d of %s\n" % (prefix, n, c["name"])
+                 for n in range(FAKE_DOCKER_LOG_LINES))
+        if stream:
+            return (line.encode() for line in lines)
+        return "".join(lines)
@@ -0,0 +1,224 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Budgets for the external work each Blockade operation does
+
+Each operation runs against the fake Docker client, which counts
+requests, and a fake subprocess.Popen which records commands, at a few
+blockade sizes. The budgets are functions of the number of containers,
+so an operation which starts forking a process or asking Docker about
+each container in turn, where it didn't before, fails here.
+"""
+
+import shutil
+import tempfile
+
+import mock
+
+from blockade.tests import unittest
+from blockade.core import Blockade
+from blockade.config import BlockadeConfig
+from blockade.state import BlockadeState
+from blockade.tests.fake_docker import Client
+
+
+SIZES = (1, 10, 100)
+
+
+class RecordingProcess(object):
+    """Stand-in for subprocess.Popen which records argv and runs nothing
+    """
+    def __init__(self, commands, args, **kwargs):
+        self.args = list(args)
+        commands.append(self.args)
+        self.pid = 0
+        self.returncode = 0
+        self.stdin = self.stdout = self.stderr = None
+
+    def communicate(self, input=None, timeout=None):
+        if self.args[:3] == ["iptables", "-n", "-L"]:
+            # an empty chain
+            return ("Chain %s (policy ACCEPT)\n"
+                    "target     prot opt source       destination\n"
+                    % (self.args[3],)).encode(), b""
+        return b"", b""
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class BudgetTests(unittest.TestCase):
+
+    def blockade(self, count, firewall="iptables"):
+        """Get a Blockade of count containers which are already up
+        """
+        config = BlockadeConfig.from_dict({
+            "containers": dict(("c%d" % n, {"image": "image"})
+                               for n in range(1, count + 1)),
+            "network": {"firewall": firewall}})
+        state = BlockadeState("blockade-budget", {})
+        state_factory = mock.Mock()
+        state_factory.initialize.side_effect = \
+            lambda containers: state.update_containers(containers) or state
+        state_factory.load.return_value = state
+
+        docker_client = Client(state=":memory:")
+        b = Blockade(config, state_factory, docker_client=docker_client)
+        with mock.patch("subprocess.Popen", self.recording_popen([])):
+            b.create()
+        docker_client.take_calls()
+        return b, docker_client
+
+    def recording_popen(self, commands):
+        return lambda args, **kwargs: RecordingProcess(commands, args,
+                                                       **kwargs)
+
+    def assertBudget(self, operation, processes, docker=None,
+                     firewall="iptables", setup=None):
+        """Check the work operation does at each of SIZES
+
+        processes is a function of the container count giving the most
+        processes the operation may start. docker maps Docker client
+        methods to functions giving the most requests of each; methods
+        left out may not be called at all.
+        """
+        docker = docker or {}
+        for count in SIZES:
+            b, docker_client = self.blockade(count, firewall)
+            if setup:
+                with mock.patch("subprocess.Popen", self.recording_popen([])):
+                    setup(b)
+                docker_client.take_calls()
+
+            commands = []
+            with mock.patch("subprocess.Popen",
+                            self.recording_popen(commands)):
+                operation(b)
+
+            description = "%d containers: %s" % (
+                count, [" ".join(command[:3]) for command in commands])
+            self.assertTrue(len(commands) <= processes(count),
+                            "%d processes for %s" % (len(commands),
+                                                     description))
+            for method, calls in docker_client.take_calls().items():
+                limit = docker.get(method, lambda count: 0)(count)
+                self.assertTrue(calls <= limit,
+                                "%d %s calls for %d containers (%d allowed)"
+                                % (calls, method, count, limit))
+
+    def test_create(self):
+        # one tc for each dependency level; these containers have no links
+        self.assertBudget(lambda b: b.create(), processes=lambda n: 1,
+                          docker={"create_container": lambda n: n,
+                                  "start": lambda n: n,
+                                  "inspect_container": lambda n: n})
+
+    def test_status(self):
+        self.assertBudget(lambda b: b.status(), processes=lambda n: 2,
+                          docker={"containers": lambda n: 1,
+                                  "inspect_container": lambda n: n})
+
+    def test_destroy(self):
+        self.assertBudget(lambda b: b.destroy(), processes=lambda n: 2,
+                          docker={"containers": lambda n: 1,
+                                  "stop": lambda n: n,
+                                  "remove_container": lambda n: n})
+
+    def test_destroy_kill(self):
+        self.assertBudget(lambda b: b.destroy(kill=True),
+                          processes=lambda n: 2,
+                          docker={"containers": lambda n: 1,
+                                  "kill": lambda n: n,
+                                  "remove_container": lambda n: n})
+
+    def test_partition(self):
+        for firewall in ("iptables", "ipset", "nftables"):
+            self.assertBudget(lambda b: b.partition([["c1"]]),
+                              processes=lambda n: 6, firewall=firewall,
+                              docker={"containers": lambda n: 1,
+                                      "inspect_container": lambda n: n})
+
+    def test_partition_again(self):
+        for firewall in ("iptables", "ipset", "nftables"):
+            self.assertBudget(lambda b: b.partition([["c1"]]),
+                              setup=lambda b: b.partition([["c1"]]),
+                              processes=lambda n: 6, firewall=firewall,
+                              docker={"containers": lambda n: 1,
+                                      "inspect_container": lambda n: n})
+
+    def test_join(self):
+        for firewall in ("iptables", "ipset", "nftables"):
+            self.assertBudget(lambda b: b.join(), processes=lambda n: 2,
+                              firewall=firewall)
+
+    def test_flaky(self):
+        self.assertBudget(lambda b: b.flaky(include_all=True),
+                          processes=lambda n: 3,
+                          docker={"containers": lambda n: 1,
+                                  "inspect_container": lambda n: n})
+
+    def test_slow(self):
+        self.assertBudget(lambda b: b.slow(["c1"]),
+                          processes=lambda n: 3,
+                          docker={"containers": lambda n: 1,
+                                  "inspect_container": lambda n: n})
+
+    def test_fast(self):
+        self.assertBudget(lambda b: b.fast(include_all=True),
+                          processes=lambda n: 3,
+                          docker={"containers": lambda n: 1,
+                                  "inspect_container": lambda n: n})
+
+    def test_logs(self):
+        self.assertBudget(lambda b: b.logs("c1"), processes=lambda n: 2,
+                          docker={"containers": lambda n: 1,
+                                  "inspect_container": lambda n: n,
+                                  "logs": lambda n: 1})
+
+    def test_stream_logs(self):
+        self.assertBudget(lambda b: list(b.stream_logs()),
+                          processes=lambda n: 0,
+                          docker={"containers": lambda n: 1,
+                                  "logs": lambda n: n})
+
+    def test_collect_logs(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.assertBudget(lambda b: b.collect_logs(directory),
+                          processes=lambda n: 0,
+                          docker={"containers": lambda n: 1,
+                                  "logs": lambda n: n})
+
+    def test_per_container_forks_fail(self):
+        def network_states(b):
+            for container in b.status():
+                b.network.network_state(container.veth_device)
+        with self.assertRaises(AssertionError):
+            self.assertBudget(network_states, processes=lambda n: 3,
+                              docker={"containers": lambda n: 1,
+                                      "inspect_container": lambda n: n})
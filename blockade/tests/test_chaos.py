@@ -0,0 +1,108 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mock
+
+from blockade.tests import unittest
+from blockade.chaos import Chaos
+from blockade.core import Container, ContainerState
+from blockade.errors import BlockadeError
+from blockade.tests.test_scenario import FakeClock
+
+
+class ChaosTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.blockade = mock.Mock()
+        self.containers = [Container("c%d" % n, "id%d" % n, ContainerState.UP,
+                                     veth_device="veth%d" % n)
+                           for n in range(1, 8)]
+        self.blockade._get_running_containers.return_value = self.containers
+
+    def chaos(self, **kwargs):
+        return Chaos(self.blockade, clock=self.clock, sleep=self.clock.sleep,
+                     **kwargs)
+
+    def test_seeded_runs_repeat(self):
+        runs = []
+        for _ in range(2):
+            chaos = self.chaos(seed=42, rate=10)
+            runs.append([e.to_dict() for e in chaos.run(duration=5)])
+        self.assertEqual(len(runs[0]), 50)
+        strip = lambda events: [dict(e, at=None) for e in events]
+        self.assertEqual(strip(runs[0]), strip(runs[1]))
+
+        other = self.chaos(seed=43, rate=10)
+        self.assertNotEqual(strip(runs[0]),
+                            strip([e.to_dict() for e in other.run(5)]))
+
+    def test_faults(self):
+        chaos = self.chaos(seed=1, rate=100)
+        events = list(chaos.run(duration=2))
+        faults = set(e.fault for e in events)
+        self.assertEqual(faults, set(["partition", "flaky", "slow", "heal"]))
+
+        for event in events:
+            if event.fault == "partition":
+                minority, majority = event.partitions
+                self.assertTrue(1 <= len(minority) <= 3)
+                self.assertEqual(sorted(minority + majority),
+                                 ["c%d" % n for n in range(1, 8)])
+            elif event.fault in ("flaky", "slow"):
+                self.assertTrue(event.containers)
+
+        # looked up once, not for every fault
+        self.assertEqual(self.blockade._get_running_containers.call_count, 1)
+        # healed on the way out
+        self.blockade._apply_join.assert_called_with(mock.ANY)
+        self.assertFalse(chaos.partitioned or chaos.netem)
+
+    def test_weights(self):
+        chaos = self.chaos(seed=7, rate=100, weights={"slow": 1})
+        events = list(chaos.run(duration=0.5))
+        self.assertEqual(set(e.fault for e in events), set(["slow"]))
+        self.assertFalse(self.blockade._apply_partition.called)
+
+        for weights in ({"nap": 1}, {"slow": 0}, {"slow": -1, "heal": 2}):
+            with self.assertRaises(BlockadeError):
+                self.chaos(weights=weights)
+        with self.assertRaises(BlockadeError):
+            self.chaos(rate=0)
+
+    def test_timing(self):
+        chaos = self.chaos(seed=3, rate=4)
+        ats = [e.at for e in chaos.run(duration=2)]
+        self.assertEqual(len(ats), 8)
+        for index, at in enumerate(ats):
+            self.assertAlmostEqual(at, index / 4.0, places=2)
+
+    def test_failure_refreshes(self):
+        self.blockade._apply_partition.side_effect = BlockadeError("gone")
+        chaos = self.chaos(seed=5, rate=10, weights={"partition": 1})
+        events = list(chaos.run(duration=0.3))
+        self.assertEqual([e.error for e in events], ["gone"] * 3)
+        self.assertEqual(self.blockade._get_running_containers.call_count, 4)
+
+    def test_close_heals(self):
+        chaos = self.chaos(seed=9, weights={"flaky": 1})
+        events = chaos.run()
+        event = next(events)
+        self.assertEqual(event.fault, "flaky")
+        self.assertFalse(self.blockade._apply_fast.called)
+        events.close()
+        healed = self.blockade._apply_fast.call_args[0][1]
+        self.assertEqual(sorted(c.name for c in healed), event.containers)
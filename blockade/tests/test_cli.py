@@ -13,9 +13,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
+import subprocess
+import sys
+import time
+
+import mock
 
 from blockade.tests import unittest
 from blockade import cli
+from blockade.config import BlockadeConfig
+from blockade.logs import LogLine
 
 
 class CommandLineTests(unittest.TestCase):
@@ -23,3 +30,50 @@ class CommandLineTests(unittest.TestCase):
     def test_parser(self):
         # just make sure we don't have any typos for now
         cli.setup_parser()
+
+    def test_logs_since(self):
+        parser = cli.setup_parser()
+        opts = parser.parse_args(["logs", "--since", "1400000000", "c1"])
+        self.assertEqual(opts.since, 1400000000)
+        self.assertEqual(opts.containers, ["c1"])
+
+        before = time.time()
+        opts = parser.parse_args(["logs", "-f", "--since", "10m", "--all"])
+        self.assertTrue(opts.follow and opts.all)
+        self.assertTrue(before - 601 <= opts.since <= time.time() - 599)
+
+    def test_logs_prefixed(self):
+        config = BlockadeConfig.from_dict(dict(containers={
+            "db": {"image": "image", "count": 2},
+            "app": {"image": "image"}}))
+        b = mock.Mock(config=config)
+        b.stream_logs.side_effect = lambda names, **kwargs: [
+            LogLine(name, "2014-06-01T12:00:00Z", "hello")
+            for name in names]
+        parser = cli.setup_parser()
+
+        with mock.patch.object(cli, "get_local_blockade", return_value=b):
+            with mock.patch.object(cli, "puts") as mock_puts:
+                cli.cmd_logs(parser.parse_args(["logs", "app"]))
+                self.assertEqual(mock_puts.call_args_list,
+                                 [mock.call("hello")])
+
+                # one selector, two containers
+                mock_puts.reset_mock()
+                cli.cmd_logs(parser.parse_args(["logs", "db-*"]))
+                self.assertEqual(sorted(c[0][0] for c in
+                                        mock_puts.call_args_list),
+                                 ["db-1            2014-06-01T12:00:00Z "
+                                  "| hello",
+                                  "db-2            2014-06-01T12:00:00Z "
+                                  "| hello"])
+                self.assertTrue(b.stream_logs.call_args[1]['timestamps'])
+
+    def test_deferred_imports(self):
+        # these are slow to import, and not needed until a command uses them
+        code = ("import sys, blockade.cli; "
+                "blockade.cli.setup_parser().parse_args(['status']); "
+                "print(','.join(m for m in ('docker', 'yaml', 'clint') "
+                "if m in sys.modules))")
+        output = subprocess.check_output([sys.executable, "-c", code])
+        self.assertEqual(output.decode().strip(), "")
@@ -15,7 +15,7 @@
 #
 
 from blockade.tests import unittest
-from blockade.errors import BlockadeConfigError
+from blockade.errors import BlockadeError, BlockadeConfigError
 from blockade.config import BlockadeConfig, BlockadeContainerConfig, \
     dependency_sorted
 
@@ -51,6 +51,36 @@ class ConfigTests(unittest.TestCase):
         # default value should be there
         self.assertIn("slow", config.network)
 
+    def test_parse_traffic_control(self):
+        containers = {"c1": {"image": "image1"}}
+        config = BlockadeConfig.from_dict(dict(containers=containers))
+        self.assertEqual(config.network['traffic_control'], "tc")
+
+        network = {"traffic_control": "netlink"}
+        config = BlockadeConfig.from_dict(dict(containers=containers,
+                                               network=network))
+        self.assertEqual(config.network['traffic_control'], "netlink")
+
+        network = {"traffic_control": "carrier-pigeon"}
+        with self.assertRaisesRegexp(BlockadeConfigError, "traffic_control"):
+            BlockadeConfig.from_dict(dict(containers=containers,
+                                          network=network))
+
+    def test_parse_firewall(self):
+        containers = {"c1": {"image": "image1"}}
+        config = BlockadeConfig.from_dict(dict(containers=containers))
+        self.assertEqual(config.network['firewall'], "iptables")
+
+        network = {"firewall": "nftables"}
+        config = BlockadeConfig.from_dict(dict(containers=containers,
+                                               network=network))
+        self.assertEqual(config.network['firewall'], "nftables")
+
+        network = {"firewall": "pf"}
+        with self.assertRaisesRegexp(BlockadeConfigError, "firewall"):
+            BlockadeConfig.from_dict(dict(containers=containers,
+                                          network=network))
+
     def test_parse_with_volumes_1(self):
         containers = {
             "c1": {"image": "image1", "command": "/bin/bash",
@@ -149,6 +179,66 @@ class ConfigTests(unittest.TestCase):
         with self.assertRaises(BlockadeConfigError):
             BlockadeConfig.from_dict(d)
 
+    def test_parse_count(self):
+        containers = {
+            "db": {"image": "image1", "count": 3,
+                   "environment": {"NODE_ID": "{index}", "PEERS": "{count}",
+                                   "HOST": "{name}.{group}", "N": 1}},
+            "app": {"image": "image2", "links": {"db": "database"}},
+            "web": {"image": "image2", "links": ["app"], "group": "front"}
+        }
+        config = BlockadeConfig.from_dict(dict(containers=containers))
+        self.assertEqual(sorted(config.containers),
+                         ["app", "db-1", "db-2", "db-3", "web"])
+
+        db2 = config.containers["db-2"]
+        self.assertEqual(db2.group, "db")
+        self.assertEqual(db2.environment, {"NODE_ID": "2", "PEERS": "3",
+                                           "HOST": "db-2.db", "N": 1})
+        self.assertEqual(config.containers["app"].links,
+                         {"db-1": "database-1", "db-2": "database-2",
+                          "db-3": "database-3"})
+        self.assertEqual(config.containers["web"].links, {"app": "app"})
+        self.assertEqual(config.groups,
+                         {"db": ["db-1", "db-2", "db-3"], "front": ["web"]})
+        self.assertDependencyLevels(
+            [c.name for c in config.sorted_containers],
+            ["db-1", "db-2", "db-3"], ["app"], ["web"])
+
+    def test_parse_count_invalid(self):
+        for count in (0, -1, "3", True):
+            containers = {"db": {"image": "image1", "count": count}}
+            with self.assertRaisesRegexp(BlockadeConfigError, "count"):
+                BlockadeConfig.from_dict(dict(containers=containers))
+
+        containers = {"db": {"image": "image1", "count": 2},
+                      "db-2": {"image": "image1"}}
+        with self.assertRaisesRegexp(BlockadeConfigError, "more than once"):
+            BlockadeConfig.from_dict(dict(containers=containers))
+
+    def test_select(self):
+        containers = {"db": {"image": "image1", "count": 3},
+                      "dbadmin": {"image": "image1"},
+                      "app": {"image": "image1", "count": 2}}
+        config = BlockadeConfig.from_dict(dict(containers=containers))
+
+        self.assertEqual(sorted(config.select(["db-*"])),
+                         ["db-1", "db-2", "db-3"])
+        self.assertEqual(sorted(config.select(["group:app", "dbadmin"])),
+                         ["app-1", "app-2", "dbadmin"])
+        self.assertEqual(sorted(config.select(["db-[12]", "db-1"])),
+                         ["db-1", "db-2"])
+        self.assertEqual([sorted(p) for p in
+                          config.select_many([["group:db"], ["app-?"]])],
+                         [["db-1", "db-2", "db-3"], ["app-1", "app-2"]])
+
+        with self.assertRaisesRegexp(BlockadeError, "Unknown containers"):
+            config.select(["db-4"])
+        with self.assertRaisesRegexp(BlockadeError, "group"):
+            config.select(["group:web"])
+        with self.assertRaisesRegexp(BlockadeError, "web-\\*"):
+            config.select(["db-*", "web-*"])
+
     def test_link_ordering_1(self):
         containers = [BlockadeContainerConfig("c1", "image"),
                       BlockadeContainerConfig("c2", "image"),
@@ -192,6 +282,21 @@ class ConfigTests(unittest.TestCase):
         self.assertDependencyLevels(ordered_names, ["c1"], ["c2", "c3"],
                                     ["c4", "c5"])
 
+    def test_dependency_levels(self):
+        containers = [BlockadeContainerConfig("c1", "image"),
+                      BlockadeContainerConfig("c2", "image", links=["c1"]),
+                      BlockadeContainerConfig("c3", "image"),
+                      BlockadeContainerConfig("c4", "image",
+                                              links=["c2", "c3"])]
+        config = BlockadeConfig(containers)
+        levels = [set(c.name for c in level)
+                  for level in config.dependency_levels]
+        self.assertEqual(levels, [set(["c1", "c3"]), set(["c2"]),
+                                  set(["c4"])])
+        self.assertDependencyLevels(
+            [c.name for c in config.sorted_containers],
+            ["c1", "c3"], ["c2"], ["c4"])
+
     def test_link_ordering_unknown_1(self):
         containers = [BlockadeContainerConfig("c1", "image"),
                       BlockadeContainerConfig("c2", "image", links=["c6"]),
@@ -224,6 +329,32 @@ class ConfigTests(unittest.TestCase):
         with self.assertRaisesRegexp(BlockadeConfigError, "circular"):
             dependency_sorted(containers)
 
+    def test_link_ordering_circular_path(self):
+        containers = [BlockadeContainerConfig("c1", "image", links=["c4"]),
+                      BlockadeContainerConfig("c2", "image", links=["c1"]),
+                      BlockadeContainerConfig("c3", "image", links=["c2"]),
+                      BlockadeContainerConfig("c4", "image", links=["c3"]),
+                      BlockadeContainerConfig("c5", "image", links=["c2"]),
+                      BlockadeContainerConfig("c6", "image")]
+
+        with self.assertRaisesRegexp(BlockadeConfigError,
+                                     "c1 -> c4 -> c3 -> c2 -> c1$"):
+            dependency_sorted(containers)
+
+        containers = [BlockadeContainerConfig("c1", "image", links=["c1"])]
+        with self.assertRaisesRegexp(BlockadeConfigError, "c1 -> c1$"):
+            dependency_sorted(containers)
+
+    def test_dependency_levels_long_chain(self):
+        # rescanning every container for each level would be quadratic
+        containers = [BlockadeContainerConfig("c0", "image")]
+        for index in range(1, 5000):
+            containers.append(BlockadeContainerConfig(
+                "c%d" % index, "image", links=["c%d" % (index - 1)]))
+        config = BlockadeConfig(containers)
+        self.assertEqual(len(config.dependency_levels), 5000)
+        self.assertEqual(config.sorted_containers[-1].name, "c4999")
+
     def assertDependencyLevels(self, seq, *levels):
         self.assertEquals(len(seq), sum(len(l) for l in levels))
 
@@ -14,10 +14,17 @@
 # limitations under the License.
 #
 
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+
 import mock
 
 from blockade.tests import unittest
-from blockade.core import Blockade, expand_partitions
+from blockade.core import Blockade, Container, ContainerState, \
+    expand_partitions, parallel_map
 from blockade.errors import BlockadeError
 from blockade.config import BlockadeContainerConfig, BlockadeConfig
 from blockade.state import BlockadeState
@@ -53,6 +60,329 @@ class BlockadeCoreTests(unittest.TestCase):
         self.assertEqual(self.state_factory.initialize.call_count, 1)
         self.assertEqual(self.docker_client.create_container.call_count, 3)
 
+    def test_create_records_containers(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image")])
+        self.network.new_veth_device_name.return_value = "veth1"
+        state = BlockadeState("ourblockadeid", {})
+        self.state_factory.initialize.side_effect = \
+            lambda x: state.update_containers(x) or state
+        self.docker_client.create_container.return_value = {"Id": "abc"}
+        self.docker_client.inspect_container.return_value = {
+            "State": {"Running": True},
+            "NetworkSettings": {"IPAddress": "10.0.0.1"}}
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        b.create()
+
+        self.assertEqual(state.container("c1"),
+                         {"veth_device": "veth1", "container_id": "abc",
+                          "ip_address": "10.0.0.1"})
+
+    def test_partition_and_netem_recorded(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        state = BlockadeState("ourblockadeid",
+                              {"c1": {"veth_device": "veth1"},
+                               "c2": {"veth_device": "veth2"}})
+        self.state_factory.load.return_value = state
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"], "Status": "Up 1s"}]
+        self.docker_client.inspect_container.return_value = {
+            "State": {"Running": True}, "NetworkSettings": {}}
+        self.network.get_ip_partitions.return_value = {}
+        self.network.network_states.return_value = {}
+        self.network.flaky_params.return_value = ["loss", "30%"]
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        b.partition([["c1"]])
+        self.assertEqual(state.partitions, {"c1": 1, "c2": 2})
+        b.join()
+        self.assertEqual(state.partitions, {})
+
+        b.flaky(["c2"])
+        self.network.flaky_devices.assert_called_once_with(["veth2"])
+        self.assertEqual(state.netem, {"c2": ["loss", "30%"]})
+        b.fast(include_all=True)
+        self.assertEqual(state.netem, {})
+
+    def test_create_by_dependency_level(self):
+        containers = [BlockadeContainerConfig("c1", "image"),
+                      BlockadeContainerConfig("c2", "image", links=["c1"]),
+                      BlockadeContainerConfig("c3", "image", links=["c1"]),
+                      BlockadeContainerConfig("c4", "image",
+                                              links=["c2", "c3"])]
+        config = BlockadeConfig(containers)
+
+        self.network.new_veth_device_name.side_effect = ["veth1", "veth2",
+                                                         "veth3", "veth4"]
+        initialize = lambda x: BlockadeState("ourblockadeid", x)
+        self.state_factory.initialize.side_effect = initialize
+
+        def create_container(image, name=None, **kwargs):
+            return {"Id": name}
+        self.docker_client.create_container.side_effect = create_container
+
+        started = []
+        self.docker_client.start.side_effect = \
+            lambda container_id, **kwargs: started.append(container_id)
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client, parallelism=4)
+        descriptions = b.create()
+
+        self.assertEqual([d.name for d in descriptions][0], "c1")
+        self.assertEqual([d.name for d in descriptions][3], "c4")
+        self.assertEqual(started[0], "ourblockadeid-c1")
+        self.assertEqual(set(started[1:3]),
+                         set(["ourblockadeid-c2", "ourblockadeid-c3"]))
+        self.assertEqual(started[3], "ourblockadeid-c4")
+
+    def test_destroy(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        self.state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {})
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"], "Status": "Up 1s"},
+            {"Id": "ghi", "Names": ["/otherblockade-c1"], "Status": "Up 1s"}]
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        b.destroy(stop_timeout=7)
+
+        self.assertEqual(
+            sorted(self.docker_client.stop.call_args_list),
+            [mock.call("abc", timeout=7), mock.call("def", timeout=7)])
+        self.assertEqual(
+            sorted(self.docker_client.remove_container.call_args_list),
+            [mock.call("abc"), mock.call("def")])
+        self.assertFalse(self.docker_client.kill.called)
+        self.network.restore.assert_called_once_with("ourblockadeid")
+        self.state_factory.destroy.assert_called_once_with()
+
+    def test_destroy_kill(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        self.state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {})
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"],
+             "Status": "Exited (0) 1s ago"}]
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        b.destroy(kill=True)
+
+        self.docker_client.kill.assert_called_once_with("abc")
+        self.assertFalse(self.docker_client.stop.called)
+        self.assertEqual(self.docker_client.remove_container.call_count, 2)
+
+    def test_create_labels(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image")])
+        self.network.new_veth_device_name.return_value = "veth1"
+        self.state_factory.initialize.side_effect = \
+            lambda x: BlockadeState("ourblockadeid", x)
+        self.docker_client.create_container.return_value = {"Id": "abc"}
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        b.create()
+
+        kwargs = self.docker_client.create_container.call_args[1]
+        self.assertEqual(kwargs['labels'], {"blockade.id": "ourblockadeid",
+                                            "blockade.name": "c1"})
+        self.assertEqual(kwargs['name'], "ourblockadeid-c1")
+
+    def test_create_without_labels(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image")])
+        self.network.new_veth_device_name.return_value = "veth1"
+        self.state_factory.initialize.side_effect = \
+            lambda x: BlockadeState("ourblockadeid", x)
+
+        def create_container(image, name=None, **kwargs):
+            if 'labels' in kwargs:
+                raise TypeError("unexpected keyword argument 'labels'")
+            return {"Id": "abc"}
+        self.docker_client.create_container.side_effect = create_container
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        b.create()
+        self.assertEqual(self.docker_client.create_container.call_count, 2)
+        self.docker_client.start.assert_called_once_with(
+            "abc", lxc_conf=mock.ANY, links={}, binds={})
+
+    def test_get_docker_containers_filtered(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image")])
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/whatever"], "Status": "Up 1s",
+             "Labels": {"blockade.id": "ourblockadeid",
+                        "blockade.name": "c1"}}]
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        containers = b._get_docker_containers("ourblockadeid")
+
+        self.assertEqual(list(containers), ["c1"])
+        self.docker_client.containers.assert_called_once_with(
+            all=True, filters={"label": ["blockade.id=ourblockadeid"]})
+
+    def test_get_docker_containers_fallback(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image")])
+        listed = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/otherblockade-c1"], "Status": "Up 1s"}]
+
+        # docker-py which can't filter
+        def containers(all=False, **kwargs):
+            if kwargs:
+                raise TypeError("unexpected keyword argument 'filters'")
+            return listed
+        self.docker_client.containers.side_effect = containers
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        result = b._get_docker_containers("ourblockadeid")
+        self.assertEqual(list(result), ["c1"])
+        self.assertEqual(result["c1"]["Id"], "abc")
+
+        # containers which were created without labels
+        self.docker_client.containers.side_effect = \
+            lambda all=False, filters=None: [] if filters else listed
+        result = b._get_docker_containers("ourblockadeid")
+        self.assertEqual(list(result), ["c1"])
+        self.assertEqual(self.docker_client.containers.call_count, 4)
+
+    def test_flaky_selectors(self):
+        config = BlockadeConfig.from_dict(dict(containers={
+            "db": {"image": "image", "count": 2},
+            "app": {"image": "image"}}))
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        containers = [Container(name, name, ContainerState.UP,
+                                veth_device="veth" + name)
+                      for name in ("db-1", "db-2", "app")]
+        with mock.patch.object(b, "_get_all_containers",
+                               return_value=containers):
+            b.flaky(["group:db"])
+            devices = self.network.flaky_devices.call_args[0][0]
+            self.assertEqual(sorted(devices), ["vethdb-1", "vethdb-2"])
+
+            b.partition([["db-*"]])
+            partitions = self.network.partition_containers.call_args[0][1]
+            self.assertEqual([sorted(c.name for c in p) for p in partitions],
+                             [["db-1", "db-2"], ["app"]])
+
+    def test_stream_logs(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        self.state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {})
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"], "Status": "Exit 1"}]
+        logs = {"abc": [b"2014-06-01T12:00:00Z one\n2014-06-01T12:00:01Z t",
+                        b"wo\n"],
+                "def": [b"2014-06-01T12:00:02Z crashed\n"]}
+        self.docker_client.logs.side_effect = \
+            lambda container_id, **kwargs: iter(logs[container_id])
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        lines = [(l.name, l.timestamp, l.text)
+                 for l in b.stream_logs(since=5, timestamps=True)]
+        self.assertEqual(sorted(lines),
+                         [("c1", "2014-06-01T12:00:00Z", "one"),
+                          ("c1", "2014-06-01T12:00:01Z", "two"),
+                          ("c2", "2014-06-01T12:00:02Z", "crashed")])
+        self.docker_client.logs.assert_any_call(
+            "def", stream=True, follow=False, since=5, timestamps=True)
+
+        lines = [l.text for l in b.stream_logs(["c1"])]
+        self.assertEqual(len(lines), 2)
+
+        with self.assertRaises(BlockadeError):
+            b.stream_logs(["c3"])
+
+    def test_collect_logs(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        self.state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {})
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"], "Status": "Exit 1"}]
+        logs = {"abc": [b"one\n", b"two\n"], "def": [b"crashed\n"]}
+        self.docker_client.logs.side_effect = \
+            lambda container_id, **kwargs: iter(logs[container_id])
+
+        directory = os.path.join(tempfile.mkdtemp(), "logs")
+        try:
+            b = Blockade(config, self.state_factory, self.network,
+                         self.docker_client)
+            archives = b.collect_logs(directory)
+            self.assertEqual([(a.name, a.size) for a in archives],
+                             [("c1", 8), ("c2", 8)])
+            with gzip.open(os.path.join(directory, "c1.log.gz")) as f:
+                self.assertEqual(f.read(), b"one\ntwo\n")
+        finally:
+            shutil.rmtree(os.path.dirname(directory))
+
+    def test_parallel_map(self):
+        self.assertEqual(parallel_map(lambda x: x * 2, range(10), 4),
+                         [x * 2 for x in range(10)])
+        self.assertEqual(parallel_map(lambda x: x * 2, [], 4), [])
+
+        def fail(x):
+            raise BlockadeError("failed %s" % x)
+        with self.assertRaisesRegexp(BlockadeError, "failed"):
+            parallel_map(fail, range(10), 4)
+
+    def test_parallel_map_timeout(self):
+        event = threading.Event()
+        try:
+            with self.assertRaisesRegexp(BlockadeError, "Timed out"):
+                parallel_map(lambda x: event.wait(5), range(3), 3,
+                             timeout=0.01)
+        finally:
+            event.set()
+
+    def test_status(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        self.state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {"c1": {"veth_device": "veth1"},
+                              "c2": {"veth_device": "veth2"}})
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"]},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"]}]
+        self.docker_client.inspect_container.side_effect = lambda cid: {
+            "State": {"Running": True},
+            "NetworkSettings": {"IPAddress": {"abc": "10.0.0.1",
+                                              "def": "10.0.0.2"}[cid]}}
+        self.network.get_ip_partitions.return_value = {"10.0.0.2": 1}
+        self.network.network_states.return_value = {"veth1": "SLOW"}
+
+        b = Blockade(config, self.state_factory, self.network,
+                     self.docker_client)
+        containers = dict((c.name, c) for c in b.status())
+
+        self.assertEqual(self.docker_client.containers.call_count, 1)
+        self.assertEqual(self.docker_client.inspect_container.call_count, 2)
+        self.assertEqual(containers["c1"].ip_address, "10.0.0.1")
+        self.assertEqual(containers["c1"].veth_device, "veth1")
+        self.assertEqual(containers["c1"].partition, None)
+        self.assertEqual(containers["c2"].partition, 1)
+        self.assertEqual(containers["c1"].network_state, "SLOW")
+        self.assertEqual(containers["c2"].network_state, "UNKNOWN")
+        self.assertEqual(self.network.network_states.call_count, 1)
+        self.assertFalse(self.network.network_state.called)
+
     def test_expand_partitions(self):
         containers = ["c1", "c2", "c3", "c4", "c5"]
 
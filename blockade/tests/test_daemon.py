@@ -0,0 +1,230 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import mock
+
+from blockade.tests import unittest
+from blockade.errors import BlockadeError, DaemonNotRunningError
+from blockade.core import Container, ContainerState
+from blockade.config import BlockadeConfig, BlockadeContainerConfig
+from blockade.state import BlockadeState
+from blockade.daemon import BlockadeDaemon, BlockadeClient, \
+    CachingBlockade, CachedStateFactory, call_daemon, daemon_running
+
+
+class BlockadeDaemonTests(unittest.TestCase):
+    tempdir = None
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "daemon.sock")
+        self.blockade = mock.Mock(parallelism=8)
+        for command in ("destroy", "flaky", "slow", "fast", "partition",
+                        "join"):
+            getattr(self.blockade, command).return_value = None
+
+    def tearDown(self):
+        if self.tempdir:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def start_daemon(self):
+        daemon = BlockadeDaemon(self.blockade, self.path)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.daemon = True
+        thread.start()
+        for _ in range(100):
+            if daemon_running(self.path):
+                break
+            time.sleep(0.01)
+
+        def stop():
+            daemon.shutdown()
+            thread.join(5)
+        self.addCleanup(stop)
+        return daemon
+
+    def test_handle_request(self):
+        self.blockade.status.return_value = [
+            Container("c1", "abc", ContainerState.UP, ip_address="10.0.0.1")]
+        daemon = BlockadeDaemon(self.blockade, self.path)
+
+        response = daemon.handle_request(dict(command="status"))
+        self.assertEqual(response['result'][0]['name'], "c1")
+        self.assertEqual(response['result'][0]['ip_address'], "10.0.0.1")
+
+        response = daemon.handle_request(
+            dict(command="flaky", args=dict(container_names=["c1"],
+                                            include_all=False)))
+        self.assertEqual(response, dict(result=None))
+        self.blockade.flaky.assert_called_once_with(container_names=["c1"],
+                                                    include_all=False)
+
+    def test_handle_request_errors(self):
+        daemon = BlockadeDaemon(self.blockade, self.path)
+        self.blockade.join.side_effect = BlockadeError("no way")
+        self.assertEqual(daemon.handle_request(dict(command="join")),
+                         dict(error="no way"))
+        self.assertIn("Unknown command",
+                      daemon.handle_request(dict(command="rm"))['error'])
+        self.assertIn("Invalid request",
+                      daemon.handle_request("status")['error'])
+
+    def test_handle_request_parallelism(self):
+        daemon = BlockadeDaemon(self.blockade, self.path)
+        seen = []
+        self.blockade.create.side_effect = \
+            lambda: seen.append(self.blockade.parallelism) or []
+        daemon.handle_request(dict(command="create",
+                                   args=dict(parallelism=2)))
+        self.assertEqual(seen, [2])
+        self.assertEqual(self.blockade.parallelism, 8)
+
+    def test_client(self):
+        self.blockade.status.return_value = [
+            Container("c1", "abc", ContainerState.UP, ip_address="10.0.0.1",
+                      veth_device="veth1", partition=2)]
+        self.blockade.logs.return_value = b"I am c1"
+        self.blockade.slow.side_effect = BlockadeError("not running")
+        self.start_daemon()
+
+        client = BlockadeClient(self.path)
+        containers = client.status()
+        self.assertEqual(len(containers), 1)
+        self.assertEqual(containers[0].name, "c1")
+        self.assertEqual(containers[0].state, ContainerState.UP)
+        self.assertEqual(containers[0].veth_device, "veth1")
+        self.assertEqual(containers[0].partition, 2)
+
+        self.assertEqual(client.logs("c1"), "I am c1")
+
+        client.partition([["c1"], ["c2", "c3"]])
+        self.blockade.partition.assert_called_once_with(
+            partitions=[["c1"], ["c2", "c3"]])
+
+        with self.assertRaisesRegexp(BlockadeError, "not running"):
+            client.slow(["c1"])
+
+    def test_not_running(self):
+        self.assertFalse(daemon_running(self.path))
+        with self.assertRaises(DaemonNotRunningError):
+            call_daemon("status", self.path)
+
+        # a stale socket file is not a running daemon
+        open(self.path, "w").close()
+        self.assertFalse(daemon_running(self.path))
+
+    def test_handle_request_config(self):
+        config_path = os.path.join(self.tempdir, "blockade.yaml")
+        daemon = BlockadeDaemon(self.blockade, self.path,
+                                config_path=config_path)
+        self.blockade.join.return_value = None
+
+        response = daemon.handle_request(dict(
+            command="join", config_path=os.path.join(self.tempdir, "other")))
+        self.assertIn("not %s" % (os.path.join(self.tempdir, "other"),),
+                      response['error'])
+        self.assertFalse(self.blockade.join.called)
+
+        response = daemon.handle_request(dict(command="join",
+                                              config_path=config_path))
+        self.assertEqual(response, dict(result=None))
+
+    def test_client_config(self):
+        self.start_daemon()
+        client = BlockadeClient(self.path, config_path="/elsewhere.yaml")
+        client.join()
+        self.blockade.join.assert_called_once_with()
+
+    def test_already_running(self):
+        self.start_daemon()
+        with self.assertRaisesRegexp(BlockadeError, "already"):
+            BlockadeDaemon(self.blockade, self.path).serve_forever()
+
+
+class CachingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir, True)
+
+    def test_caching_blockade(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        state_factory = mock.Mock()
+        state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {"c1": {"veth_device": "veth1"},
+                              "c2": {"veth_device": "veth2"}})
+        docker_client = mock.Mock()
+        docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"], "Status": "Up 1s"}]
+        docker_client.inspect_container.return_value = {
+            "State": {"Running": True},
+            "NetworkSettings": {"IPAddress": "10.0.0.1"}}
+        network = mock.Mock()
+        network.get_ip_partitions.return_value = {}
+        network.network_states.return_value = {}
+
+        b = CachingBlockade(config, state_factory, network, docker_client)
+        b.status()
+        b.status()
+        self.assertEqual(docker_client.inspect_container.call_count, 2)
+
+        # a container which stopped is inspected again
+        docker_client.containers.return_value[1]["Status"] = "Exited (0)"
+        b.status()
+        self.assertEqual(docker_client.inspect_container.call_count, 3)
+
+    def test_cached_state_factory(self):
+        state_factory = mock.Mock()
+        state_factory.load.return_value = BlockadeState("id1", {})
+        factory = CachedStateFactory(
+            state_factory, [os.path.join(self.tempdir, "state.db")])
+
+        self.assertEqual(factory.load().blockade_id, "id1")
+        self.assertEqual(factory.load().blockade_id, "id1")
+        self.assertEqual(state_factory.load.call_count, 1)
+
+        factory.destroy()
+        state_factory.destroy.assert_called_once_with()
+        factory.load()
+        self.assertEqual(state_factory.load.call_count, 2)
+
+    def test_cached_state_factory_replaced(self):
+        # another blockade command destroyed the blockade and made a new
+        # one without going through the daemon
+        path = os.path.join(self.tempdir, "state.db")
+        open(path, "w").close()
+        state_factory = mock.Mock()
+        state_factory.load.side_effect = [BlockadeState("id1", {}),
+                                          BlockadeState("id2", {})]
+        factory = CachedStateFactory(state_factory, [path])
+        self.assertEqual(factory.load().blockade_id, "id1")
+
+        os.unlink(path)
+        open(path + ".tmp", "w").close()
+        os.link(path + ".tmp", path)
+        os.unlink(path + ".tmp")
+        os.utime(path, None)
+        self.assertEqual(factory.load().blockade_id, "id2")
+        self.assertEqual(factory.load().blockade_id, "id2")
+        self.assertEqual(state_factory.load.call_count, 2)
@@ -0,0 +1,151 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+
+from blockade.tests import unittest
+from blockade.errors import BlockadeError
+from blockade.logs import docker_log_stream, split_lines, parse_log_line, \
+    multiplex, archive_log
+
+
+class LogsTests(unittest.TestCase):
+
+    def test_split_lines(self):
+        chunks = [b"one\ntw", "o\n", b"", b"three\nfour"]
+        self.assertEqual(list(split_lines(chunks)),
+                         [b"one", b"two", b"three", b"four"])
+
+    def test_split_lines_long_line(self):
+        chunks = [b"x" * 10, b"x" * 10, b"\n"]
+        self.assertEqual(list(split_lines(chunks, max_line=8)),
+                         [b"x" * 8, b"x" * 8, b"x" * 4])
+
+    def test_parse_log_line(self):
+        line = parse_log_line("c1", b"2014-06-01T12:00:00.123Z hello\r",
+                              timestamps=True)
+        self.assertEqual((line.name, line.timestamp, line.text),
+                         ("c1", "2014-06-01T12:00:00.123Z", "hello"))
+
+        line = parse_log_line("c1", b"hello world", timestamps=True)
+        self.assertEqual(line.text, "hello world")
+        self.assertTrue(line.timestamp.endswith("Z"))
+
+    def test_docker_log_stream(self):
+        client = mock.Mock()
+        client.logs.return_value = iter([b"a\n", b"b\n"])
+        self.assertEqual(list(docker_log_stream(client, "abc", follow=True,
+                                                since=10)),
+                         [b"a\n", b"b\n"])
+        client.logs.assert_called_once_with("abc", stream=True, follow=True,
+                                            since=10, timestamps=False)
+
+    def test_docker_log_stream_old_client(self):
+        client = mock.Mock()
+
+        def logs(container_id, **kwargs):
+            if kwargs:
+                raise TypeError("unexpected keyword argument 'stream'")
+            return b"all of it"
+        client.logs.side_effect = logs
+        client.attach.return_value = iter([b"more"])
+
+        self.assertEqual(list(docker_log_stream(client, "abc")),
+                         [b"all of it"])
+        self.assertEqual(list(docker_log_stream(client, "abc", follow=True)),
+                         [b"more"])
+        client.attach.assert_called_once_with("abc", stream=True, logs=True)
+        with self.assertRaises(BlockadeError):
+            list(docker_log_stream(client, "abc", since=10))
+
+    def test_multiplex(self):
+        items = list(multiplex([iter(range(100)), iter(range(100, 150)),
+                                iter([])], queue_size=4))
+        self.assertEqual(sorted(items), list(range(150)))
+        # each source's items stay in order
+        self.assertEqual([i for i in items if i < 100], list(range(100)))
+
+    def test_multiplex_error(self):
+        def failing():
+            yield 1
+            raise ValueError("oops")
+
+        with self.assertRaises(ValueError):
+            list(multiplex([failing()]))
+
+    def test_multiplex_bounded(self):
+        read = []
+        finished = threading.Event()
+
+        def source():
+            try:
+                for i in range(1000):
+                    read.append(i)
+                    yield i
+            finally:
+                finished.set()
+
+        lines = multiplex([source()], queue_size=2)
+        self.assertEqual(next(lines), 0)
+        # the reader can only get a few items ahead of the consumer
+        self.assertFalse(finished.wait(0.3))
+        self.assertTrue(len(read) <= 5)
+        lines.close()
+        self.assertTrue(finished.wait(5))
+
+
+class ArchiveLogTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_archive_log_gzip(self):
+        path = os.path.join(self.tempdir, "c1.log.gz")
+        chunks = (("line %d\n" % n).encode() for n in range(1000))
+        archive = archive_log("c1", chunks, path)
+
+        with gzip.open(path) as f:
+            content = f.read()
+        self.assertEqual(content.count(b"\n"), 1000)
+        self.assertEqual(archive.size, len(content))
+        self.assertEqual(archive.compressed_size, os.path.getsize(path))
+        self.assertTrue(archive.compressed_size < archive.size)
+        self.assertEqual(archive.to_dict()["name"], "c1")
+
+    def test_archive_log_zstd(self):
+        try:
+            import zstandard
+        except ImportError:
+            raise unittest.SkipTest("zstandard is not installed")
+        path = os.path.join(self.tempdir, "c1.log.zst")
+        archive = archive_log("c1", [b"hello\n", "world\n"], path, "zstd")
+        with open(path, "rb") as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            self.assertEqual(reader.read(), b"hello\nworld\n")
+        self.assertEqual(archive.size, 12)
+
+    def test_archive_log_unknown_compression(self):
+        with self.assertRaises(BlockadeError):
+            archive_log("c1", [], os.path.join(self.tempdir, "x"), "lzma")
@@ -19,8 +19,9 @@ import subprocess
 
 from blockade.tests import unittest
 import blockade.net
+from blockade.errors import BlockadeError
 from blockade.net import NetworkState, BlockadeNetwork, \
-    parse_partition_index, partition_chain_name
+    parse_partition_index, partition_chain_name, parse_batch_failures
 
 # NOTE these values are "byte strings" -- to depict output we would see
 # from subprocess calls. We need to make sure we properly decode them
@@ -30,6 +31,14 @@ NORMAL_QDISC_SHOW = b"qdisc pfifo_fast 0: root refcnt 2 bands 3 priomap\n"
 SLOW_QDISC_SHOW = b"qdisc netem 8011: root refcnt 2 limit 1000 delay 50.0ms\n"
 FLAKY_QDISC_SHOW = b"qdisc netem 8011: root refcnt 2 limit 1000 loss 50%\n"
 
+QDISC_SHOW_ALL = b"""qdisc noqueue 0: dev lo root refcnt 2
+qdisc pfifo_fast 0: dev eth0 root refcnt 2 bands 3 priomap  1 2 2 2 1 2 0 0
+qdisc netem 8011: dev vethaaaaaaaa root refcnt 2 limit 1000 delay 50.0ms
+qdisc netem 8012: dev vethbbbbbbbb root refcnt 2 limit 1000 loss 50%
+qdisc noqueue 0: dev vethcccccccc root refcnt 2
+qdisc ingress ffff: dev vethdddddddd parent ffff:fff1 ----------------
+"""
+
 QDISC_DEL_NOENT = b"RTNETLINK answers: No such file or directory"
 
 
@@ -47,52 +56,86 @@ ACCEPT     all  --  anywhere             anywhere
 ACCEPT     all  --  anywhere             anywhere
 """
 
-_IPTABLES_LIST_FORWARD_2 = b"""Chain FORWARD (policy ACCEPT)
-target     prot opt source               destination
+_IPTABLES_SAVE_1 = b"""# Generated by iptables-save v1.4.21
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:blockade-e5dcf85cd2-p1 - [0:0]
+:blockade-e5dcf85cd2-p2 - [0:0]
+:blockade-aa43racd2-p1 - [0:0]
+-A FORWARD -s 172.17.0.16/32 -j blockade-aa43racd2-p1
+-A FORWARD -s 172.17.0.162/32 -j blockade-e5dcf85cd2-p1
+-A FORWARD -s 172.17.0.164/32 -j blockade-e5dcf85cd2-p1
+-A FORWARD -s 172.17.0.163/32 -j blockade-e5dcf85cd2-p2
+-A FORWARD -o docker0 -j ACCEPT
+-A blockade-e5dcf85cd2-p1 -d 172.17.0.163/32 -j DROP
+-A blockade-e5dcf85cd2-p2 -d 172.17.0.162/32 -j DROP
+-A blockade-e5dcf85cd2-p2 -d 172.17.0.164/32 -j DROP
+COMMIT
+# Completed
 """
 
-_IPTABLES_LIST_1 = b"""Chain INPUT (policy ACCEPT)
-target     prot opt source               destination
-
-Chain FORWARD (policy ACCEPT)
-target     prot opt source               destination
-blockade-e5dcf85cd2-p1  all  --  172.17.0.162         anywhere
-blockade-e5dcf85cd2-p1  all  --  172.17.0.164         anywhere
-ACCEPT     tcp  --  172.17.0.162         172.17.0.164         tcp spt:8000
-ACCEPT     tcp  --  172.17.0.164         172.17.0.162         tcp dpt:8000
-ACCEPT     tcp  --  172.17.0.162         172.17.0.163         tcp spt:8000
-ACCEPT     tcp  --  172.17.0.163         172.17.0.162         tcp dpt:8000
-ACCEPT     all  --  anywhere             anywhere
-ACCEPT     all  --  anywhere             anywhere
-
-Chain OUTPUT (policy ACCEPT)
-target     prot opt source               destination
-
-Chain blockade-e5dcf85cd2-p1 (2 references)
-target     prot opt source               destination
-DROP       all  --  anywhere             172.17.0.163
-
-Chain blockade-e5dcf85cd2-p2 (0 references)
-target     prot opt source               destination
-DROP       all  --  anywhere             172.17.0.162
-DROP       all  --  anywhere             172.17.0.164
+_IPTABLES_SAVE_2 = b"""# Generated by iptables-save v1.4.21
+*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+-A FORWARD -o docker0 -j ACCEPT
+COMMIT
+# Completed
 """
 
-_IPTABLES_LIST_2 = b"""Chain INPUT (policy ACCEPT)
-target     prot opt source               destination
-
-Chain FORWARD (policy ACCEPT)
-target     prot opt source               destination
-ACCEPT     tcp  --  172.17.0.162         172.17.0.164         tcp spt:8000
-ACCEPT     tcp  --  172.17.0.164         172.17.0.162         tcp dpt:8000
-ACCEPT     tcp  --  172.17.0.162         172.17.0.163         tcp spt:8000
-ACCEPT     tcp  --  172.17.0.163         172.17.0.162         tcp dpt:8000
-ACCEPT     all  --  anywhere             anywhere
-ACCEPT     all  --  anywhere             anywhere
-
-Chain OUTPUT (policy ACCEPT)
-target     prot opt source               destination
-"""
+_IPSET_SAVE_1 = (
+    b"create blockade-e5dcf85cd2-p1 hash:ip family inet hashsize 1024 "
+    b"maxelem 65536\n"
+    b"add blockade-e5dcf85cd2-p1 172.17.0.162\n"
+    b"add blockade-e5dcf85cd2-p1 172.17.0.164\n"
+    b"create blockade-e5dcf85cd2-p2 hash:ip family inet hashsize 1024 "
+    b"maxelem 65536\n"
+    b"add blockade-e5dcf85cd2-p2 172.17.0.163\n"
+    b"create blockade-e5dcf85cd2-all hash:ip family inet hashsize 1024 "
+    b"maxelem 65536\n"
+    b"add blockade-e5dcf85cd2-all 172.17.0.162\n"
+    b"add blockade-e5dcf85cd2-all 172.17.0.163\n"
+    b"add blockade-e5dcf85cd2-all 172.17.0.164\n"
+    b"create docker-unrelated hash:ip family inet hashsize 1024 "
+    b"maxelem 65536\n"
+    b"add docker-unrelated 10.0.0.1\n")
+
+_IPTABLES_SAVE_IPSET_1 = (
+    b"*filter\n"
+    b":INPUT ACCEPT [0:0]\n"
+    b":FORWARD ACCEPT [0:0]\n"
+    b":OUTPUT ACCEPT [0:0]\n"
+    b":blockade-e5dcf85cd2-p1 - [0:0]\n"
+    b":blockade-e5dcf85cd2-p2 - [0:0]\n"
+    b"-A FORWARD -m set --match-set blockade-e5dcf85cd2-p2 src "
+    b"-j blockade-e5dcf85cd2-p2\n"
+    b"-A FORWARD -m set --match-set blockade-e5dcf85cd2-p1 src "
+    b"-j blockade-e5dcf85cd2-p1\n"
+    b"-A FORWARD -o docker0 -j ACCEPT\n"
+    b"COMMIT\n")
+
+
+def _fake_commands(mock_subprocess, outputs):
+    """Make check_output answer by command name and record Popen input
+    """
+    mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+    mock_subprocess.check_output.side_effect = \
+        lambda cmd: outputs[cmd[0]]
+    mock_process = mock_subprocess.Popen.return_value
+    mock_process.communicate.return_value = b"", b""
+    mock_process.returncode = 0
+
+    inputs = []
+
+    def popen(cmd, **kwargs):
+        mock_process.communicate.side_effect = \
+            lambda data: inputs.append((cmd[0], data.decode())) or (b"", b"")
+        return mock_process
+    mock_subprocess.Popen.side_effect = popen
+    return inputs
 
 
 class NetTests(unittest.TestCase):
@@ -107,94 +150,79 @@ class NetTests(unittest.TestCase):
             self.assertEqual(mock_subprocess.check_output.call_count, 1)
             self.assertEqual(result, {"172.17.0.162": 1, "172.17.0.164": 1})
 
-    def test_iptables_delete_blockade_rules_1(self):
+    def test_clear_iptables_1(self):
         blockade_id = "blockade-e5dcf85cd2"
         with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            mock_check_output = mock_subprocess.check_output
-            mock_check_output.return_value = _IPTABLES_LIST_FORWARD_1
-            blockade.net.iptables_delete_blockade_rules(blockade_id)
-
-            self.assertEqual(mock_subprocess.check_output.call_count, 1)
+            inputs = _fake_commands(mock_subprocess,
+                                    {"iptables-save": _IPTABLES_SAVE_1})
+            blockade.net.clear_iptables(blockade_id)
 
-            # rules should be removed in reverse order
-            expected_calls = [mock.call(["iptables", "-D", "FORWARD", "4"]),
-                              mock.call(["iptables", "-D", "FORWARD", "3"])]
-            self.assertEqual(mock_subprocess.check_call.call_args_list,
-                             expected_calls)
+            self.assertEqual(mock_subprocess.check_call.call_count, 0)
 
-    def test_iptables_delete_blockade_rules_2(self):
+            # jumps are deleted by spec, then the chains, all in one
+            # transaction
+            self.assertEqual(inputs, [("iptables-restore", "\n".join([
+                "*filter",
+                "-D FORWARD -s 172.17.0.162/32 -j blockade-e5dcf85cd2-p1",
+                "-D FORWARD -s 172.17.0.164/32 -j blockade-e5dcf85cd2-p1",
+                "-D FORWARD -s 172.17.0.163/32 -j blockade-e5dcf85cd2-p2",
+                "-F blockade-e5dcf85cd2-p1",
+                "-X blockade-e5dcf85cd2-p1",
+                "-F blockade-e5dcf85cd2-p2",
+                "-X blockade-e5dcf85cd2-p2",
+                "COMMIT", ""]))])
+
+    def test_clear_iptables_2(self):
         blockade_id = "blockade-e5dcf85cd2"
         with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            mock_check_output = mock_subprocess.check_output
-            mock_check_output.return_value = _IPTABLES_LIST_FORWARD_2
-            blockade.net.iptables_delete_blockade_rules(blockade_id)
+            inputs = _fake_commands(mock_subprocess,
+                                    {"iptables-save": _IPTABLES_SAVE_2})
+            blockade.net.clear_iptables(blockade_id)
 
-            self.assertEqual(mock_subprocess.check_output.call_count, 1)
             self.assertEqual(mock_subprocess.check_call.call_count, 0)
+            self.assertEqual(inputs, [])
 
-    def test_iptables_delete_blockade_chains_1(self):
+    def test_clear_iptables_lock_retry(self):
         blockade_id = "blockade-e5dcf85cd2"
         with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            mock_subprocess.check_output.return_value = _IPTABLES_LIST_1
-            blockade.net.iptables_delete_blockade_chains(blockade_id)
-
-            self.assertEqual(mock_subprocess.check_output.call_count, 1)
-
-            expected_calls = [
-                mock.call(["iptables", "-F", "blockade-e5dcf85cd2-p1"]),
-                mock.call(["iptables", "-X", "blockade-e5dcf85cd2-p1"]),
-                mock.call(["iptables", "-F", "blockade-e5dcf85cd2-p2"]),
-                mock.call(["iptables", "-X", "blockade-e5dcf85cd2-p2"])]
-            self.assertEqual(mock_subprocess.check_call.call_args_list,
-                             expected_calls)
-
-    def test_iptables_delete_blockade_chains_2(self):
+            _fake_commands(mock_subprocess,
+                           {"iptables-save": _IPTABLES_SAVE_1})
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.side_effect = None
+            mock_process.communicate.return_value = (
+                b"", b"Another app is currently holding the xtables lock. "
+                b"Perhaps you want to use the -w option?")
+            mock_process.returncode = 4
+
+            # something else held the lock the first time
+            def popen(cmd, **kwargs):
+                if mock_subprocess.Popen.call_count > 1:
+                    mock_process.communicate.return_value = b"", b""
+                    mock_process.returncode = 0
+                return mock_process
+            mock_subprocess.Popen.side_effect = popen
+
+            with mock.patch('blockade.net.time.sleep') as mock_sleep:
+                blockade.net.clear_iptables(blockade_id)
+            self.assertEqual(mock_subprocess.check_output.call_count, 2)
+            self.assertEqual(mock_subprocess.Popen.call_count, 2)
+            self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_clear_iptables_failure_not_retried(self):
         blockade_id = "blockade-e5dcf85cd2"
         with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            mock_subprocess.check_output.return_value = _IPTABLES_LIST_2
-            blockade.net.iptables_delete_blockade_chains(blockade_id)
-
-            self.assertEqual(mock_subprocess.check_output.call_count, 1)
-            self.assertEqual(mock_subprocess.check_call.call_count, 0)
-
-    def test_iptables_insert_rule_1(self):
-        with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            blockade.net.iptables_insert_rule("FORWARD", src="192.168.0.1",
-                                              target="DROP")
-            mock_subprocess.check_call.assert_called_once_with(
-                ["iptables", "-I", "FORWARD", "-s", "192.168.0.1",
-                 "-j", "DROP"])
-
-    def test_iptables_insert_rule_2(self):
-        with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            blockade.net.iptables_insert_rule("FORWARD", src="192.168.0.1",
-                                              dest="192.168.0.2",
-                                              target="DROP")
-            mock_subprocess.check_call.assert_called_once_with(
-                ["iptables", "-I", "FORWARD", "-s", "192.168.0.1", "-d",
-                 "192.168.0.2", "-j", "DROP"])
-
-    def test_iptables_insert_rule_3(self):
-        with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            blockade.net.iptables_insert_rule("FORWARD", dest="192.168.0.2",
-                                              target="DROP")
-            mock_subprocess.check_call.assert_called_once_with(
-                ["iptables", "-I", "FORWARD", "-d", "192.168.0.2",
-                 "-j", "DROP"])
-
-    def test_iptables_create_chain(self):
-        with mock.patch('blockade.net.subprocess') as mock_subprocess:
-            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
-            blockade.net.iptables_create_chain("hats")
-            mock_subprocess.check_call.assert_called_once_with(
-                ["iptables", "-N", "hats"])
+            _fake_commands(mock_subprocess,
+                           {"iptables-save": _IPTABLES_SAVE_1})
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.side_effect = None
+            mock_process.communicate.return_value = (
+                b"", b"iptables-restore: line 2 failed")
+            mock_process.returncode = 1
+            mock_subprocess.Popen.side_effect = None
+
+            with self.assertRaisesRegexp(BlockadeError, "line 2 failed"):
+                blockade.net.clear_iptables(blockade_id)
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
 
     def test_partition_chain_parse(self):
         blockade_id = "abc123"
@@ -228,6 +256,62 @@ class NetTests(unittest.TestCase):
             self.assertIn('somedevice',
                           mock_subprocess.Popen.call_args[0][0])
 
+    def test_netem_devices_batch(self):
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value = mock.Mock()
+            mock_process.communicate.return_value = b"", b""
+            mock_process.returncode = 0
+
+            net = BlockadeNetwork(mock.Mock(network={"slow": "75ms 100ms"}))
+            net.slow_devices(["veth1", "veth2"])
+
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
+            self.assertEqual(mock_subprocess.Popen.call_args[0][0],
+                             ["tc", "-force", "-batch", "-"])
+            mock_process.communicate.assert_called_once_with(
+                b"qdisc replace dev veth1 root netem delay 75ms 100ms\n"
+                b"qdisc replace dev veth2 root netem delay 75ms 100ms\n")
+
+    def test_netem_devices_failure(self):
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value = mock.Mock()
+            mock_process.communicate.return_value = b"", (
+                b'Cannot find device "veth2"\nCommand failed -:2\n')
+            mock_process.returncode = 1
+
+            net = BlockadeNetwork(mock.Mock(network={"flaky": "30%"}))
+            with self.assertRaisesRegexp(BlockadeError,
+                                         'veth2 root netem loss 30%: '
+                                         'Cannot find device "veth2"$'):
+                net.flaky_devices(["veth1", "veth2", "veth3"])
+
+    def test_restore_devices_already_normal(self):
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value = mock.Mock()
+            mock_process.communicate.return_value = b"", (
+                QDISC_DEL_NOENT + b"\nCommand failed -:1\n"
+                b"Error: Cannot delete qdisc with handle of zero.\n"
+                b"Command failed -:3\n")
+            mock_process.returncode = 1
+
+            net = BlockadeNetwork(mock.Mock())
+            net.fast_devices(["veth1", "veth2", "veth3"])
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
+
+            # nothing to do, nothing run
+            net.fast_devices([])
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
+
+    def test_parse_batch_failures(self):
+        output = ("RTNETLINK answers: Invalid argument\n"
+                  "We have an error talking to the kernel\n"
+                  "Command failed -:2\n"
+                  "Command failed -:5\n")
+        self.assertEqual(parse_batch_failures(output), {
+            1: "RTNETLINK answers: Invalid argument "
+               "We have an error talking to the kernel",
+            4: ""})
+
     def test_network_state_slow(self):
         self._network_state(NetworkState.SLOW, SLOW_QDISC_SHOW)
 
@@ -246,3 +330,349 @@ class NetTests(unittest.TestCase):
             self.assertEqual(net.network_state('somedevice'), state)
             self.assertIn('somedevice',
                           mock_subprocess.check_output.call_args[0][0])
+
+    def test_iptables_get_partition_layout_ipset(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        lines = _IPTABLES_SAVE_IPSET_1.decode().split("\n")
+        chain_rules, jumps = blockade.net.iptables_get_partition_layout(
+            blockade_id, lines)
+        self.assertEqual(chain_rules, {"blockade-e5dcf85cd2-p1": [],
+                                       "blockade-e5dcf85cd2-p2": []})
+        self.assertEqual(jumps, [
+            ("-m set --match-set blockade-e5dcf85cd2-p2 src "
+             "-j blockade-e5dcf85cd2-p2", None, "blockade-e5dcf85cd2-p2"),
+            ("-m set --match-set blockade-e5dcf85cd2-p1 src "
+             "-j blockade-e5dcf85cd2-p1", None, "blockade-e5dcf85cd2-p1")])
+
+    def test_partition_containers_1(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.return_value = _IPTABLES_SAVE_2
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = b"", b""
+            mock_process.returncode = 0
+
+            blockade.net.partition_containers(blockade_id, [[c1, c2], [c3]])
+
+            self.assertEqual(mock_subprocess.check_output.call_count, 1)
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
+            self.assertEqual(mock_subprocess.check_call.call_count, 0)
+            self.assertEqual(mock_subprocess.Popen.call_args[0][0],
+                             ["iptables-restore", "--noflush"])
+
+            restore_input = mock_process.communicate.call_args[0][0].decode()
+            self.assertEqual(restore_input.split("\n"), [
+                "*filter",
+                ":blockade-e5dcf85cd2-p1 - [0:0]",
+                ":blockade-e5dcf85cd2-p2 - [0:0]",
+                "-A blockade-e5dcf85cd2-p1 -d 172.17.0.164 -j DROP",
+                "-I FORWARD -s 172.17.0.162 -j blockade-e5dcf85cd2-p1",
+                "-I FORWARD -s 172.17.0.163 -j blockade-e5dcf85cd2-p1",
+                "-A blockade-e5dcf85cd2-p2 -d 172.17.0.162 -j DROP",
+                "-A blockade-e5dcf85cd2-p2 -d 172.17.0.163 -j DROP",
+                "-I FORWARD -s 172.17.0.164 -j blockade-e5dcf85cd2-p2",
+                "COMMIT",
+                ""])
+
+    def test_partition_containers_replace(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.return_value = _IPTABLES_SAVE_1
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = b"", b""
+            mock_process.returncode = 0
+
+            # a single partition means no partitions: only the teardown
+            blockade.net.partition_containers(blockade_id, [[c1, c2, c3]])
+
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
+            restore_input = mock_process.communicate.call_args[0][0].decode()
+            self.assertEqual(restore_input.split("\n"), [
+                "*filter",
+                "-D FORWARD -s 172.17.0.162/32 -j blockade-e5dcf85cd2-p1",
+                "-D FORWARD -s 172.17.0.164/32 -j blockade-e5dcf85cd2-p1",
+                "-D FORWARD -s 172.17.0.163/32 -j blockade-e5dcf85cd2-p2",
+                "-F blockade-e5dcf85cd2-p1",
+                "-X blockade-e5dcf85cd2-p1",
+                "-F blockade-e5dcf85cd2-p2",
+                "-X blockade-e5dcf85cd2-p2",
+                "COMMIT",
+                ""])
+
+    def test_iptables_get_partition_layout(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        lines = _IPTABLES_SAVE_1.decode().split("\n")
+        chain_rules, jumps = blockade.net.iptables_get_partition_layout(
+            blockade_id, lines)
+        self.assertEqual(chain_rules, {
+            "blockade-e5dcf85cd2-p1": [
+                ("-d 172.17.0.163/32 -j DROP", "172.17.0.163")],
+            "blockade-e5dcf85cd2-p2": [
+                ("-d 172.17.0.162/32 -j DROP", "172.17.0.162"),
+                ("-d 172.17.0.164/32 -j DROP", "172.17.0.164")]})
+        self.assertEqual(jumps, [
+            ("-s 172.17.0.162/32 -j blockade-e5dcf85cd2-p1", "172.17.0.162",
+             "blockade-e5dcf85cd2-p1"),
+            ("-s 172.17.0.164/32 -j blockade-e5dcf85cd2-p1", "172.17.0.164",
+             "blockade-e5dcf85cd2-p1"),
+            ("-s 172.17.0.163/32 -j blockade-e5dcf85cd2-p2", "172.17.0.163",
+             "blockade-e5dcf85cd2-p2")])
+
+    def test_partition_containers_move_one(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.return_value = _IPTABLES_SAVE_1
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = b"", b""
+            mock_process.returncode = 0
+
+            # move c3 from the first partition to the second
+            blockade.net.partition_containers(blockade_id, [[c1], [c2, c3]])
+
+            restore_input = mock_process.communicate.call_args[0][0].decode()
+            self.assertEqual(restore_input.split("\n"), [
+                "*filter",
+                "-A blockade-e5dcf85cd2-p1 -d 172.17.0.164 -j DROP",
+                "-I FORWARD -s 172.17.0.164 -j blockade-e5dcf85cd2-p2",
+                "-D FORWARD -s 172.17.0.164/32 -j blockade-e5dcf85cd2-p1",
+                "-D blockade-e5dcf85cd2-p2 -d 172.17.0.164/32 -j DROP",
+                "COMMIT",
+                ""])
+
+    def test_partition_containers_unchanged(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.return_value = _IPTABLES_SAVE_1
+
+            blockade.net.partition_containers(blockade_id, [[c1, c3], [c2]])
+
+            self.assertEqual(mock_subprocess.check_output.call_count, 1)
+            self.assertFalse(mock_subprocess.Popen.called)
+
+    def test_partition_delta_adds_partition(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        lines = _IPTABLES_SAVE_1.decode().split("\n")
+        chain_rules, jumps = blockade.net.iptables_get_partition_layout(
+            blockade_id, lines)
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+
+        delta = blockade.net.iptables_partition_delta(
+            blockade_id, [[c1], [c2], [c3]], chain_rules, jumps)
+        self.assertEqual(delta, [
+            "*filter",
+            ":blockade-e5dcf85cd2-p3 - [0:0]",
+            "-A blockade-e5dcf85cd2-p1 -d 172.17.0.164 -j DROP",
+            "-A blockade-e5dcf85cd2-p3 -d 172.17.0.162 -j DROP",
+            "-A blockade-e5dcf85cd2-p3 -d 172.17.0.163 -j DROP",
+            "-I FORWARD -s 172.17.0.164 -j blockade-e5dcf85cd2-p3",
+            "-D FORWARD -s 172.17.0.164/32 -j blockade-e5dcf85cd2-p1",
+            "COMMIT"])
+
+    def test_partition_containers_restore_failure(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2 = [mock.Mock(ip_address="172.17.0.%d" % i) for i in (1, 2)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.return_value = _IPTABLES_SAVE_2
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = (
+                b"", b"iptables-restore: line 4 failed")
+            mock_process.returncode = 1
+
+            with self.assertRaisesRegexp(BlockadeError, "line 4 failed"):
+                blockade.net.partition_containers(blockade_id, [[c1], [c2]])
+
+    def test_network_states(self):
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.return_value = QDISC_SHOW_ALL
+
+            net = BlockadeNetwork(mock.Mock())
+            states = net.network_states()
+            self.assertEqual(mock_subprocess.check_output.call_count, 1)
+            self.assertEqual(states, {
+                "lo": NetworkState.NORMAL,
+                "eth0": NetworkState.NORMAL,
+                "vethaaaaaaaa": NetworkState.SLOW,
+                "vethbbbbbbbb": NetworkState.FLAKY,
+                "vethcccccccc": NetworkState.NORMAL})
+
+    def test_ipset_get_ip_partitions(self):
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            _fake_commands(mock_subprocess, {"ipset": _IPSET_SAVE_1})
+            result = blockade.net.ipset_get_ip_partitions(
+                "blockade-e5dcf85cd2")
+            self.assertEqual(result, {"172.17.0.162": 1, "172.17.0.164": 1,
+                                      "172.17.0.163": 2})
+
+    def test_partition_containers_ipset_new(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            inputs = _fake_commands(mock_subprocess,
+                                    {"ipset": b"", "iptables-save":
+                                     _IPTABLES_SAVE_2})
+            blockade.net.partition_containers_ipset(blockade_id,
+                                                    [[c1, c3], [c2]])
+
+        self.assertEqual([cmd for cmd, _ in inputs],
+                         ["ipset", "iptables-restore"])
+        self.assertEqual(inputs[0][1].split("\n"), [
+            "create blockade-e5dcf85cd2-all hash:ip",
+            "add blockade-e5dcf85cd2-all 172.17.0.162",
+            "add blockade-e5dcf85cd2-all 172.17.0.163",
+            "add blockade-e5dcf85cd2-all 172.17.0.164",
+            "create blockade-e5dcf85cd2-p1 hash:ip",
+            "add blockade-e5dcf85cd2-p1 172.17.0.162",
+            "add blockade-e5dcf85cd2-p1 172.17.0.164",
+            "create blockade-e5dcf85cd2-p2 hash:ip",
+            "add blockade-e5dcf85cd2-p2 172.17.0.163",
+            ""])
+        self.assertEqual(inputs[1][1].split("\n"), [
+            "*filter",
+            ":blockade-e5dcf85cd2-p1 - [0:0]",
+            ":blockade-e5dcf85cd2-p2 - [0:0]",
+            "-A blockade-e5dcf85cd2-p1 -m set ! --match-set "
+            "blockade-e5dcf85cd2-p1 dst -m set --match-set "
+            "blockade-e5dcf85cd2-all dst -j DROP",
+            "-I FORWARD -m set --match-set blockade-e5dcf85cd2-p1 src "
+            "-j blockade-e5dcf85cd2-p1",
+            "-A blockade-e5dcf85cd2-p2 -m set ! --match-set "
+            "blockade-e5dcf85cd2-p2 dst -m set --match-set "
+            "blockade-e5dcf85cd2-all dst -j DROP",
+            "-I FORWARD -m set --match-set blockade-e5dcf85cd2-p2 src "
+            "-j blockade-e5dcf85cd2-p2",
+            "COMMIT",
+            ""])
+
+    def test_partition_containers_ipset_move(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        c1, c2, c3 = [mock.Mock(ip_address="172.17.0.%d" % i)
+                      for i in (162, 163, 164)]
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            inputs = _fake_commands(mock_subprocess,
+                                    {"ipset": _IPSET_SAVE_1})
+            # move c3 from p1 to p2
+            blockade.net.partition_containers_ipset(blockade_id,
+                                                    [[c1], [c2, c3]])
+
+            # no chains were touched
+            self.assertEqual(mock_subprocess.check_output.call_count, 1)
+
+        self.assertEqual(inputs, [("ipset", "\n".join([
+            "add blockade-e5dcf85cd2-p2 172.17.0.164",
+            "del blockade-e5dcf85cd2-p1 172.17.0.164",
+            ""]))])
+
+    def test_partition_containers_ipset_join(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            inputs = _fake_commands(mock_subprocess,
+                                    {"ipset": _IPSET_SAVE_1,
+                                     "iptables-save": _IPTABLES_SAVE_IPSET_1})
+            blockade.net.partition_containers_ipset(blockade_id, [])
+
+        self.assertEqual([cmd for cmd, _ in inputs],
+                         ["iptables-restore", "ipset"])
+        self.assertEqual(inputs[0][1].split("\n"), [
+            "*filter",
+            "-D FORWARD -m set --match-set blockade-e5dcf85cd2-p2 src "
+            "-j blockade-e5dcf85cd2-p2",
+            "-D FORWARD -m set --match-set blockade-e5dcf85cd2-p1 src "
+            "-j blockade-e5dcf85cd2-p1",
+            "-F blockade-e5dcf85cd2-p1",
+            "-X blockade-e5dcf85cd2-p1",
+            "-F blockade-e5dcf85cd2-p2",
+            "-X blockade-e5dcf85cd2-p2",
+            "COMMIT",
+            ""])
+        self.assertEqual(inputs[1][1].split("\n"), [
+            "destroy blockade-e5dcf85cd2-all",
+            "destroy blockade-e5dcf85cd2-p1",
+            "destroy blockade-e5dcf85cd2-p2",
+            ""])
+
+    def test_partition_containers_ipset_lock_retry(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            _fake_commands(mock_subprocess,
+                           {"ipset": _IPSET_SAVE_1,
+                            "iptables-save": _IPTABLES_SAVE_IPSET_1})
+            mock_process = mock_subprocess.Popen.return_value
+            commands = []
+
+            # something else held the lock for the first iptables-restore
+            def popen(cmd, **kwargs):
+                commands.append(cmd[0])
+                if commands == ["iptables-restore"]:
+                    mock_process.communicate.side_effect = lambda data: (
+                        b"", b"Another app is currently holding the xtables "
+                        b"lock. Perhaps you want to use the -w option?")
+                    mock_process.returncode = 4
+                else:
+                    mock_process.communicate.side_effect = \
+                        lambda data: (b"", b"")
+                    mock_process.returncode = 0
+                return mock_process
+            mock_subprocess.Popen.side_effect = popen
+
+            with mock.patch('blockade.net.time.sleep') as mock_sleep:
+                blockade.net.partition_containers_ipset(blockade_id, [])
+
+            # the rules were read again for the second attempt
+            self.assertEqual(commands,
+                             ["iptables-restore", "iptables-restore", "ipset"])
+            self.assertEqual(
+                [cmd[0] for (cmd,), _ in
+                 mock_subprocess.check_output.call_args_list],
+                ["ipset", "iptables-save", "iptables-save"])
+            self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_ipset_clear(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            inputs = _fake_commands(mock_subprocess,
+                                    {"ipset": _IPSET_SAVE_1,
+                                     "iptables-save": _IPTABLES_SAVE_IPSET_1})
+            blockade.net.IpsetFirewall().clear(blockade_id)
+
+        self.assertEqual([cmd for cmd, _ in inputs],
+                         ["iptables-restore", "ipset"])
+
+    def test_iptables_clear_leaves_ipsets(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            inputs = _fake_commands(mock_subprocess,
+                                    {"iptables-save": _IPTABLES_SAVE_1})
+            blockade.net.IptablesFirewall().clear(blockade_id)
+
+            self.assertEqual([cmd for cmd, _ in inputs], ["iptables-restore"])
+            self.assertEqual(mock_subprocess.check_output.call_count, 1)
+
+    def test_ipset_missing(self):
+        blockade_id = "blockade-e5dcf85cd2"
+        with mock.patch('blockade.net.subprocess') as mock_subprocess:
+            mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+            mock_subprocess.check_output.side_effect = OSError(
+                2, "No such file or directory")
+            mock_subprocess.Popen.side_effect = OSError(
+                2, "No such file or directory")
+
+            with self.assertRaisesRegexp(BlockadeError, "needs the ipset"):
+                blockade.net.ipset_get_ip_partitions(blockade_id)
+            with self.assertRaisesRegexp(BlockadeError, "needs the ipset"):
+                blockade.net.ipset_restore(["destroy unused"])
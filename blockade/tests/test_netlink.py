@@ -0,0 +1,226 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import errno
+import struct
+
+import mock
+
+from blockade.tests import unittest
+import blockade.netlink
+from blockade.errors import NetlinkError, UnsupportedNetemError
+from blockade.net import NetworkState, BlockadeNetwork, TrafficControl
+from blockade.netlink import NetlinkTrafficControl, encode_netem_options, \
+    parse_qdisc_message, qdisc_network_state, nlmsg, rtattr, \
+    parse_nlmsgs, parse_time, parse_percent
+
+
+def _qdisc_message(seq, ifindex, kind, options=b"", parent=0xFFFFFFFF):
+    body = struct.pack("=BxxxiIII", 0, ifindex, 0x80110000, parent, 1)
+    body += rtattr(blockade.netlink.TCA_KIND, kind + b"\0")
+    if options:
+        body += rtattr(blockade.netlink.TCA_OPTIONS, options)
+    return nlmsg(blockade.netlink.RTM_NEWQDISC, 2, seq, body)
+
+
+def _ack(seq, err=0):
+    return nlmsg(blockade.netlink.NLMSG_ERROR, 0, seq,
+                 struct.pack("=i", -err) + b"\0" * 16)
+
+
+class FakeSocket(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def recv(self, size):
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+class NetlinkTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('blockade.netlink.ticks_per_usec')
+        self.addCleanup(patcher.stop)
+        patcher.start().return_value = 15.625
+
+    def test_parse_time(self):
+        self.assertEqual(parse_time("75ms"), 75000)
+        self.assertEqual(parse_time("2s"), 2000000)
+        self.assertEqual(parse_time("100"), 100)
+        self.assertEqual(parse_time("10usec"), 10)
+        with self.assertRaises(UnsupportedNetemError):
+            parse_time("fast")
+
+    def test_parse_percent(self):
+        self.assertEqual(parse_percent("100%"), 0xFFFFFFFF)
+        self.assertEqual(parse_percent("0%"), 0)
+        self.assertEqual(parse_percent("50"), 0x80000000)
+        with self.assertRaises(UnsupportedNetemError):
+            parse_percent("lots")
+
+    def test_encode_delay(self):
+        options = encode_netem_options(["delay", "75ms", "100ms", "25%"])
+        qopt = struct.unpack_from("=IIIIII", options)
+        self.assertEqual(qopt, (75000 * 15.625, 1000, 0, 0, 0,
+                                100000 * 15.625))
+        corr = blockade.netlink.parse_rtattrs(options[24:])
+        self.assertEqual(
+            struct.unpack("=III", corr[blockade.netlink.TCA_NETEM_CORR]),
+            (parse_percent("25%"), 0, 0))
+
+    def test_encode_loss(self):
+        options = encode_netem_options(["loss", "random", "30%"])
+        qopt = struct.unpack_from("=IIIIII", options)
+        self.assertEqual(qopt, (0, 1000, parse_percent("30%"), 0, 0, 0))
+
+    def test_encode_distribution(self):
+        with mock.patch('blockade.netlink.load_distribution') as mock_load:
+            mock_load.return_value = struct.pack("=3h", -1, 0, 1)
+            options = encode_netem_options(
+                ["delay", "75ms", "100ms", "distribution", "normal"])
+            mock_load.assert_called_once_with("normal")
+        attrs = blockade.netlink.parse_rtattrs(options[24:])
+        self.assertEqual(attrs[blockade.netlink.TCA_NETEM_DELAY_DIST],
+                         struct.pack("=3h", -1, 0, 1))
+
+    def test_encode_unsupported(self):
+        with self.assertRaises(UnsupportedNetemError):
+            encode_netem_options(["reorder", "25%"])
+        with self.assertRaises(UnsupportedNetemError):
+            encode_netem_options(["delay", "75ms", "distribution", "normal"])
+
+    def test_qdisc_network_state(self):
+        slow = encode_netem_options(["delay", "75ms"])
+        flaky = encode_netem_options(["loss", "30%"])
+        self.assertEqual(qdisc_network_state("netem", slow),
+                         NetworkState.SLOW)
+        self.assertEqual(qdisc_network_state("netem", flaky),
+                         NetworkState.FLAKY)
+        self.assertEqual(qdisc_network_state("pfifo_fast", b""),
+                         NetworkState.NORMAL)
+
+    def test_parse_qdisc_message(self):
+        options = encode_netem_options(["loss", "30%"])
+        messages = parse_nlmsgs(_qdisc_message(1, 7, b"netem", options) +
+                                _qdisc_message(1, 8, b"noqueue"))
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(parse_qdisc_message(messages[0][2]),
+                         (7, 0xFFFFFFFF, "netem", options))
+        self.assertEqual(parse_qdisc_message(messages[1][2]),
+                         (8, 0xFFFFFFFF, "noqueue", b""))
+
+    def test_netem(self):
+        sock = FakeSocket(_ack(1))
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            mock_open.return_value = sock
+            with mock.patch('blockade.netlink.device_index') as mock_index:
+                mock_index.return_value = 7
+                NetlinkTrafficControl().netem("veth1", ["loss", "30%"])
+
+        (msg_type, seq, body), = parse_nlmsgs(sock.sent[0])
+        self.assertEqual(msg_type, blockade.netlink.RTM_NEWQDISC)
+        self.assertEqual(parse_qdisc_message(body),
+                         (7, 0xFFFFFFFF, "netem",
+                          encode_netem_options(["loss", "30%"])))
+
+    def test_netem_devices(self):
+        sock = FakeSocket(_ack(1), _ack(2), _ack(3))
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            mock_open.return_value = sock
+            with mock.patch('blockade.netlink.device_index') as mock_index:
+                mock_index.side_effect = [7, 8, 9]
+                with mock.patch('blockade.netlink.encode_netem_options',
+                                wraps=encode_netem_options) as mock_encode:
+                    NetlinkTrafficControl().netem_devices(
+                        ["veth1", "veth2", "veth3"], ["loss", "30%"])
+
+        # the options are encoded once for all three devices
+        self.assertEqual(mock_encode.call_count, 1)
+        self.assertEqual(
+            [parse_qdisc_message(parse_nlmsgs(data)[0][2])[0]
+             for data in sock.sent], [7, 8, 9])
+
+    def test_netem_error(self):
+        sock = FakeSocket(_ack(1, errno.EPERM))
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            mock_open.return_value = sock
+            with mock.patch('blockade.netlink.device_index') as mock_index:
+                mock_index.return_value = 7
+                with self.assertRaises(NetlinkError):
+                    NetlinkTrafficControl().netem("veth1", ["loss", "30%"])
+
+    def test_netem_fallback(self):
+        fallback = mock.Mock()
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            NetlinkTrafficControl(fallback).netem("veth1", ["reorder", "5%"])
+            self.assertFalse(mock_open.called)
+        fallback.netem.assert_called_once_with("veth1", ["reorder", "5%"])
+
+    def test_netem_devices_fallback(self):
+        fallback = mock.Mock()
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            NetlinkTrafficControl(fallback).netem_devices(
+                ["veth1", "veth2"], ["reorder", "5%"])
+            self.assertFalse(mock_open.called)
+        fallback.netem_devices.assert_called_once_with(
+            ["veth1", "veth2"], ["reorder", "5%"])
+
+    def test_restore_already_normal(self):
+        sock = FakeSocket(_ack(1, errno.ENOENT))
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            mock_open.return_value = sock
+            with mock.patch('blockade.netlink.device_index') as mock_index:
+                mock_index.return_value = 7
+                # ensure we don't raise an error
+                NetlinkTrafficControl().restore("veth1")
+
+        (msg_type, _, _), = parse_nlmsgs(sock.sent[0])
+        self.assertEqual(msg_type, blockade.netlink.RTM_DELQDISC)
+
+    def test_network_states(self):
+        slow = encode_netem_options(["delay", "75ms"])
+        flaky = encode_netem_options(["loss", "30%"])
+        sock = FakeSocket(
+            _qdisc_message(1, 1, b"noqueue") + _qdisc_message(1, 7, b"netem",
+                                                              slow),
+            _qdisc_message(1, 8, b"netem", flaky) +
+            _qdisc_message(1, 8, b"ingress", parent=0xFFFFFFF1) +
+            nlmsg(blockade.netlink.NLMSG_DONE, 2, 1, b"\0" * 4))
+        with mock.patch('blockade.netlink._open_socket') as mock_open:
+            mock_open.return_value = sock
+            with mock.patch('blockade.netlink.device_names') as mock_names:
+                mock_names.return_value = {1: "lo", 7: "veth1", 8: "veth2"}
+                states = NetlinkTrafficControl().network_states()
+
+        self.assertEqual(states, {"lo": NetworkState.NORMAL,
+                                  "veth1": NetworkState.SLOW,
+                                  "veth2": NetworkState.FLAKY})
+
+    def test_backend_selection(self):
+        config = mock.Mock(network={"traffic_control": "netlink"})
+        net = BlockadeNetwork(config)
+        self.assertIsInstance(net.traffic_control, NetlinkTrafficControl)
+        self.assertIsInstance(net.traffic_control.fallback, TrafficControl)
+
+        net = BlockadeNetwork(mock.Mock(network={}))
+        self.assertIsInstance(net.traffic_control, TrafficControl)
@@ -0,0 +1,167 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mock
+
+from blockade.tests import unittest
+from blockade.errors import BlockadeError
+from blockade.net import BlockadeNetwork
+from blockade.nftables import NftablesFirewall, nft_partition_ruleset, \
+    parse_ip_partitions
+
+_NFT_LIST_1 = b"""table ip blockade-e5dcf85cd2 {
+	set p1 {
+		type ipv4_addr
+		elements = { 172.17.0.162, 172.17.0.164 }
+	}
+
+	set p2 {
+		type ipv4_addr
+		elements = { 172.17.0.163 }
+	}
+
+	set p3 {
+		type ipv4_addr
+	}
+
+	set members {
+		type ipv4_addr
+		elements = { 172.17.0.162, 172.17.0.163,
+			     172.17.0.164 }
+	}
+
+	map partitions {
+		type ipv4_addr : verdict
+		elements = { 172.17.0.162 : jump p1, 172.17.0.164 : jump p1,
+			     172.17.0.163 : jump p2 }
+	}
+}
+"""
+
+
+class NftablesTests(unittest.TestCase):
+
+    def _containers(self, *ips):
+        return [mock.Mock(ip_address=ip) for ip in ips]
+
+    def test_partition_ruleset(self):
+        c1, c2, c3 = self._containers("172.17.0.2", "172.17.0.3",
+                                      "172.17.0.4")
+        lines = nft_partition_ruleset("blockade-abc", [[c1, c2], [c3]])
+        self.assertEqual(lines, [
+            "table ip blockade-abc",
+            "delete table ip blockade-abc",
+            "table ip blockade-abc {",
+            "    set p1 {",
+            "        type ipv4_addr",
+            "        elements = { 172.17.0.2, 172.17.0.3 }",
+            "    }",
+            "    set p2 {",
+            "        type ipv4_addr",
+            "        elements = { 172.17.0.4 }",
+            "    }",
+            "    set members {",
+            "        type ipv4_addr",
+            "        elements = { 172.17.0.2, 172.17.0.3, 172.17.0.4 }",
+            "    }",
+            "    chain p1 {",
+            "        ip daddr @p1 return",
+            "        ip daddr @members drop",
+            "    }",
+            "    chain p2 {",
+            "        ip daddr @p2 return",
+            "        ip daddr @members drop",
+            "    }",
+            "    map partitions {",
+            "        type ipv4_addr : verdict",
+            "        elements = { 172.17.0.2 : jump p1, "
+            "172.17.0.3 : jump p1, 172.17.0.4 : jump p2 }",
+            "    }",
+            "    chain forward {",
+            "        type filter hook forward priority 0; policy accept;",
+            "        ip saddr vmap @partitions",
+            "    }",
+            "}"])
+
+    def test_partition_ruleset_single(self):
+        c1, c2 = self._containers("172.17.0.2", "172.17.0.3")
+        lines = nft_partition_ruleset("blockade-abc", [[c1, c2]])
+        self.assertEqual(lines, ["table ip blockade-abc",
+                                 "delete table ip blockade-abc"])
+
+    def test_partition_ruleset_missing_ip(self):
+        c1, c2 = self._containers("172.17.0.2", None)
+        lines = nft_partition_ruleset("blockade-abc", [[c1], [c2]])
+        self.assertNotIn("None", "\n".join(lines))
+        self.assertEqual(lines[7:10], ["    set p2 {",
+                                       "        type ipv4_addr",
+                                       "    }"])
+
+    def test_parse_ip_partitions(self):
+        self.assertEqual(parse_ip_partitions(_NFT_LIST_1.decode()),
+                         {"172.17.0.162": 1, "172.17.0.164": 1,
+                          "172.17.0.163": 2})
+
+    def test_partition(self):
+        c1, c2 = self._containers("172.17.0.2", "172.17.0.3")
+        with mock.patch('blockade.nftables.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = b"", b""
+            mock_process.returncode = 0
+
+            NftablesFirewall().partition("blockade-abc", [[c1], [c2]])
+
+            self.assertEqual(mock_subprocess.Popen.call_count, 1)
+            self.assertEqual(mock_subprocess.Popen.call_args[0][0],
+                             ["nft", "-f", "-"])
+            script = mock_process.communicate.call_args[0][0].decode()
+            self.assertTrue(script.startswith(
+                "table ip blockade-abc\ndelete table ip blockade-abc\n"))
+
+    def test_partition_failure(self):
+        c1, c2 = self._containers("172.17.0.2", "172.17.0.3")
+        with mock.patch('blockade.nftables.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = b"", b"Error: syntax"
+            mock_process.returncode = 1
+
+            with self.assertRaisesRegexp(BlockadeError, "syntax"):
+                NftablesFirewall().partition("blockade-abc", [[c1], [c2]])
+
+    def test_get_ip_partitions(self):
+        with mock.patch('blockade.nftables.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = _NFT_LIST_1, b""
+            mock_process.returncode = 0
+
+            result = NftablesFirewall().get_ip_partitions(
+                "blockade-e5dcf85cd2")
+            self.assertEqual(result, {"172.17.0.162": 1, "172.17.0.164": 1,
+                                      "172.17.0.163": 2})
+
+    def test_get_ip_partitions_no_table(self):
+        with mock.patch('blockade.nftables.subprocess') as mock_subprocess:
+            mock_process = mock_subprocess.Popen.return_value
+            mock_process.communicate.return_value = (
+                b"", b"Error: No such file or directory")
+            mock_process.returncode = 1
+
+            result = NftablesFirewall().get_ip_partitions("blockade-abc")
+            self.assertEqual(result, {})
+
+    def test_backend_selection(self):
+        net = BlockadeNetwork(mock.Mock(network={"firewall": "nftables"}))
+        self.assertIsInstance(net.firewall, NftablesFirewall)
@@ -0,0 +1,139 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import mock
+
+from blockade.tests import unittest
+from blockade.errors import BlockadeError, ScenarioError
+from blockade.config import BlockadeConfig
+from blockade.core import Container, ContainerState
+from blockade.scenario import Scenario
+
+
+class FakeClock(object):
+    """Clock which ticks a little on every read, and oversleeps"""
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        self.now += 0.0001
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds + 0.001
+
+
+class ScenarioTests(unittest.TestCase):
+
+    def setUp(self):
+        self.config = BlockadeConfig.from_dict(dict(containers={
+            "c1": {"image": "image"},
+            "db": {"image": "image", "count": 2}}))
+        self.clock = FakeClock()
+        self.containers = [Container(name, name + "-id", ContainerState.UP)
+                           for name in ("c1", "db-1", "db-2")]
+        self.state = mock.Mock()
+        self.blockade = mock.Mock()
+        self.blockade.config = self.config
+        self.blockade.state_factory.load.return_value = self.state
+        self.blockade._get_running_containers.return_value = self.containers
+
+    def test_parse(self):
+        scenario = Scenario.from_dict(dict(steps=[
+            dict(at=2, join=None),
+            dict(at=0.5, partition=["c1", ["db-1", "db-2"]]),
+            dict(at=1, slow="c1, group:db"),
+            dict(at=1, flaky="all"),
+        ]))
+        self.assertEqual([s.to_dict() for s in scenario.steps], [
+            dict(at=0.5, action="partition",
+                 containers=[["c1"], ["db-1", "db-2"]]),
+            dict(at=1.0, action="slow", containers=["c1", "group:db"]),
+            dict(at=1.0, action="flaky", containers=None),
+            dict(at=2.0, action="join", containers=None)])
+
+    def test_parse_invalid(self):
+        for d in (None, dict(steps=[]),
+                  dict(steps=[dict(at=1)]),
+                  dict(steps=[dict(at=1, slow="c1", fast="c1")]),
+                  dict(steps=[dict(at=-1, join=None)]),
+                  dict(steps=[dict(at="soon", join=None)]),
+                  dict(steps=[dict(partition="c1")]),
+                  dict(steps=[dict(slow="")])):
+            with self.assertRaises(ScenarioError):
+                Scenario.from_dict(d)
+
+    def test_run(self):
+        def slow(state, containers):
+            self.clock.now += 0.25
+        self.blockade._apply_slow.side_effect = slow
+
+        scenario = Scenario.from_dict(dict(steps=[
+            dict(at=0, partition=["c1"]),
+            dict(at=0.1, slow=["db-*"]),
+            dict(at=0.2, fast="all"),
+            dict(at=1, join=None)]))
+        results = scenario.run(self.blockade, self.clock, self.clock.sleep)
+
+        # containers are looked up once, not for each step
+        self.blockade._get_running_containers.assert_called_once_with(
+            state=self.state)
+        self.blockade._apply_partition.assert_called_once_with(
+            self.state, self.containers, [["c1"]])
+        self.blockade._apply_slow.assert_called_once_with(
+            self.state, self.containers[1:])
+        self.blockade._apply_fast.assert_called_once_with(
+            self.state, self.containers)
+        self.blockade._apply_join.assert_called_once_with(self.state)
+        for method in ("partition", "slow", "fast", "join", "status"):
+            self.assertFalse(getattr(self.blockade, method).called)
+
+        results = [r.to_dict() for r in results]
+        self.assertEqual([r['action'] for r in results],
+                         ["partition", "slow", "fast", "join"])
+        for r in results:
+            if r['action'] not in ("slow", "fast"):
+                self.assertTrue(0 <= r['lag'] < 0.001, r)
+        # the lag is taken once the fault is in place, so it includes the
+        # time slow took, and the time that held fast up
+        self.assertAlmostEqual(results[1]['lag'], 0.25, places=2)
+        self.assertAlmostEqual(results[1]['seconds'], 0.25, places=2)
+        self.assertAlmostEqual(results[2]['lag'], 0.15, places=2)
+
+    def test_run_validates_first(self):
+        scenario = Scenario.from_dict(dict(steps=[
+            dict(at=0, join=None), dict(at=5, slow="c2")]))
+        with self.assertRaises(BlockadeError):
+            scenario.run(self.blockade, self.clock, self.clock.sleep)
+        self.assertFalse(self.blockade._apply_join.called)
+
+    def test_run_not_running(self):
+        self.blockade._get_running_containers.return_value = \
+            self.containers[1:]
+        for step in (dict(at=3, flaky="c1"), dict(at=3, partition=["c1"])):
+            scenario = Scenario.from_dict(dict(steps=[
+                dict(at=0, join=None), step]))
+            with self.assertRaisesRegexp(ScenarioError, "at 3.0s failed"):
+                scenario.run(self.blockade, self.clock, self.clock.sleep)
+        # checked before the first step
+        self.assertFalse(self.blockade._apply_join.called)
+
+    def test_run_step_failure(self):
+        self.blockade._apply_flaky.side_effect = BlockadeError("tc failed")
+        scenario = Scenario.from_dict(dict(steps=[dict(at=3, flaky="c1")]))
+        with self.assertRaisesRegexp(ScenarioError,
+                                     "flaky at 3.0s failed: tc failed"):
+            scenario.run(self.blockade, self.clock, self.clock.sleep)
@@ -17,10 +17,16 @@
 import os
 import shutil
 import tempfile
+import sqlite3
+import threading
+
+import mock
 
 from blockade.tests import unittest
-from blockade.state import BlockadeStateFactory
-from blockade.errors import NotInitializedError
+from blockade.state import BlockadeStateFactory, BlockadeDatabaseState, \
+    _write_transaction
+from blockade.errors import NotInitializedError, AlreadyInitializedError, \
+    InconsistentStateError
 
 
 class BlockadeStateTests(unittest.TestCase):
@@ -46,7 +52,7 @@ class BlockadeStateTests(unittest.TestCase):
         containers = {"n1": {"a": 1}, "n2": {"a": 4}}
         state = BlockadeStateFactory.initialize(containers=containers)
 
-        self.assertTrue(os.path.exists(".blockade/state.yml"))
+        self.assertTrue(os.path.exists(".blockade/state.db"))
 
         self.assertEqual(state.containers, containers)
         self.assertIsNot(state.containers, containers)
@@ -61,9 +67,119 @@ class BlockadeStateTests(unittest.TestCase):
         self.assertEqual(state2.blockade_id, state.blockade_id)
 
         BlockadeStateFactory.destroy()
-        self.assertFalse(os.path.exists(".blockade/state.yml"))
+        self.assertFalse(os.path.exists(".blockade/state.db"))
         self.assertFalse(os.path.exists(".blockade"))
 
     def test_state_uninitialized(self):
         with self.assertRaises(NotInitializedError):
             BlockadeStateFactory.load()
+
+    def test_state_already_initialized(self):
+        BlockadeStateFactory.initialize(containers={"n1": {}})
+        with self.assertRaises(AlreadyInitializedError):
+            BlockadeStateFactory.initialize(containers={"n1": {}})
+        self.assertEqual(os.listdir(".blockade"), ["state.db"])
+
+    def test_state_container(self):
+        containers = {"n1": {"veth_device": "veth1"},
+                      "n2": {"veth_device": "veth2", "a": [1, 2]}}
+        BlockadeStateFactory.initialize(containers=containers)
+        state = BlockadeStateFactory.load()
+        self.assertIsInstance(state, BlockadeDatabaseState)
+
+        self.assertEqual(state.container("n2"), containers["n2"])
+        self.assertIsNone(state.container("n3"))
+
+        state.update_containers({"n2": {"container_id": "abc",
+                                        "ip_address": "10.0.0.2"},
+                                 "n3": {"veth_device": "veth3"}})
+        state = BlockadeStateFactory.load()
+        self.assertEqual(state.container("n2"),
+                         {"veth_device": "veth2", "a": [1, 2],
+                          "container_id": "abc", "ip_address": "10.0.0.2"})
+        self.assertEqual(state.container("n3"), {"veth_device": "veth3"})
+        self.assertEqual(len(state.containers), 3)
+
+    def test_state_partitions_and_netem(self):
+        state = BlockadeStateFactory.initialize(
+            containers={"n1": {}, "n2": {}, "n3": {}})
+        self.assertEqual(state.partitions, {})
+        self.assertEqual(state.netem, {})
+
+        state.set_partitions({"n1": 1, "n2": 2, "n3": 2})
+        state.set_netem(["n1", "n2"], ["loss", "30%"])
+        state.set_netem(["n2"], ["delay", "75ms"])
+
+        state = BlockadeStateFactory.load()
+        self.assertEqual(state.partitions, {"n1": 1, "n2": 2, "n3": 2})
+        self.assertEqual(state.netem, {"n1": ["loss", "30%"],
+                                       "n2": ["delay", "75ms"]})
+
+        state.set_partitions({})
+        state.set_netem(["n1"], None)
+        self.assertEqual(state.partitions, {})
+        self.assertEqual(state.netem, {"n2": ["delay", "75ms"]})
+
+    def test_state_concurrent_writers(self):
+        names = ["n%d" % i for i in range(20)]
+        BlockadeStateFactory.initialize(
+            containers=dict((name, {}) for name in names))
+
+        def write(name):
+            # each writer loads its own state, as separate commands would
+            state = BlockadeStateFactory.load()
+            state.update_containers({name: {"container_id": name}})
+            state.set_netem([name], ["loss", "1%"])
+
+        threads = [threading.Thread(target=write, args=(name,))
+                   for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        state = BlockadeStateFactory.load()
+        for name in names:
+            self.assertEqual(state.container(name), {"container_id": name})
+        self.assertEqual(sorted(state.netem), sorted(names))
+
+    def test_state_version(self):
+        BlockadeStateFactory.initialize(containers={"n1": {}})
+        db = sqlite3.connect(".blockade/state.db")
+        db.execute("UPDATE blockade SET version = 3")
+        db.commit()
+        db.close()
+
+        with self.assertRaisesRegexp(InconsistentStateError, "version 3"):
+            BlockadeStateFactory.load()
+
+    def test_state_commit_failure(self):
+        def execute(statement, *args):
+            if statement == "COMMIT":
+                raise sqlite3.OperationalError("disk I/O error")
+        db = mock.Mock(in_transaction=True)
+        db.execute.side_effect = execute
+
+        with self.assertRaises(sqlite3.OperationalError):
+            with _write_transaction(db):
+                pass
+        self.assertEqual([c[0][0] for c in db.execute.call_args_list],
+                         ["BEGIN IMMEDIATE", "COMMIT", "ROLLBACK"])
+
+    def test_state_legacy(self):
+        os.mkdir(".blockade")
+        with open(".blockade/state.yml", "w") as f:
+            f.write("blockade_id: blockade-abc\n"
+                    "containers:\n"
+                    "  n1: {veth_device: veth1}\n"
+                    "version: 1\n")
+
+        state = BlockadeStateFactory.load()
+        self.assertEqual(state.blockade_id, "blockade-abc")
+        self.assertEqual(state.container("n1"), {"veth_device": "veth1"})
+
+        with self.assertRaises(AlreadyInitializedError):
+            BlockadeStateFactory.initialize(containers={"n1": {}})
+
+        BlockadeStateFactory.destroy()
+        self.assertFalse(os.path.exists(".blockade"))
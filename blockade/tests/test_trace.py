@@ -0,0 +1,110 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import subprocess
+import sys
+
+import mock
+
+from blockade.tests import unittest
+from blockade import trace
+
+
+class TraceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tracer = trace.start_tracing()
+        self.addCleanup(trace.stop_tracing)
+
+    def test_span(self):
+        with trace.phase("load config"):
+            pass
+        with self.assertRaises(ValueError):
+            with trace.span("docker", "inspect_container", args=["abc"]):
+                raise ValueError("no such container")
+
+        events = self.tracer.events
+        self.assertEqual([(e['cat'], e['name'], e['status'])
+                          for e in events],
+                         [("phase", "load config", "ok"),
+                          ("docker", "inspect_container",
+                           "error: no such container")])
+        self.assertEqual(events[1]['args'], {"args": ["abc"]})
+        self.assertTrue(events[1]['start'] >= events[0]['start'])
+
+    def test_not_tracing(self):
+        trace.stop_tracing()
+        with trace.phase("load config"):
+            pass
+        client = object()
+        self.assertTrue(trace.traced(client, "docker") is client)
+        self.assertTrue(subprocess.Popen is trace._Popen)
+
+    def test_commands(self):
+        subprocess.check_call([sys.executable, "-c", "pass"])
+        p = subprocess.Popen([sys.executable, "-c", "exit(3)"])
+        p.communicate()
+        with self.assertRaises(OSError):
+            subprocess.Popen(["blockade-no-such-command"])
+
+        events = self.tracer.events
+        self.assertEqual([e['cat'] for e in events], ["command"] * 3)
+        self.assertEqual([e['status'] for e in events][:2], [0, 3])
+        self.assertEqual(events[0]['args']['argv'],
+                         [sys.executable, "-c", "pass"])
+        self.assertTrue(events[2]['status'].startswith("error:"))
+
+    def test_traced(self):
+        client = mock.Mock()
+        client.inspect_container.return_value = {"Id": "abc"}
+        traced = trace.traced(client, "docker")
+        self.assertEqual(traced.inspect_container("abc", size=False),
+                         {"Id": "abc"})
+
+        factory = mock.Mock()
+        traced = trace.traced(factory, "phase", {"load": "load state"})
+        traced.load()
+        traced.destroy()
+
+        self.assertEqual([(e['cat'], e['name'], e['args'])
+                          for e in self.tracer.events],
+                         [("docker", "inspect_container",
+                           {"args": ["abc"], "kwargs": {"size": "False"}}),
+                          ("phase", "load state", {})])
+        self.assertTrue(factory.destroy.called)
+
+    def test_formats(self):
+        with trace.phase("inspect"):
+            with trace.span("docker", "containers"):
+                pass
+
+        lines = []
+        self.tracer.write_json_lines(mock.Mock(write=lines.append))
+        self.assertEqual([json.loads(l)['name'] for l in lines],
+                         ["containers", "inspect"])
+
+        chunks = []
+        self.tracer.write_chrome_trace(mock.Mock(write=chunks.append))
+        events = json.loads("".join(chunks))['traceEvents']
+        spans = [e for e in events if e['ph'] == "X"]
+        self.assertEqual([(e['name'], e['cat']) for e in spans],
+                         [("containers", "docker"), ("inspect", "phase")])
+        self.assertTrue(spans[1]['ts'] <= spans[0]['ts'])
+        self.assertTrue(spans[1]['dur'] >= spans[0]['dur'])
+        self.assertEqual(spans[0]['args'], {"status": "ok"})
+        self.assertEqual([e['args'] for e in events if e['ph'] == "M"],
+                         [{"name": "MainThread"}])
@@ -0,0 +1,106 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+
+import mock
+
+from blockade.tests import unittest
+from blockade.core import Blockade, ContainerState
+from blockade.config import BlockadeConfig, BlockadeContainerConfig
+from blockade.state import BlockadeState
+from blockade.watch import BlockadeWatcher
+
+
+class BlockadeWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        config = BlockadeConfig([BlockadeContainerConfig("c1", "image"),
+                                 BlockadeContainerConfig("c2", "image")])
+        self.state_factory = mock.Mock()
+        self.state_factory.load.return_value = BlockadeState(
+            "ourblockadeid", {"c1": {"veth_device": "veth1"},
+                              "c2": {"veth_device": "veth2"}})
+        self.docker_client = mock.Mock()
+        self.docker_client.containers.return_value = [
+            {"Id": "abc", "Names": ["/ourblockadeid-c1"], "Status": "Up 1s"},
+            {"Id": "def", "Names": ["/ourblockadeid-c2"], "Status": "Up 1s"}]
+        self.docker_client.inspect_container.return_value = {
+            "State": {"Running": True},
+            "NetworkSettings": {"IPAddress": "10.0.0.1"}}
+        self.network = mock.Mock()
+        self.network.get_ip_partitions.return_value = {}
+        self.network.network_states.return_value = {}
+        self.network.network_state.return_value = "NORMAL"
+        self.blockade = Blockade(config, self.state_factory, self.network,
+                                 self.docker_client)
+
+    def test_watch(self):
+        self.docker_client.events.return_value = [
+            {"status": "die", "id": "abc", "time": 10},
+            # not one of ours
+            {"status": "die", "id": "xyz", "time": 11},
+            # not a status change
+            {"status": "attach", "id": "def", "time": 12},
+            json.dumps({"status": "start", "id": "abc", "time": 13}),
+            {"Action": "destroy", "time": 14,
+             "Actor": {"ID": "def", "Attributes": {}}}]
+
+        watcher = BlockadeWatcher(self.blockade)
+        changes = list(watcher.watch())
+
+        self.assertEqual([(c.name, c.event, c.time) for c in changes],
+                         [("c1", "die", 10), ("c1", "start", 13),
+                          ("c2", "destroy", 14)])
+        self.assertEqual(changes[0].container.state, ContainerState.DOWN)
+        self.assertEqual(changes[1].container.state, ContainerState.UP)
+        self.assertEqual(changes[1].container.ip_address, "10.0.0.1")
+        self.assertEqual(watcher.containers["c1"].state, ContainerState.UP)
+        self.assertEqual(watcher.containers["c2"].state,
+                         ContainerState.MISSING)
+
+        # the full status is only fetched once
+        self.assertEqual(self.docker_client.containers.call_count, 1)
+        kwargs = self.docker_client.events.call_args[1]
+        self.assertEqual(kwargs['filters'],
+                         {"label": ["blockade.id=ourblockadeid"]})
+
+    def test_watch_new_container(self):
+        self.docker_client.events.return_value = [
+            {"Action": "start", "time": 10, "Actor": {
+                "ID": "ghi", "Attributes": {"blockade.id": "ourblockadeid",
+                                            "blockade.name": "c3"}}},
+            {"Action": "start", "time": 11, "Actor": {
+                "ID": "jkl", "Attributes": {"blockade.id": "otherblockade",
+                                            "blockade.name": "c3"}}}]
+
+        watcher = BlockadeWatcher(self.blockade)
+        changes = list(watcher.watch())
+        self.assertEqual([(c.name, c.container.container_id)
+                          for c in changes], [("c3", "ghi")])
+
+    def test_watch_without_filters(self):
+        def events(**kwargs):
+            if kwargs:
+                raise TypeError("unexpected keyword argument 'since'")
+            return [b'{"status": "oom", "id": "def", "time": 10}']
+        self.docker_client.events.side_effect = events
+
+        watcher = BlockadeWatcher(self.blockade)
+        changes = list(watcher.watch())
+        self.assertEqual([(c.name, c.event) for c in changes],
+                         [("c2", "oom")])
+        self.assertEqual(changes[0].container.state, ContainerState.UP)
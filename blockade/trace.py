@@ -0,0 +1,193 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import contextlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+TRACE_FORMATS = ("jsonl", "chrome")
+
+_clock = getattr(time, "perf_counter", time.time)
+_Popen = subprocess.Popen
+
+# the tracer recording this process, if any
+_tracer = None
+
+
+class Tracer(object):
+    """Records how long commands, Docker calls and phases take
+
+    Each event has a category ("command", "docker" or "phase"), a name,
+    arguments, a status, and its start and duration in seconds, the start
+    relative to when tracing began.
+    """
+    def __init__(self):
+        self.start = _clock()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def record(self, category, name, start, end, args=None, status=None):
+        event = dict(cat=category, name=name, start=start - self.start,
+                     duration=end - start, args=args or {}, status=status,
+                     thread=threading.current_thread().name)
+        with self._lock:
+            self.events.append(event)
+
+    def write_json_lines(self, f):
+        for event in self.events:
+            f.write(json.dumps(event, sort_keys=True) + "\n")
+
+    def write_chrome_trace(self, f):
+        """Write the Trace Event format read by chrome://tracing and Perfetto
+        """
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for event in self.events:
+            tid = threads.setdefault(event['thread'], len(threads) + 1)
+            args = dict(event['args'], status=event['status'])
+            events.append(dict(name=event['name'], cat=event['cat'], ph="X",
+                               ts=int(event['start'] * 1e6),
+                               dur=int(event['duration'] * 1e6),
+                               pid=pid, tid=tid, args=args))
+        for name, tid in threads.items():
+            events.append(dict(name="thread_name", ph="M", pid=pid, tid=tid,
+                               args=dict(name=name)))
+        json.dump(dict(traceEvents=events), f)
+
+    def dump(self, path, trace_format="jsonl"):
+        with open(path, "w") as f:
+            if trace_format == "chrome":
+                self.write_chrome_trace(f)
+            else:
+                self.write_json_lines(f)
+
+
+def start_tracing():
+    """Start recording this process, and return the Tracer
+    """
+    global _tracer
+    _tracer = Tracer()
+    subprocess.Popen = _TracedPopen
+    return _tracer
+
+
+def stop_tracing():
+    global _tracer
+    subprocess.Popen = _Popen
+    _tracer = None
+
+
+@contextlib.contextmanager
+def span(category, name, **args):
+    """Record the time spent in a with block, when tracing
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start = _clock()
+    status = "ok"
+    try:
+        yield
+    except Exception as e:
+        status = "error: %s" % (e,)
+        raise
+    finally:
+        tracer.record(category, name, start, _clock(), args, status)
+
+
+def phase(name):
+    return span("phase", name)
+
+
+class _TracedPopen(_Popen):
+    # check_call and check_output go through Popen, and every way of
+    # finishing with a process (wait, communicate, with) ends in wait()
+    def __init__(self, args, *pargs, **kwargs):
+        self._trace_args = [str(a) for a in args] \
+            if isinstance(args, (list, tuple)) else [str(args)]
+        self._trace_start = _clock()
+        self._traced = False
+        try:
+            _Popen.__init__(self, args, *pargs, **kwargs)
+        except OSError as e:
+            tracer = _tracer
+            if tracer:
+                tracer.record("command", self._trace_args[0],
+                              self._trace_start, _clock(),
+                              dict(argv=self._trace_args),
+                              "error: %s" % (e,))
+            raise
+
+    def wait(self, *args, **kwargs):
+        returncode = _Popen.wait(self, *args, **kwargs)
+        tracer = _tracer
+        if tracer and not self._traced:
+            self._traced = True
+            tracer.record("command", self._trace_args[0], self._trace_start,
+                          _clock(), dict(argv=self._trace_args), returncode)
+        return returncode
+
+
+class Traced(object):
+    """Wraps an object so calls to its methods are recorded as events
+
+    names maps the methods to trace to event names; with none, every
+    method is traced under its own name.
+    """
+    def __init__(self, wrapped, category, names=None):
+        self._wrapped = wrapped
+        self._category = category
+        self._names = names
+
+    def __getattr__(self, attr):
+        value = getattr(self._wrapped, attr)
+        if not callable(value):
+            return value
+        if self._names is not None:
+            if attr not in self._names:
+                return value
+            name = self._names[attr]
+        else:
+            name = attr
+
+        def call(*args, **kwargs):
+            details = {}
+            if args:
+                details['args'] = [_brief(a) for a in args]
+            if kwargs:
+                details['kwargs'] = dict((k, _brief(v))
+                                         for k, v in kwargs.items())
+            with span(self._category, name, **details):
+                return value(*args, **kwargs)
+        return call
+
+
+def _brief(value):
+    value = str(value)
+    return value if len(value) <= 80 else value[:77] + "..."
+
+
+def traced(wrapped, category, names=None):
+    """Wrap wrapped in Traced if tracing, or return it as it is
+    """
+    if _tracer is None:
+        return wrapped
+    return Traced(wrapped, category, names)
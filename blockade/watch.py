@@ -0,0 +1,142 @@
+#
+#  Copyright (C) 2014 Dell, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import time
+
+from .core import Container, ContainerState, BLOCKADE_ID_LABEL, \
+    BLOCKADE_NAME_LABEL, _docker_api_error
+from .net import NetworkState
+
+# Docker events which change a container's status
+WATCHED_EVENTS = ("start", "die", "oom", "destroy")
+
+
+class ContainerChange(object):
+    """A Docker event for one of the blockade's containers
+
+    container is the container's status after the event.
+    """
+    def __init__(self, name, event, time, container):
+        self.name = name
+        self.event = event
+        self.time = time
+        self.container = container
+
+    def to_dict(self):
+        return dict(name=self.name, event=self.event, time=self.time,
+                    container=self.container.to_dict())
+
+
+class BlockadeWatcher(object):
+    """Keep a blockade's status table up to date from Docker events
+
+    The table starts from one full status, then each start, die, oom or
+    destroy event updates just the container it is about. Only a start
+    costs anything more: one inspect and one look at the container's
+    network state.
+    """
+    def __init__(self, blockade):
+        self.blockade = blockade
+        self.state = None
+        self.containers = {}
+        self._names = {}
+
+    def refresh(self):
+        """Load the full status of every container into the table
+        """
+        self.state = self.blockade.state_factory.load()
+        containers = self.blockade.status()
+        self.containers = dict((c.name, c) for c in containers)
+        self._names = dict((c.container_id, c.name) for c in containers)
+        return containers
+
+    def watch(self):
+        """Refresh the table, then yield a ContainerChange for each event
+
+        Runs until the Docker event stream ends, which is normally never.
+        """
+        since = int(time.time())
+        self.refresh()
+        for change in self.follow(since):
+            yield change
+
+    def follow(self, since=None):
+        """Yield a ContainerChange for each event after refresh()
+
+        Events since the given time are replayed first, so taking the time
+        before refresh() means nothing that happens during it is missed.
+        """
+        for event in self._docker_events(since):
+            change = self.apply(event)
+            if change:
+                yield change
+
+    def _docker_events(self, since):
+        client = self.blockade.docker_client
+        label_filter = "%s=%s" % (BLOCKADE_ID_LABEL, self.state.blockade_id)
+        try:
+            events = client.events(since=since,
+                                   filters={"label": [label_filter]})
+        except (TypeError, _docker_api_error()):
+            # docker-py or daemon too old to filter, so every event on the
+            # host comes through and apply() drops the ones not ours
+            events = client.events()
+        for event in events:
+            if not isinstance(event, dict):
+                try:
+                    if isinstance(event, bytes):
+                        event = event.decode()
+                    event = json.loads(event)
+                except ValueError:
+                    continue
+            yield event
+
+    def apply(self, event):
+        """Update the table from a Docker event dict
+
+        Returns a ContainerChange, or None if the event isn't about a
+        status change of one of the blockade's containers.
+        """
+        action = event.get('status') or event.get('Action')
+        if action not in WATCHED_EVENTS:
+            return None
+        actor = event.get('Actor') or {}
+        container_id = event.get('id') or actor.get('ID')
+        name = self._names.get(container_id)
+        if name is None:
+            attributes = actor.get('Attributes') or {}
+            if attributes.get(BLOCKADE_ID_LABEL) != self.state.blockade_id:
+                return None
+            name = attributes.get(BLOCKADE_NAME_LABEL)
+            if not name:
+                return None
+            self._names[container_id] = name
+
+        if action == "start":
+            container = self.blockade._get_container_description(
+                self.state, name, container_id)
+        elif action == "oom":
+            # the container may live on; a die event follows if not
+            container = self.containers.get(name) or Container(
+                name, container_id, ContainerState.UP)
+        else:
+            state = (ContainerState.MISSING if action == "destroy"
+                     else ContainerState.DOWN)
+            container = Container(name, container_id, state,
+                                  network_state=NetworkState.UNKNOWN)
+        self.containers[name] = container
+        return ContainerChange(name, action, event.get('time'), container)